@@ -28,6 +28,13 @@ def get_admin_commands() -> list[BotCommand]:
         BotCommand(command="/users", description="Get all users in paginated message."),
         BotCommand(command="/dump", description="Export clients dump as CSV file."),
         BotCommand(command="/syncconfig", description="Syncs config file with WG."),
+        BotCommand(command="/reconcile", description="Compare DB with Wireguard and 3x-ui. Pass 'apply' to fix the drift."),
+        BotCommand(command="/stats", description="Show clients and peers statistics and 3x-ui availability."),
+        BotCommand(command="/traffic", description="Top users by traffic. Arguments: [count] [days], 10 and 30 by default."),
+        BotCommand(
+            command="/quota",
+            description="Set user traffic limit. Arguments: <ID or IP> <GB>, 0 for no limit, 'default' for the global one."
+        ),
         BotCommand(
             command="/listen_clients",
             description="Run listen_clients event independently. "
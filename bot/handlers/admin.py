@@ -1,5 +1,6 @@
 import asyncio
 import datetime
+import html
 import os
 import sys
 import tempfile
@@ -18,12 +19,16 @@ from bot.middlewares.logging_middleware import LoggingMiddleware
 from bot.utils.inline_paginator import UsersInlineKeyboardPaginator
 from bot.utils.message_utils import preview_message
 from bot.utils.states import AddPeerStates, WhisperStates
-from bot.utils.user_helper import get_user_data_string
+from bot.utils.user_helper import get_user_data_string, traffic_string
 from config.loader import (bot_cfg, cfg, connections_observer, db_cfg,
-                           ip_queue, wghub, xray_worker)
-from core.db.db_works import Client, ClientFactory
+                           ip_queue, reconciler, wghub, xray_worker)
+from core.db.async_db import AsyncClient, AsyncClientFactory, db_thread
+from core.db.cache import client_cache
 from core.db.enums import ClientStatusChoices, PeerStatusChoices, ProtocolType
+from core.db.quota import quota_engine
+from core.db.stats import service_stats
 from core.logs import bot_logger
+from core.utils.circuit_breaker import BreakerState
 from core.utils.ip_utils import check_ip_address
 from core.utils.peers_utils import disable_peers, enable_peers
 from export_clients_csv import export_clients_dump
@@ -79,6 +84,13 @@ async def reboot(message: Message) -> None:
     with open(".reboot", "w", encoding="utf-8") as f:
         f.write(str(message.chat.id))
 
+    await xray_worker.close()
+    wghub.stop()
+    db_thread.stop()
+    connections_observer.status_buffer.flush()
+    connections_observer.session_writer.close_all()
+    connections_observer.session_writer.flush()
+    connections_observer.traffic.flush()
     os.execv(sys.executable, ['python'] + sys.argv)
 
 @router.message(Command("broadcast"))
@@ -90,7 +102,7 @@ async def broadcast(message: Message, state: FSMContext):
         return
 
     clients_list = []
-    all_clients = ClientFactory.select_clients()
+    all_clients = await AsyncClientFactory.select_clients()
     msg = message.html_text.split(maxsplit=1)[1]
 
     for client in all_clients:
@@ -101,7 +113,7 @@ async def broadcast(message: Message, state: FSMContext):
     await preview_message(msg, message.chat.id, state, clients_list)
 
 @router.message(Command("whisper"))
-async def whisper(message: Message, client: Client, state: FSMContext):
+async def whisper(message: Message, client: AsyncClient, state: FSMContext):
     args = message.html_text.split()
 
     if len(args) <= 2:
@@ -115,10 +127,10 @@ async def whisper(message: Message, client: Client, state: FSMContext):
     await preview_message(msg, message.chat.id, state, [client.userdata.user_id])
 
 @router.message(Command("ban", "anathem"))
-async def ban(message: Message, client: Client):
-    client.set_status(ClientStatusChoices.STATUS_ACCOUNT_BLOCKED)
-    peers = client.get_all_peers(protocol_specific=True)
-    disable_peers(wghub, xray_worker, peers, client)
+async def ban(message: Message, client: AsyncClient):
+    await client.set_status(ClientStatusChoices.STATUS_ACCOUNT_BLOCKED)
+    peers = await client.get_all_peers(protocol_specific=True)
+    await disable_peers(wghub, xray_worker, peers, client)
 
     await message.answer(
         f"✅ Пользователь <code>{client.userdata.name}:{client.userdata.user_id}</code> заблокирован."
@@ -130,10 +142,11 @@ async def ban(message: Message, client: Client):
     )
 
 @router.message(Command("unban", "mercy", "pardon"))
-async def unban(message: Message, client: Client):
-    client.set_status(ClientStatusChoices.STATUS_CREATED)
-    peers = client.get_all_peers(protocol_specific=True)
-    enable_peers(wghub, xray_worker, peers, client)
+async def unban(message: Message, client: AsyncClient):
+    await client.set_status(ClientStatusChoices.STATUS_CREATED)
+    quota_engine.mark_restored(client.userdata.user_id)
+    peers = await client.get_all_peers(protocol_specific=True)
+    await enable_peers(wghub, xray_worker, peers, client)
     await message.answer(
         f"✅ Пользователь <code>{client.userdata.name}:{client.userdata.user_id}</code> разблокирован."
     )
@@ -142,15 +155,33 @@ async def unban(message: Message, client: Client):
         f"🔓❗ Твой аккаунт был разблокирован. Если у тебя были доступные пиры, они станут доступны в ближайшее время."
     )
 
+@router.message(Command("quota"))
+async def set_quota(message: Message, client: AsyncClient):
+    args = message.text.split()
+    if len(args) != 3 or not (args[2] == "default" or args[2].isdigit()):
+        await message.answer(
+            "❌ Использование: /quota <i>IP или ID</i> <i>лимит в ГБ</i>\n"
+            "0 — без лимита, default — общий лимит сервера."
+        )
+        return
+
+    traffic_limit = None if args[2] == "default" else int(args[2]) * 1024 ** 3
+    await client.set_traffic_limit(traffic_limit)
+    await db_thread.run(quota_engine.set_limit, client.userdata.user_id, traffic_limit)
+    await message.answer(
+        f"✅ Лимит трафика пользователя <code>{client.userdata.name}:{client.userdata.user_id}</code>: "
+        f"{'общий' if traffic_limit is None else f'{args[2]} ГБ'}."
+    )
+
 @router.message(Command("get_user"))
-async def get_user(message: Message, client: Client):
+async def get_user(message: Message, client: AsyncClient):
     await message.answer(f"Пользователь: {client.userdata.name}")
-    user_string = get_user_data_string(client, show_peer_ids=True)
+    user_string = await get_user_data_string(client, show_peer_ids=True)
     await message.answer(user_string[0])
     await message.answer(user_string[1], reply_markup=build_user_actions_keyboard(client))
 
 @router.message(Command("add_peer"))
-async def add_peer(message: Message, client: Client, state: FSMContext):
+async def add_peer(message: Message, client: AsyncClient, state: FSMContext):
     keyboard = build_protocols_keyboard()
     keyboard.inline_keyboard.append(cancel_keyboard().inline_keyboard[0])
 
@@ -171,25 +202,25 @@ async def disable_peer_command(message: Message):
     id_or_ip = message.text.split()[1]
 
     if check_ip_address(id_or_ip):
-        peer = ClientFactory.get_peer_by_ip(id_or_ip)
+        peer = await AsyncClientFactory.get_peer_by_ip(id_or_ip)
     else:
-        peer = ClientFactory.get_peer_by_id(id_or_ip, protocol_specific=True)
+        peer = await AsyncClientFactory.get_peer_by_id(id_or_ip, protocol_specific=True)
 
     if not peer:
         await message.answer("❌ Пир не найден.")
         return
 
-    client = ClientFactory(user_id=peer.user_id).get_client()
+    client = await AsyncClientFactory.get_client(peer.user_id)
     match peer.peer_type:
         case ProtocolType.WIREGUARD | ProtocolType.AMNEZIA_WIREGUARD:
-            wghub.disable_peer(peer)
+            await wghub.disable_peer(peer)
         case ProtocolType.XRAY:
-            xray_worker.disable_peer(peer, expire_time=client.userdata.expire_time)
+            await xray_worker.disable_peer(peer, expire_time=client.userdata.expire_time)
         case _:
             bot_logger.warning(f"Unknown peer type: {peer.peer_type}. Can't disable peer.")
             await message.answer("❌ Неподдерживаемый тип пира. Странно...")
             return
-    client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_BLOCKED)
+    await client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_BLOCKED)
     await message.answer("✅ Пир отключён.")
     await message.bot.send_message(
         client.userdata.user_id,
@@ -208,25 +239,25 @@ async def enable_peer_command(message: Message):
     id_or_ip = message.text.split()[1]
 
     if check_ip_address(id_or_ip):
-        peer = ClientFactory.get_peer_by_ip(id_or_ip)
+        peer = await AsyncClientFactory.get_peer_by_ip(id_or_ip)
     else:
-        peer = ClientFactory.get_peer_by_id(id_or_ip, protocol_specific=True)
+        peer = await AsyncClientFactory.get_peer_by_id(id_or_ip, protocol_specific=True)
 
     if not peer:
         await message.answer("❌ Пир не найден.")
         return
 
-    client = ClientFactory(user_id=peer.user_id).get_client()
+    client = await AsyncClientFactory.get_client(peer.user_id)
     match peer.peer_type:
         case ProtocolType.WIREGUARD | ProtocolType.AMNEZIA_WIREGUARD:
-            wghub.enable_peer(peer)
+            await wghub.enable_peer(peer)
         case ProtocolType.XRAY:
-            xray_worker.enable_peer(peer, expire_time=client.userdata.expire_time)
+            await xray_worker.enable_peer(peer, expire_time=client.userdata.expire_time)
         case _:
             bot_logger.warning(f"Unknown peer type: {peer.peer_type}. Can't enable peer.")
             await message.answer("❌ Неподдерживаемый тип пира. Странно...")
             return
-    client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
+    await client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
     await message.answer("✅ Пир включён.")
     await message.bot.send_message(
         client.userdata.user_id,
@@ -245,17 +276,17 @@ async def delete_peer(message: Message):
         return
     peer_id = splitted_message[1]
 
-    peer = ClientFactory.delete_peer_by_id(int(peer_id), protocol_specific=True)
+    peer = await AsyncClientFactory.delete_peer_by_id(int(peer_id), protocol_specific=True)
 
     if not peer:
         await message.answer("❌ Пир не найден.")
         return
 
     if peer.peer_type in (ProtocolType.WIREGUARD, ProtocolType.AMNEZIA_WIREGUARD):
-        wghub.delete_peer(peer)
+        await wghub.delete_peer(peer)
         ip_queue.release_ip(peer.shared_ips)
     elif peer.peer_type == ProtocolType.XRAY:
-        xray_worker.delete_peer(peer)
+        await xray_worker.delete_peer(peer)
 
     await message.answer("✅ Пир был успешно удалён.")
     with bot_logger.contextualize(peer=peer):
@@ -263,18 +294,134 @@ async def delete_peer(message: Message):
 
 @router.message(Command("syncconfig"))
 async def syncconfig(message: Message):
-    wghub.sync_config()
+    try:
+        await wghub.sync_config()
+    except Exception:
+        # already logged by WGHub
+        await message.answer("❌ Не удалось синхронизировать конфиг Wireguard. Проверь логи ядра.")
+        return
     bot_logger.info(f"Wireguard config was forcefully synchronized by {message.from_user.id}")
     await message.answer("✅ Конфиг Wireguard был синхронизирован с сервером.")
 
+@router.message(Command("reconcile"))
+async def reconcile(message: Message):
+    args = message.text.split()
+    apply = len(args) > 1 and args[1] == "apply"
+
+    try:
+        plan = await reconciler.plan()
+    except Exception as e:
+        bot_logger.exception(f"Couldn't compute reconciliation plan: {e}")
+        await message.answer("❌ Не удалось сверить состояние. Проверь логи ядра.")
+        return
+
+    report = (
+        f"🧭 Расхождения с БД:\n"
+        f"  Конфиг Wireguard: добавить/обновить {len(plan.config_upsert)}, удалить {len(plan.config_remove)}, "
+        f"включить {len(plan.config_enable)}, отключить {len(plan.config_disable)}\n"
+        f"  Интерфейс Wireguard: синхронизировать {len(plan.interface_sync)}\n"
+        f"  3x-ui: добавить {len(plan.xray_add)}, включить {len(plan.xray_enable)}, "
+        f"отключить {len(plan.xray_disable)}, удалить {len(plan.xray_remove)}"
+    )
+    if plan.unavailable:
+        report += f"\n⚠️ Не удалось прочитать: {', '.join(plan.unavailable)}"
+    if plan.is_empty:
+        await message.answer(report + "\n✅ Всё совпадает.")
+        return
+    if not apply:
+        await message.answer(report + "\nЧтобы исправить, отправь <code>/reconcile apply</code>.")
+        return
+
+    try:
+        await reconciler.apply(plan)
+    except Exception as e:
+        bot_logger.exception(f"Couldn't apply reconciliation plan: {e}")
+        await message.answer(report + "\n❌ Не удалось применить исправления. Проверь логи ядра.")
+        return
+    bot_logger.info(f"Reconciliation plan was applied by {message.from_user.id}")
+    await message.answer(report + "\n✅ Исправления применены.")
+
 @router.message(Command("users"))
 async def users(message: Message):
-    all_clients = ClientFactory.select_clients()
+    all_clients = await AsyncClientFactory.select_clients()
     paginator = UsersInlineKeyboardPaginator(all_clients, router)
     msg = await message.answer("Список всех пользователей:", reply_markup=paginator.markup)
     await asyncio.sleep(60)
     await msg.delete()
 
+@router.message(Command("stats"))
+async def stats(message: Message):
+    # counters are kept in memory, so the command never touches the database
+    snapshot = service_stats.snapshot()
+    if snapshot.reconciled_at is None:
+        await message.answer("⚠️ Статистика ещё не загружена.")
+        return
+
+    def lines(counter: dict) -> str:
+        return "\n".join(f"  <code>{key.name}</code>: {count}" for key, count in counter.items()) or "  —"
+
+    cache_info = client_cache.info()
+    await message.answer(
+        f"📊 Пользователей: {snapshot.total_clients}\n"
+        f"{lines(snapshot.clients_by_status)}\n\n"
+        f"🔌 Пиров: {snapshot.total_peers}\n"
+        f"{lines(snapshot.peers_by_status)}\n\n"
+        f"🧩 Пиры по протоколам:\n"
+        f"{lines(snapshot.peers_by_protocol)}\n\n"
+        f"🗄 Кэш клиентов: {cache_info.currsize}/{cache_info.maxsize}, "
+        f"попаданий {cache_info.hits}, промахов {cache_info.misses}\n"
+        f"⏳ Очередь БД: {db_thread.queue_size}, "
+        f"незаписанных статусов: {connections_observer.status_buffer.pending}\n"
+        f"🕒 Сверено с БД: {snapshot.reconciled_at:%d.%m.%Y %H:%M:%S}\n\n"
+        f"{xray_panel_status()}"
+    )
+
+def xray_panel_status() -> str:
+    panel = xray_worker.panel
+    breaker = panel.breaker
+    match breaker.state:
+        case BreakerState.CLOSED:
+            status = "🟢 3x-ui: доступна"
+        case BreakerState.OPEN:
+            status = f"🔴 3x-ui: недоступна, запросы приостановлены ещё на {breaker.retry_in:.0f} с"
+        case _:
+            status = "🟡 3x-ui: проверяется доступность"
+    if breaker.failures:
+        status += f"\n  Ошибок подряд: {breaker.failures}, последняя: <code>{html.escape(breaker.last_error)}</code>"
+    if breaker.trips:
+        status += f"\n  Отключений: {breaker.trips}"
+    if (session_age := panel.session_age) is not None:
+        status += (
+            f"\n  Возраст сессии: {session_age / 60:.0f} мин, "
+            f"обновление через {max(0.0, panel.session_ttl - session_age) / 60:.0f} мин"
+        )
+    return status
+
+@router.message(Command("traffic"))
+async def top_traffic(message: Message):
+    args = message.text.split()
+    if len(args) > 1 and not args[1].isdigit():
+        await message.answer("❌ Использование: /traffic [количество пользователей] [количество дней]")
+        return
+    limit = max(1, int(args[1])) if len(args) > 1 else 10
+    days = max(1, int(args[2])) if len(args) > 2 and args[2].isdigit() else 30
+
+    top = await db_thread.run(
+        connections_observer.traffic.top_users,
+        since=datetime.date.today() - datetime.timedelta(days=days - 1),
+        limit=limit
+    )
+    if not top:
+        await message.answer(f"📶 За последние {days} дн. трафика не было.")
+        return
+
+    await message.answer(
+        f"📶 Топ пользователей по трафику за {days} дн.:\n" + "\n".join(
+            f"{place}. {user.name} (<code>{user.user_id}</code>): {traffic_string(user.usage)}"
+            for place, user in enumerate(top, start=1)
+        )
+    )
+
 @router.message(Command("listen_clients"))
 async def listen_clients(message: Message):
     connected_only = True
@@ -4,7 +4,7 @@ import time
 from aiogram import Router
 
 from config.loader import bot_instance, connections_observer, interval_observer
-from core.db.db_works import Client
+from core.db.async_db import AsyncClient
 from core.db.model_serializer import BasePeer
 from core.logs import bot_logger
 
@@ -16,17 +16,17 @@ async def on_connections_observer_startup():
     bot_logger.info("Observer is running!")
 
 @connections_observer.connected()
-async def on_connected(client: Client, peer: BasePeer):
+async def on_connected(client: AsyncClient, peer: BasePeer):
     with bot_logger.contextualize(client=client, peer=peer):
         bot_logger.info("Client connected")
 
 @connections_observer.disconnected()
-async def on_disconnected(client: Client, peer: BasePeer):
+async def on_disconnected(client: AsyncClient, peer: BasePeer):
     with bot_logger.contextualize(client=client, peer=peer):
         bot_logger.info("Client disconnected")
 
 @connections_observer.timer_observer()
-async def warn_user_timeout(client: Client, peer: BasePeer, disconnect: bool):
+async def warn_user_timeout(client: AsyncClient, peer: BasePeer, disconnect: bool):
     time_left = peer.peer_timer - datetime.datetime.now()
     delta_as_time = time.gmtime(time_left.total_seconds())
     # TODO: write an ip address with a peer name
@@ -37,15 +37,28 @@ async def warn_user_timeout(client: Client, peer: BasePeer, disconnect: bool):
         "Введи /unblock, чтобы обновить время действия подключения.")
 
 @interval_observer.expire_date_warning_observer()
-async def warn_user_expire_date(client: Client):
+async def warn_user_expire_date(client: AsyncClient):
     await bot_instance.send_message(client.userdata.user_id,
         "⚠️ Твой аккаунт будет заблокирован через 24 часа из-за истечения оплаченного времени. "
         "Свяжись с администрацией для продления доступа."
     )
 
 @interval_observer.expire_date_block_observer()
-async def block_user_expire_date(client: Client):
+async def block_user_expire_date(client: AsyncClient):
     await bot_instance.send_message(client.userdata.user_id,
         "❌ Твой аккаунт заблокирован из-за истечения оплаченного времени. "
         "Если ты хочешь продлить доступ, свяжись с нами."
     )
+
+@interval_observer.quota_exceeded_observer()
+async def block_user_quota(client: AsyncClient):
+    await bot_instance.send_message(client.userdata.user_id,
+        "❌ Твой лимит трафика исчерпан, пиры отключены. "
+        "Доступ восстановится автоматически, когда начнётся новый период."
+    )
+
+@interval_observer.quota_restored_observer()
+async def unblock_user_quota(client: AsyncClient):
+    await bot_instance.send_message(client.userdata.user_id,
+        "✅ Начался новый период, лимит трафика обновлён. Можешь снова пользоваться VPN!"
+    )
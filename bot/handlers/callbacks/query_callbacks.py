@@ -24,7 +24,7 @@ from bot.utils.user_helper import (extend_users_usage_time,
                                    get_peer_as_input_file,
                                    get_user_data_string)
 from config.loader import bot_instance, wghub, xray_worker
-from core.db.db_works import ClientFactory
+from core.db.async_db import AsyncClientFactory
 from core.db.enums import ClientStatusChoices, ProtocolType
 from core.logs import bot_logger
 from core.utils.date_utils import parse_time
@@ -42,7 +42,7 @@ async def cancel_action_callback(callback: CallbackQuery, state: FSMContext):
 
 @router.callback_query(PeerCallbackData.filter(), default_state)
 async def select_peer_callback(callback: CallbackQuery, callback_data: PeerCallbackData, state: FSMContext):
-    client = ClientFactory(user_id=callback_data.user_id).get_client()
+    client = await AsyncClientFactory.get_client(callback_data.user_id)
 
     media_group = MediaGroupBuilder()
     xray_strings = ""
@@ -52,9 +52,9 @@ async def select_peer_callback(callback: CallbackQuery, callback_data: PeerCallb
     await callback.answer()
 
     if callback_data.peer_id != -1:
-        peers = [ClientFactory.get_peer_by_id(callback_data.peer_id, protocol_specific=True)]
+        peers = [await AsyncClientFactory.get_peer_by_id(callback_data.peer_id, protocol_specific=True)]
     else:
-        peers = client.get_all_peers(protocol_specific=True)
+        peers = await client.get_all_peers(protocol_specific=True)
 
     for peer in peers:
         match peer.peer_type:
@@ -63,7 +63,7 @@ async def select_peer_callback(callback: CallbackQuery, callback_data: PeerCallb
                     media=get_peer_as_input_file(peer)
                 )
             case ProtocolType.XRAY:
-                xray_strings += "<code>" + xray_worker.get_connection_string(peer) + "</code>\n\n"
+                xray_strings += "<code>" + await xray_worker.get_connection_string(peer) + "</code>\n\n"
             case _:
                 bot_logger.warning(f"Unknown protocol type: {peer.peer_type}. Skipping.")
                 continue
@@ -77,16 +77,16 @@ async def select_peer_callback(callback: CallbackQuery, callback_data: PeerCallb
     UserActionsCallbackData.filter(F.action == UserActionsEnum.BAN_USER)
 )
 async def ban_user_callback(callback: CallbackQuery, callback_data: UserActionsCallbackData):
-    client = ClientFactory(user_id=callback_data.user_id).get_client()
-    peers = client.get_all_peers(protocol_specific=True)
-    client.set_status(ClientStatusChoices.STATUS_ACCOUNT_BLOCKED)
-    disable_peers(wghub, xray_worker, peers, client)
+    client = await AsyncClientFactory.get_client(callback_data.user_id)
+    peers = await client.get_all_peers(protocol_specific=True)
+    await client.set_status(ClientStatusChoices.STATUS_ACCOUNT_BLOCKED)
+    await disable_peers(wghub, xray_worker, peers, client)
 
     await callback.answer(f"✅ Пользователь {client.userdata.name} заблокирован.")
     # see docstring in get_user_data_string for more info
     await callback.message.edit_text(
         # callback_data.is_admin is probably always True here, but just in case
-        text=get_user_data_string(client, show_peer_ids=callback_data.is_admin)[1],
+        text=(await get_user_data_string(client, show_peer_ids=callback_data.is_admin))[1],
         reply_markup=build_user_actions_keyboard(client, is_admin=callback_data.is_admin)
     )
 
@@ -97,16 +97,16 @@ async def ban_user_callback(callback: CallbackQuery, callback_data: UserActionsC
     UserActionsCallbackData.filter(F.action == UserActionsEnum.PARDON_USER)
 )
 async def pardon_user_callback(callback: CallbackQuery, callback_data: UserActionsCallbackData):
-    client = ClientFactory(user_id=callback_data.user_id).get_client()
-    peers = client.get_all_peers(protocol_specific=True)
-    client.set_status(ClientStatusChoices.STATUS_CREATED)
-    enable_peers(wghub, xray_worker, peers, client)
+    client = await AsyncClientFactory.get_client(callback_data.user_id)
+    peers = await client.get_all_peers(protocol_specific=True)
+    await client.set_status(ClientStatusChoices.STATUS_CREATED)
+    await enable_peers(wghub, xray_worker, peers, client)
 
     await callback.answer(f"✅ Пользователь {client.userdata.name} разблокирован.")
     # see docstring in get_user_data_string for more info
     await callback.message.edit_text(
         # callback_data.is_admin is probably always True here, but just in case
-        text=get_user_data_string(client, show_peer_ids=callback_data.is_admin)[1],
+        text=(await get_user_data_string(client, show_peer_ids=callback_data.is_admin))[1],
         reply_markup=build_user_actions_keyboard(client, is_admin=callback_data.is_admin)
     )
 
@@ -117,7 +117,8 @@ async def pardon_user_callback(callback: CallbackQuery, callback_data: UserActio
     UserActionsCallbackData.filter(F.action == UserActionsEnum.GET_CONFIGS)
 )
 async def get_user_configs_callback(callback: CallbackQuery, callback_data: UserActionsCallbackData):
-    peers = ClientFactory(user_id=callback_data.user_id).get_client().get_all_peers()
+    client = await AsyncClientFactory.get_client(callback_data.user_id)
+    peers = await client.get_all_peers()
 
     await callback.answer()
     if peers:
@@ -135,12 +136,12 @@ async def get_user_configs_callback(callback: CallbackQuery, callback_data: User
     UserActionsCallbackData.filter(F.action == UserActionsEnum.UPDATE_DATA)
 )
 async def update_user_message_data(callback: CallbackQuery, callback_data: UserActionsCallbackData):
-    client = ClientFactory(user_id=callback_data.user_id).get_client()
+    client = await AsyncClientFactory.get_client(callback_data.user_id)
     await callback.answer(f"Данные пользователя {client.userdata.name} обновлены.")
     with suppress(TelegramBadRequest):
         await callback.message.edit_text(
             # see docstring in get_user_data_string for more info
-            text=get_user_data_string(client, show_peer_ids=callback_data.is_admin)[1],
+            text=(await get_user_data_string(client, show_peer_ids=callback_data.is_admin))[1],
             reply_markup=build_user_actions_keyboard(client, is_admin=callback_data.is_admin)
         )
 
@@ -148,7 +149,7 @@ async def update_user_message_data(callback: CallbackQuery, callback_data: UserA
     UserActionsCallbackData.filter(F.action == UserActionsEnum.ADD_PEER)
 )
 async def add_peer_callback(callback: CallbackQuery, callback_data: UserActionsCallbackData, state: FSMContext):
-    client = ClientFactory(user_id=callback_data.user_id).get_client()
+    client = await AsyncClientFactory.get_client(callback_data.user_id)
 
     keyboard = build_protocols_keyboard()
     keyboard.inline_keyboard.append(cancel_keyboard().inline_keyboard[0])
@@ -188,8 +189,8 @@ async def preview_message_callback(callback: CallbackQuery, callback_data: Previ
     UserActionsCallbackData.filter(F.action == UserActionsEnum.CHANGE_PEER_NAME)
 )
 async def change_peer_name_callback(callback: CallbackQuery, callback_data: UserActionsCallbackData, state: FSMContext):
-    client = ClientFactory(user_id=callback.from_user.id).get_client()
-    keyboard = build_peer_configs_keyboard(client.userdata.user_id, client.get_all_peers(), display_all=False)
+    client = await AsyncClientFactory.get_client(callback.from_user.id)
+    keyboard = build_peer_configs_keyboard(client.userdata.user_id, await client.get_all_peers(), display_all=False)
     keyboard.inline_keyboard.append(cancel_keyboard().inline_keyboard[0])
     await callback.answer()
     await callback.message.answer(
@@ -210,7 +211,7 @@ async def change_peer_name_entering_callback(callback: CallbackQuery, callback_d
     UserActionsCallbackData.filter(F.action == UserActionsEnum.EXTEND_USAGE_TIME)
 )
 async def extend_usage_time_dialog_callback(callback: CallbackQuery, callback_data: UserActionsCallbackData):
-    client = ClientFactory(user_id=callback_data.user_id).get_client()
+    client = await AsyncClientFactory.get_client(callback_data.user_id)
     keyboard = extend_time_keyboard(client.userdata.user_id)
     keyboard.inline_keyboard.append(cancel_keyboard().inline_keyboard[0])
     await callback.answer()
@@ -220,7 +221,7 @@ async def extend_usage_time_dialog_callback(callback: CallbackQuery, callback_da
     TimeExtenderCallbackData.filter(F.extend_for != "custom")
 )
 async def extend_usage_time_callback(callback: CallbackQuery, callback_data: TimeExtenderCallbackData):
-    client = ClientFactory(user_id=callback_data.user_id).get_client()
+    client = await AsyncClientFactory.get_client(callback_data.user_id)
     time_to_add = parse_time(callback_data.extend_for)
 
     if not time_to_add:
@@ -228,7 +229,7 @@ async def extend_usage_time_callback(callback: CallbackQuery, callback_data: Tim
         await callback.answer(f"❌ Неправильный формат времени: {callback_data.extend_for}")
         return
 
-    if extend_users_usage_time(client, time_to_add):
+    if await extend_users_usage_time(client, time_to_add):
         await callback.answer(f"✅ Время использования продлено на {callback_data.extend_for}.")
     else:
         await callback.answer(f"❓ Что-то пошло не так во время операции. Проверь логи.")
@@ -266,9 +267,9 @@ async def whisper_user_callback(callback: CallbackQuery, callback_data: UserActi
 
 @router.callback_query(GetUserCallbackData.filter())
 async def get_user_callback(callback: CallbackQuery, callback_data: GetUserCallbackData):
-    client = ClientFactory(user_id=callback_data.user_id).get_client()
+    client = await AsyncClientFactory.get_client(callback_data.user_id)
     await callback.answer()
-    user_data = get_user_data_string(client, show_peer_ids=True)
+    user_data = await get_user_data_string(client, show_peer_ids=True)
     await callback.message.answer(f"Пользователь: {client.userdata.name}\n" + user_data[0])
     await callback.message.answer(
         user_data[1],
@@ -1,3 +1,5 @@
+import asyncio
+
 from aiogram import Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
@@ -10,7 +12,7 @@ from bot.utils.states import (AddPeerStates, ContactAdminStates,
 from bot.utils.user_helper import extend_users_usage_time
 from config.loader import (bot_cfg, bot_instance, ip_queue, wghub, xray_cfg,
                            xray_worker)
-from core.db.db_works import ClientFactory
+from core.db.async_db import AsyncClientFactory
 from core.db.enums import ProtocolType
 from core.logs import bot_logger
 from core.utils.date_utils import parse_time
@@ -34,10 +36,10 @@ async def finally_change_peer_name(message: Message, state: FSMContext):
 
     data = await state.get_data()
     user_id, peer_id = data.values()
-    client = ClientFactory(user_id=user_id).get_client()
-    client.change_peer_name(peer_id, new_name)
-    xray_worker.update_peer(
-        ClientFactory.get_xray_peer(peer_id),
+    client = await AsyncClientFactory.get_client(user_id)
+    await client.change_peer_name(peer_id, new_name)
+    await xray_worker.update_peer(
+        await AsyncClientFactory.get_xray_peer(peer_id),
         # ! we need to pass this until xray_worker is fixed
         expiry_time=client.userdata.expire_time
     )
@@ -73,9 +75,9 @@ async def extend_usage_time_custom_entered(message: Message, state: FSMContext):
         await message.answer(f"❌ Неправильный формат времени: {message.text}")
         return
 
-    client = ClientFactory(user_id=user_id).get_client()
+    client = await AsyncClientFactory.get_client(user_id)
 
-    if extend_users_usage_time(client, time_to_add):
+    if await extend_users_usage_time(client, time_to_add):
         await message.answer(f"✅ Время использования продлено на {message.text}.")
     else:
         await message.answer(f"❓ Что-то пошло не так во время операции. Проверь логи.")
@@ -94,27 +96,35 @@ async def whisper_state(message: Message, state: FSMContext):
 async def add_peers(message: Message, state: FSMContext):
     await message.delete()
     data = await state.get_data()
-    client = ClientFactory(user_id=data["user_id"]).get_client()
+    client = await AsyncClientFactory.get_client(data["user_id"])
 
     try:
-        for _ in range(int(message.text)):
-            match data["protocol"]:
-                case ProtocolType.WIREGUARD | ProtocolType.AMNEZIA_WIREGUARD:
-                    ip_addr = ip_queue.get_ip()
-                    peer = client.add_wireguard_peer(
-                        ip_addr,
-                        is_amnezia=data["protocol"] == ProtocolType.AMNEZIA_WIREGUARD
-                    )
-                    wghub.add_peer(peer)
-                case ProtocolType.XRAY:
-                    peer = client.add_xray_peer(
-                        # hardcoded flow, but it's okay
-                        flow="xtls-rprx-vision",
-                        inbound_id=xray_cfg.inbound_id,
-                    )
-                    xray_worker.add_peers(peer.inbound_id, [peer], client.userdata.expire_time)
-                case _:
-                    raise TypeError("Unknown protocol type")
+        # config changes are written in a single batch, so they're awaited all at once
+        wireguard_changes = []
+        try:
+            for _ in range(int(message.text)):
+                match data["protocol"]:
+                    case ProtocolType.WIREGUARD | ProtocolType.AMNEZIA_WIREGUARD:
+                        ip_addr = ip_queue.get_ip()
+                        peer = await client.add_wireguard_peer(
+                            ip_addr,
+                            is_amnezia=data["protocol"] == ProtocolType.AMNEZIA_WIREGUARD
+                        )
+                        wireguard_changes.append(wghub.add_peer(peer))
+                    case ProtocolType.XRAY:
+                        peer = await client.add_xray_peer(
+                            # hardcoded flow, but it's okay
+                            flow="xtls-rprx-vision",
+                            inbound_id=xray_cfg.inbound_id,
+                        )
+                        await xray_worker.add_peers(peer.inbound_id, [peer], client.userdata.expire_time)
+                    case _:
+                        raise TypeError("Unknown protocol type")
+        finally:
+            # changes submitted before a failure are awaited as well, so their errors aren't lost
+            results = await asyncio.gather(*wireguard_changes, return_exceptions=True)
+            if errors := [result for result in results if isinstance(result, Exception)]:
+                raise ExceptionGroup("Couldn't add Wireguard peers", errors)
         await message.answer("✅ Пиры были успешно добавлены.")
     except ValueError:
         await message.answer("❌ Неправильный формат количества пиров. Введи число.")
@@ -7,7 +7,7 @@ from bot.utils.callback_data import (PeerCallbackData,
                                      TimeExtenderCallbackData,
                                      UserActionsCallbackData, UserActionsEnum,
                                      YesOrNoEnum)
-from core.db.db_works import Client
+from core.db.async_db import AsyncClient
 from core.db.enums import ClientStatusChoices, ProtocolType
 from core.db.model_serializer import BasePeer
 
@@ -55,7 +55,7 @@ def build_peer_configs_keyboard(
 
     return builder.as_markup()
 
-def build_user_actions_keyboard(client: Client, is_admin=True) -> InlineKeyboardMarkup:
+def build_user_actions_keyboard(client: AsyncClient, is_admin=True) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
 
     if is_admin:
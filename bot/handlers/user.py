@@ -10,7 +10,7 @@ from bot.middlewares.logging_middleware import LoggingMiddleware
 from bot.utils.states import ContactAdminStates, RenamePeerStates
 from bot.utils.user_helper import (get_user_data_string,
                                    unblock_timeout_connections)
-from core.db.db_works import ClientFactory
+from core.db.async_db import AsyncClientFactory
 
 router = Router(name="user")
 router.message.middleware.register(LoggingMiddleware())
@@ -18,9 +18,9 @@ router.message.middleware.register(LoggingMiddleware())
 
 @router.message(Command("me"))
 async def me(message: Message):
-    client = ClientFactory(user_id=message.chat.id).get_client()
+    client = await AsyncClientFactory.get_client(message.chat.id)
 
-    user_data = get_user_data_string(client)
+    user_data = await get_user_data_string(client)
 
     await message.answer(user_data[0])
     await message.answer(
@@ -30,8 +30,8 @@ async def me(message: Message):
 
 @router.message(Command("config"))
 async def get_config(message: Message):
-    client = ClientFactory(user_id=message.from_user.id).get_client()
-    peers = client.get_all_peers()
+    client = await AsyncClientFactory.get_client(message.from_user.id)
+    peers = await client.get_all_peers(trusted=True)
 
     if not peers:
         await message.answer("❌ У тебя нет пиров.")
@@ -45,16 +45,16 @@ async def get_config(message: Message):
 
 @router.message(Command("unblock"))
 async def unblock_connections(message: Message):
-    client = ClientFactory(user_id=message.from_user.id).get_client()
+    client = await AsyncClientFactory.get_client(message.from_user.id)
 
-    unblock_timeout_connections(client)
+    await unblock_timeout_connections(client)
 
     await message.answer("✅ Соединения были разблокированы/обновлены. Можешь продолжать пользоваться VPN!")
 
 @router.message(Command("change_peer_name"))
 async def change_peer_name(message: Message, state: FSMContext):
-    client = ClientFactory(user_id=message.from_user.id).get_client()
-    keyboard = build_peer_configs_keyboard(client.userdata.user_id, client.get_all_peers(), display_all=False)
+    client = await AsyncClientFactory.get_client(message.from_user.id)
+    keyboard = build_peer_configs_keyboard(client.userdata.user_id, await client.get_all_peers(), display_all=False)
     keyboard.inline_keyboard.append(cancel_keyboard().inline_keyboard[0])
     await message.answer(
         text="Выбери конфиг, который хочешь переименовать:",
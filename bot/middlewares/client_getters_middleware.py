@@ -13,6 +13,7 @@ class ClientGettersMiddleware(BaseMiddleware):
         "unban", "pardon", "mercy", # unban
         "whisper", # broadcast
         "get_user", # get_user
+        "quota", # set_quota
         "add_peer", # add_peer
     ]
 
@@ -29,7 +30,7 @@ class ClientGettersMiddleware(BaseMiddleware):
                 await event.answer("❌ Сообщение должно содержать IP-адрес пользователя или его Telegram ID.")
                 return
 
-            client, err = get_client_by_id_or_ip(args[1])
+            client, err = await get_client_by_id_or_ip(args[1])
             if err:
                 await event.answer(err)
                 return
@@ -7,7 +7,7 @@ from aiogram.types import (CallbackQuery, InlineKeyboardButton,
                            InlineKeyboardMarkup)
 
 from bot.utils.callback_data import GetUserCallbackData
-from core.db.db_works import Client, ClientFactory
+from core.db.async_db import AsyncClient, AsyncClientFactory
 
 
 class UsersInlineKeyboardPaginator:
@@ -17,7 +17,7 @@ class UsersInlineKeyboardPaginator:
     goto_last_page = "⏭"
     current_page_label = "{} / {}"
 
-    def __init__(self, data: list[Client], router: Router, items_per_page: int = 5, current_page: int = 1, callback_prefix: str = "page_"):
+    def __init__(self, data: list[AsyncClient], router: Router, items_per_page: int = 5, current_page: int = 1, callback_prefix: str = "page_"):
         self.__data = data
         self.router = router
         self.items_per_page = items_per_page
@@ -26,7 +26,7 @@ class UsersInlineKeyboardPaginator:
 
         self.callback_prefix = callback_prefix
 
-    def __client_to_keyboard_converter(self, client: Client) -> InlineKeyboardButton:
+    def __client_to_keyboard_converter(self, client: AsyncClient) -> InlineKeyboardButton:
         return InlineKeyboardButton(
             text=f"{client.userdata.name} ({client.userdata.user_id})",
             callback_data=GetUserCallbackData(
@@ -72,7 +72,7 @@ class UsersInlineKeyboardPaginator:
         async def callback_handler(callback: CallbackQuery) -> None:
             await callback.answer()
 
-            fresh_data = ClientFactory.select_clients()
+            fresh_data = await AsyncClientFactory.select_clients()
             self.data = fresh_data
             current_page = int(callback.data.split("_")[-1])
 
@@ -96,6 +96,6 @@ class UsersInlineKeyboardPaginator:
         return self.__data
 
     @data.setter
-    def data(self, value: list[Client]) -> None:
+    def data(self, value: list[AsyncClient]) -> None:
         self.__data = value
         self.max_pages = ceil(len(self.__data) / self.items_per_page)
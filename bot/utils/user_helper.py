@@ -7,21 +7,23 @@ from pydantic import ValidationError
 
 from config.loader import (connections_observer, core_cfg, wghub,
                            wireguard_server_config, xray_worker)
-from core.db.db_works import Client, ClientFactory
+from core.db.async_db import AsyncClient, AsyncClientFactory, db_thread
 from core.db.enums import ClientStatusChoices, PeerStatusChoices, ProtocolType
 from core.db.model_serializer import WireguardPeer, XrayPeer
+from core.db.quota import quota_engine
+from core.db.traffic import TrafficUsage
 from core.logs import bot_logger
 from core.wg.wgconfig_helper import get_peer_config_str
 
 
 # TODO: make this function accept ip addresses again
-def get_client_by_id_or_ip(user_id: Union[str, int]) -> tuple[Optional[Client], Optional[str]]:
+async def get_client_by_id_or_ip(user_id: Union[str, int]) -> tuple[Optional[AsyncClient], Optional[str]]:
     """Tries to get client by it's id.
 
     Returns:
-        tuple: `(Client, None)` if the user was found, `(None, "error_message")` otherwise"""
+        tuple: `(AsyncClient, None)` if the user was found, `(None, "error_message")` otherwise"""
     try:
-        client = ClientFactory(user_id=user_id).get_client()
+        client = await AsyncClientFactory.get_client(user_id)
     except ValidationError:
         client = None
 
@@ -29,7 +31,7 @@ def get_client_by_id_or_ip(user_id: Union[str, int]) -> tuple[Optional[Client],
         return None, f"❌ Пользователь <code>{user_id}</code> не найден."
     return client, None
 
-def get_user_data_string(client: Client, show_peer_ids: bool = False) -> list[str]:
+async def get_user_data_string(client: AsyncClient, show_peer_ids: bool = False) -> list[str]:
     """Returns human-readable data about User. Recommended to use `parse_mode="HTML"`.
 
     Note:
@@ -37,7 +39,7 @@ def get_user_data_string(client: Client, show_peer_ids: bool = False) -> list[st
         - Static user info (ID, registration date, etc.)
         - Peers info, client status and expiration date
     """
-    peers = client.get_all_peers(protocol_specific=True)
+    peers = await client.get_all_peers(protocol_specific=True, trusted=True)
     peers_str = ""
     time_limitation = core_cfg.is_time_limit_disabled()
 
@@ -65,6 +67,17 @@ def get_user_data_string(client: Client, show_peer_ids: bool = False) -> list[st
     else:
         expire_time = "❌ Не оплачено"
 
+    peer_ids = [peer.peer_id for peer in peers]
+    traffic = connections_observer.traffic
+    month_usage = await db_thread.run(
+        traffic.get_usage, peer_ids, since=datetime.date.today() - datetime.timedelta(days=29)
+    )
+    day_usage = traffic.get_recent_usage(peer_ids, seconds=24 * 60 * 60)
+    quota_str = ""
+    if limit := quota_engine.limit_for(client.userdata.user_id):
+        used = humanize.naturalsize(quota_engine.get_usage(client.userdata.user_id), binary=True)
+        quota_str = f"Лимит: {used} из {humanize.naturalsize(limit, binary=True)}\n"
+
     return [f"""ℹ️ <b>Информация об аккаунте</b>:
 <b>ID</b>: <code>{client.userdata.user_id}</code>
 📅 <b>Дата регистрации</b>: {client.userdata.registered_at.strftime("%d.%m.%Y в %H:%M")}
@@ -75,45 +88,52 @@ f"""<b>Текущий статус</b>: {ClientStatusChoices.to_string(client.us
 
 🛜 <b>Пиры</b>:
 {peers_str or '❌ Нет пиров\n'}
-"""]
+📶 <b>Трафик</b>:
+За 24 часа: {traffic_string(day_usage)}
+За 30 дней: {traffic_string(month_usage)}
+{quota_str}"""]
+
+def traffic_string(usage: TrafficUsage) -> str:
+    """Formats traffic from the user's point of view: download is what the server sent."""
+    return (f"⬇️ {humanize.naturalsize(usage.tx_bytes, binary=True)} "
+            f"⬆️ {humanize.naturalsize(usage.rx_bytes, binary=True)}")
 
-def extend_users_usage_time(client: Client, time_to_add: datetime.timedelta) -> bool:
+async def extend_users_usage_time(client: AsyncClient, time_to_add: datetime.timedelta) -> bool:
     now = datetime.datetime.now()
 
     if not isinstance(client.userdata.expire_time, datetime.datetime) or client.userdata.expire_time < now:
         client.userdata.expire_time = now
 
-    is_updated = client.set_expire_time(client.userdata.expire_time + time_to_add)
+    is_updated = await client.set_expire_time(client.userdata.expire_time + time_to_add)
 
     if not is_updated:
         bot_logger.error(f"Couldn't update expire time for user {client.userdata.user_id}!")
         return False
 
-    if xray_peers := client.get_xray_peers():
-        for peer in xray_peers:
-            xray_worker.update_peer(peer, expiry_time=client.userdata.expire_time)
+    if xray_peers := await client.get_xray_peers():
+        await xray_worker.update_peers(xray_peers, expiry_time=client.userdata.expire_time)
 
     return True
 
 @bot_logger.catch()
-def unblock_timeout_connections(client: Client) -> bool:
-    peers = client.get_all_peers(protocol_specific=True)
+async def unblock_timeout_connections(client: AsyncClient) -> bool:
+    peers = await client.get_all_peers(protocol_specific=True)
     for peer in peers:
         match peer.peer_status:
             case PeerStatusChoices.STATUS_TIME_EXPIRED:
                 if peer.peer_type in [ProtocolType.WIREGUARD, ProtocolType.AMNEZIA_WIREGUARD]:
                     peer: WireguardPeer
-                    wghub.enable_peer(peer)
+                    await wghub.enable_peer(peer)
                 elif peer.peer_type == ProtocolType.XRAY:
                     peer: XrayPeer
-                    xray_worker.enable_peer(peer, expire_time=client.userdata.expire_time)
-                client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
-                client.set_status(ClientStatusChoices.STATUS_DISCONNECTED)
+                    await xray_worker.enable_peer(peer, expire_time=client.userdata.expire_time)
+                await client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
+                await client.set_status(ClientStatusChoices.STATUS_DISCONNECTED)
             case PeerStatusChoices.STATUS_CONNECTED:
                 new_time = datetime.datetime.now() + datetime.timedelta(hours=core_cfg.peer_active_time)
-                client.set_peer_timer(peer.peer_id, time=new_time)
+                await client.set_peer_timer(peer.peer_id, time=new_time)
     # updating peer timer for observer
-    connections_observer.update_client_peers(client)
+    await connections_observer.update_client_peers(client)
 
     return True
 
@@ -7,9 +7,14 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from config.settings import Config
 from core.db.db_works import ClientFactory
 from core.db.models import init_db
+from core.db.quota import QuotaPeriod, quota_engine
+from core.db.stats import service_stats
 from core.logs import add_loggers, core_logger
 from core.utils.ip_utils import IPQueue, generate_ip_addresses
-from core.watchdog.events import ConnectionEvents, IntervalEvents
+from core.utils.reconciler import Reconciler
+from core.watchdog.events import (ConnectionDetection, ConnectionEvents,
+                                  IntervalEvents)
+from core.wg.key_pool import key_pool
 from core.wg.wg_work import WGHub
 from core.xray.xray_worker import XrayWorker
 
@@ -45,7 +50,20 @@ bot_instance = Bot(
 )
 bot_dispatcher = Dispatcher(storage=MemoryStorage())
 
-db_instance = init_db(db_cfg.path)
+db_instance = init_db(
+    db_cfg.path,
+    pragmas=db_cfg.pragmas,
+    read_pool_size=db_cfg.read_pool_size,
+    client_cache_size=db_cfg.client_cache_size
+)
+service_stats.reconcile()
+quota_engine.configure(
+    limit_bytes=core_cfg.traffic_quota_gb * 1024 ** 3,
+    period=QuotaPeriod(core_cfg.traffic_quota_period),
+    rolling_days=core_cfg.traffic_quota_rolling_days
+)
+quota_engine.load()
+key_pool.set_watermarks(core_cfg.key_pool_low_watermark, core_cfg.key_pool_high_watermark)
 
 _all_ips = generate_ip_addresses(wireguard_server_config.user_ip, mask="24")
 ip_queue = IPQueue([ip for ip in _all_ips
@@ -66,6 +84,7 @@ xray_worker = XrayWorker(
 
 try:
     inbound = xray_worker.api.inbound.get_by_id(xray_cfg.inbound_id)
+    xray_worker.cache_inbound(inbound)
     with core_logger.contextualize(
         remark=inbound.remark,
         is_enabled=inbound.enable,
@@ -81,7 +100,10 @@ connections_observer = ConnectionEvents(
     listen_timer=core_cfg.connection_listen_timer,
     update_timer=core_cfg.connection_update_timer,
     connected_only_listen_timer=core_cfg.connection_connected_only_listen_timer,
-    active_hours=core_cfg.peer_active_time
+    active_hours=core_cfg.peer_active_time,
+    detection=ConnectionDetection(core_cfg.connection_detection),
+    handshake_timeout=core_cfg.handshake_timeout
 )
 
 interval_observer = IntervalEvents(wghub, xray_worker)
+reconciler = Reconciler(wghub, xray_worker, [xray_cfg.inbound_id])
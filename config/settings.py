@@ -28,7 +28,14 @@ class Config:
 
     def get_database_config(self):
         return self.Database(
-            path=self.cfg.get("db", "path", fallback="db.sqlite")
+            path=self.cfg.get("db", "path", fallback="db.sqlite"),
+            journal_mode=self.cfg.get("db", "journal_mode", fallback="wal"),
+            synchronous=self.cfg.get("db", "synchronous", fallback="normal"),
+            cache_size=self.cfg.getint("db", "cache_size", fallback=-16000),
+            mmap_size=self.cfg.getint("db", "mmap_size", fallback=134217728),
+            busy_timeout=self.cfg.getint("db", "busy_timeout", fallback=5000),
+            read_pool_size=self.cfg.getint("db", "read_pool_size", fallback=4),
+            client_cache_size=self.cfg.getint("db", "client_cache_size", fallback=1024)
         )
 
     def get_wireguard_server_config(self, *args, **kwargs):
@@ -51,7 +58,14 @@ class Config:
             connection_listen_timer=self.cfg.getint("core", "connection_listen_timer", fallback=120),
             connection_update_timer=self.cfg.getint("core", "connection_update_timer", fallback=360),
             connection_connected_only_listen_timer=self.cfg.getint("core", "connection_connected_only_listen_timer", fallback=60),
-            logs_path=self.cfg.get("core", "logs_path", fallback="./logs")
+            logs_path=self.cfg.get("core", "logs_path", fallback="./logs"),
+            key_pool_low_watermark=self.cfg.getint("core", "key_pool_low_watermark", fallback=16),
+            key_pool_high_watermark=self.cfg.getint("core", "key_pool_high_watermark", fallback=128),
+            connection_detection=self.cfg.get("core", "connection_detection", fallback="handshake"),
+            handshake_timeout=self.cfg.getint("core", "handshake_timeout", fallback=180),
+            traffic_quota_gb=self.cfg.getint("core", "traffic_quota_gb", fallback=0),
+            traffic_quota_period=self.cfg.get("core", "traffic_quota_period", fallback="monthly"),
+            traffic_quota_rolling_days=self.cfg.getint("core", "traffic_quota_rolling_days", fallback=30)
         )
 
     def get_xray_server_config(self):
@@ -104,8 +118,38 @@ class Config:
             return True
 
     class Database:
-        def __init__(self, path: str):
+        def __init__(self,
+                     path: str,
+                     journal_mode: str = "wal",
+                     synchronous: str = "normal",
+                     cache_size: int = -16000,
+                     mmap_size: int = 134217728,
+                     busy_timeout: int = 5000,
+                     read_pool_size: int = 4,
+                     client_cache_size: int = 1024):
             self.path = path
+            self.journal_mode = journal_mode
+            self.synchronous = synchronous
+            self.cache_size = cache_size
+            """Positive value is a number of pages, negative one is a size in KiB"""
+            self.mmap_size = mmap_size
+            """In bytes"""
+            self.busy_timeout = busy_timeout
+            """In milliseconds"""
+            self.read_pool_size = read_pool_size
+            self.client_cache_size = client_cache_size
+            """Max number of cached users, 0 disables the cache"""
+
+        @property
+        def pragmas(self) -> dict:
+            """SQLite pragmas that should be applied to every connection"""
+            return {
+                "journal_mode": self.journal_mode,
+                "synchronous": self.synchronous,
+                "cache_size": self.cache_size,
+                "mmap_size": self.mmap_size,
+                "busy_timeout": self.busy_timeout,
+            }
 
     class WireguardServer:
         def __init__(
@@ -160,12 +204,32 @@ class Config:
                      connection_listen_timer: int,
                      connection_update_timer: int,
                      connection_connected_only_listen_timer: int,
-                     logs_path: str):
+                     logs_path: str,
+                     key_pool_low_watermark: int = 16,
+                     key_pool_high_watermark: int = 128,
+                     connection_detection: str = "handshake",
+                     handshake_timeout: int = 180,
+                     traffic_quota_gb: int = 0,
+                     traffic_quota_period: str = "monthly",
+                     traffic_quota_rolling_days: int = 30):
             self.peer_active_time = peer_active_time
             self.connection_listen_timer = connection_listen_timer
             self.connection_update_timer = connection_update_timer
             self.connection_connected_only_listen_timer = connection_connected_only_listen_timer
             self.logs_path = logs_path
+            self.key_pool_low_watermark = key_pool_low_watermark
+            """Number of pre-generated Wireguard keys that triggers a refill of the pool"""
+            self.key_pool_high_watermark = key_pool_high_watermark
+            """Number of pre-generated Wireguard keys the pool is refilled to"""
+            self.connection_detection = connection_detection
+            """How Wireguard peers are checked: `handshake` or `icmp`"""
+            self.handshake_timeout = handshake_timeout
+            """Seconds since the latest handshake after which an idle Wireguard peer is disconnected"""
+            self.traffic_quota_gb = traffic_quota_gb
+            """Max traffic of a user per quota period in GiB, 0 means no limit. Overridden by `/quota` per user"""
+            self.traffic_quota_period = traffic_quota_period
+            """`monthly` (since the first day of the month) or `rolling` (last `traffic_quota_rolling_days` days)"""
+            self.traffic_quota_rolling_days = traffic_quota_rolling_days
 
         def is_time_limit_disabled(self) -> bool:
             """Checks if time limitation for all peers is disabled (peer_active_time equals to 0)
@@ -1,3 +1,5 @@
+import asyncio
+
 from config.loader import wireguard_server_config
 from core.db.db_works import ClientFactory
 from core.wg.wg_work import (enable_server, make_wg_server_base_str,
@@ -33,4 +35,4 @@ def create_server_config(wg_server):
 # TODO: check if server was disabled before enabling it
 def create_wg_server():
     create_server_config(wireguard_server_config.path)
-    enable_server(wireguard_server_config.path)
+    asyncio.run(enable_server(wireguard_server_config.path))
@@ -0,0 +1,296 @@
+import asyncio
+import datetime
+import queue
+import threading
+from typing import Any, Callable, Iterable, Optional, TypeVar, Union
+
+from core.db.db_works import Client, ClientFactory
+from core.db.enums import ClientStatusChoices, PeerStatusChoices
+from core.db.model_serializer import BasePeer, User, WireguardPeer, XrayPeer
+from core.db.models import db
+from core.logs import core_logger
+
+T = TypeVar("T")
+
+
+class DatabaseThread:
+    """
+    Dedicated thread that executes database calls for coroutines.
+
+    Calls are put into a bounded queue and executed one by one in the order they were submitted,
+    so every call (and every transaction opened inside of it) runs to completion on a single
+    connection before the next one starts. Coroutines wait for the result without blocking the event loop.
+    When the queue is full, submitting coroutines wait on a semaphore until the thread takes a call,
+    and are let in in the order they came.
+
+    While the thread is not started, calls are executed right away in the calling thread.
+    That's the way to go for in-memory databases, which can't be shared between connections.
+
+    Attributes:
+        max_queue_size (int): Max number of calls waiting for execution.
+    """
+    _STOP = object()
+
+    def __init__(self, max_queue_size: int = 256):
+        self.max_queue_size = max_queue_size
+        self.__queue: queue.Queue = queue.Queue()
+        self.__thread: Optional[threading.Thread] = None
+        self.__slots: Optional[asyncio.Semaphore] = None
+        """Free places in the queue, bound to `self.__loop`"""
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self.__thread is not None and self.__thread.is_alive()
+
+    @property
+    def queue_size(self) -> int:
+        """Number of calls waiting for execution."""
+        return self.__queue.qsize()
+
+    def in_thread(self) -> bool:
+        """Whether the current thread is the database thread."""
+        return self.__thread is threading.current_thread()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self.__thread = threading.Thread(target=self.__worker, name="database", daemon=True)
+        self.__thread.start()
+        core_logger.info("Database thread started.")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Executes already submitted calls, closes the thread's connection and stops the thread."""
+        if not self.is_running:
+            return
+        self.__queue.put(self._STOP)
+        self.__thread.join(timeout)
+        self.__thread = None
+        core_logger.info("Database thread stopped.")
+
+    def __worker(self) -> None:
+        while True:
+            job = self.__queue.get()
+            if job is self._STOP:
+                if not db.is_closed():
+                    db.close()
+                return
+
+            func, args, kwargs, loop, future, slots = job
+            loop.call_soon_threadsafe(slots.release)
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                loop.call_soon_threadsafe(self.__set_exception, future, e)
+            else:
+                loop.call_soon_threadsafe(self.__set_result, future, result)
+
+    @staticmethod
+    def __set_result(future: asyncio.Future, result: Any) -> None:
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def __set_exception(future: asyncio.Future, exception: BaseException) -> None:
+        if not future.done():
+            future.set_exception(exception)
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Executes `func(*args, **kwargs)` on the database thread and returns its result.
+
+        Note:
+            Cancelling the awaiting coroutine doesn't cancel the call if it has already been queued.
+        """
+        if not self.is_running or self.in_thread():
+            return func(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        if self.__loop is not loop:
+            self.__loop = loop
+            self.__slots = asyncio.Semaphore(self.max_queue_size)
+        slots = self.__slots
+        await slots.acquire()
+        future = loop.create_future()
+        # the thread releases the slot as soon as it takes the call
+        self.__queue.put_nowait((func, args, kwargs, loop, future, slots))
+        return await future
+
+    async def run_in_transaction(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """Same as `run`, but wraps the call into a transaction that is rolled back if `func` raises."""
+        def transaction() -> T:
+            with db.atomic():
+                return func(*args, **kwargs)
+        return await self.run(transaction)
+
+
+db_thread = DatabaseThread()
+"""Process-wide database thread. Started by `run_bot` for file databases."""
+
+
+class AsyncClient:
+    """
+    Awaitable facade over `Client`. Every method executes the same `Client` method on `db_thread`.
+
+    Attributes:
+        client (Client): Wrapped synchronous client.
+    """
+    __slots__ = ("client",)
+
+    def __init__(self, client: Client):
+        self.client = client
+
+    @property
+    def userdata(self) -> User:
+        return self.client.userdata
+
+    def __repr__(self) -> str:
+        return f"AsyncClient(userdata={self.userdata!r})"
+
+    async def add_wireguard_peer(self,
+                                 shared_ips: str,
+                                 public_key: Optional[str] = None,
+                                 private_key: Optional[str] = None,
+                                 preshared_key: Optional[str] = None,
+                                 is_amnezia: bool = False,
+                                 peer_name: Optional[str] = None
+                                 ) -> Optional[WireguardPeer]:
+        return await db_thread.run(
+            self.client.add_wireguard_peer,
+            shared_ips,
+            public_key=public_key,
+            private_key=private_key,
+            preshared_key=preshared_key,
+            is_amnezia=is_amnezia,
+            peer_name=peer_name
+        )
+
+    async def add_xray_peer(self, flow: str, inbound_id: int, peer_name: Optional[str] = None) -> Optional[XrayPeer]:
+        return await db_thread.run(self.client.add_xray_peer, flow, inbound_id, peer_name=peer_name)
+
+    async def delete_peers(self) -> bool:
+        return await db_thread.run(self.client.delete_peers)
+
+    async def delete_wireguard_peer_by_ip(self, ip_address: str) -> bool:
+        return await db_thread.run(self.client.delete_wireguard_peer_by_ip, ip_address)
+
+    async def get_all_peers(
+            self,
+            protocol_specific: bool = False,
+            trusted: bool = False
+        ) -> Union[list[BasePeer], list[Union[WireguardPeer, XrayPeer]]]:
+        return await db_thread.run(self.client.get_all_peers, protocol_specific, trusted)
+
+    async def get_wireguard_peers(self, is_amnezia: bool, trusted: bool = False) -> list[WireguardPeer]:
+        return await db_thread.run(self.client.get_wireguard_peers, is_amnezia, trusted)
+
+    async def get_xray_peers(self, trusted: bool = False) -> list[XrayPeer]:
+        return await db_thread.run(self.client.get_xray_peers, trusted)
+
+    async def get_connected_peers(self, trusted: bool = False) -> list[BasePeer]:
+        return await db_thread.run(self.client.get_connected_peers, trusted)
+
+    async def set_status(self, status: ClientStatusChoices) -> bool:
+        return await db_thread.run(self.client.set_status, status)
+
+    async def set_expire_time(self, expire_time: datetime.datetime) -> bool:
+        return await db_thread.run(self.client.set_expire_time, expire_time)
+
+    async def set_traffic_limit(self, traffic_limit: Optional[int]) -> bool:
+        return await db_thread.run(self.client.set_traffic_limit, traffic_limit)
+
+    async def set_peer_status(self, peer_id: int, peer_status: PeerStatusChoices) -> bool:
+        return await db_thread.run(self.client.set_peer_status, peer_id, peer_status)
+
+    async def set_peer_timer(self, peer_id: int, time: datetime.datetime) -> bool:
+        return await db_thread.run(self.client.set_peer_timer, peer_id, time)
+
+    async def change_peer_name(self, peer_id: int, peer_name: str) -> bool:
+        return await db_thread.run(self.client.change_peer_name, peer_id, peer_name)
+
+
+class AsyncClientFactory:
+    """Awaitable facade over `ClientFactory`. Every method is executed on `db_thread`."""
+
+    @staticmethod
+    def __wrap(client: Optional[Client]) -> Optional[AsyncClient]:
+        return AsyncClient(client) if client is not None else None
+
+    @staticmethod
+    async def get_or_create_client(user_id: Union[int, str], name: str, **kwargs) -> tuple[AsyncClient, bool]:
+        """Same as `ClientFactory.get_or_create_client`, executed in a single transaction."""
+        client, created = await db_thread.run_in_transaction(
+            ClientFactory(user_id=user_id).get_or_create_client, name, **kwargs
+        )
+        return AsyncClient(client), created
+
+    @staticmethod
+    async def get_client(user_id: Union[int, str]) -> Optional[AsyncClient]:
+        return AsyncClientFactory.__wrap(await db_thread.run(ClientFactory.get_client_by_id, user_id))
+
+    @staticmethod
+    async def select_clients() -> list[AsyncClient]:
+        return [AsyncClient(client) for client in await db_thread.run(ClientFactory.select_clients)]
+
+    @staticmethod
+    async def select_clients_with_peers(
+            trusted: bool = False,
+            user_ids: Optional[Iterable[Union[int, str]]] = None
+        ) -> list[tuple[AsyncClient, list[Union[WireguardPeer, XrayPeer]]]]:
+        return [
+            (AsyncClient(client), peers)
+            for client, peers in await db_thread.run(ClientFactory.select_clients_with_peers, trusted, user_ids)
+        ]
+
+    @staticmethod
+    async def select_expiring_clients(
+            until: datetime.datetime,
+            since: Optional[datetime.datetime] = None
+        ) -> list[AsyncClient]:
+        return [AsyncClient(client) for client in await db_thread.run(ClientFactory.select_expiring_clients, until, since)]
+
+    @staticmethod
+    async def block_expired_clients(until: datetime.datetime) -> list[AsyncClient]:
+        return [AsyncClient(client) for client in await db_thread.run(ClientFactory.block_expired_clients, until)]
+
+    @staticmethod
+    async def get_peer_by_id(
+            peer_id: int,
+            protocol_specific: bool = False
+        ) -> Optional[Union[BasePeer, WireguardPeer, XrayPeer]]:
+        return await db_thread.run(ClientFactory.get_peer_by_id, peer_id, protocol_specific)
+
+    @staticmethod
+    async def get_peer_by_ip(ip_address: str) -> Optional[WireguardPeer]:
+        return await db_thread.run(ClientFactory.get_peer_by_ip, ip_address)
+
+    @staticmethod
+    async def get_wireguard_peer(ip_address: str) -> Optional[WireguardPeer]:
+        return await db_thread.run(ClientFactory.get_wireguard_peer, ip_address)
+
+    @staticmethod
+    async def get_xray_peer(peer_id: int) -> Optional[XrayPeer]:
+        return await db_thread.run(ClientFactory.get_xray_peer, peer_id)
+
+    @staticmethod
+    async def delete_client_by_id(user_id: Union[int, str]) -> bool:
+        return await db_thread.run(ClientFactory.delete_client_by_id, user_id)
+
+    @staticmethod
+    async def count_clients() -> int:
+        return await db_thread.run(ClientFactory.count_clients)
+
+    @staticmethod
+    async def get_used_ip_addresses() -> list[str]:
+        return await db_thread.run(ClientFactory.get_used_ip_addresses)
+
+    @staticmethod
+    async def delete_peer(peer: BasePeer) -> Union[BasePeer, bool]:
+        return await db_thread.run(ClientFactory.delete_peer, peer)
+
+    @staticmethod
+    async def delete_peer_by_id(
+            peer_id: int,
+            protocol_specific: bool = False
+        ) -> Union[BasePeer, WireguardPeer, XrayPeer, bool]:
+        return await db_thread.run(ClientFactory.delete_peer_by_id, peer_id, protocol_specific)
@@ -0,0 +1,140 @@
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, NamedTuple, Optional, Union
+
+if TYPE_CHECKING:
+    from core.db.db_works import Client
+
+
+class CacheInfo(NamedTuple):
+    """Same fields as `functools.lru_cache` reports in `cache_info()`"""
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class _Entry:
+    __slots__ = ("client", "peers")
+
+    def __init__(self):
+        self.client: Optional["Client"] = None
+        self.peers: dict[Any, list] = {}
+        """Peer lists keyed by the variant of the request, e.g. `(protocol_specific, trusted)`"""
+
+
+class ClientCache:
+    """
+    Read-through LRU cache (identity map) of `Client`s and their peers keyed by `user_id`.
+
+    `ClientFactory` and `Client` fill the cache on reads and invalidate entries on every write,
+    so the cache never returns data older than the database. Peers are stored per request variant,
+    the cache also remembers the owners of cached peers to invalidate them by `peer_id`.
+
+    Peers are copied on the way in and out, so callers that change them in place, like the watchdog
+    changing `peer_status`, neither share objects with each other nor change the cached ones.
+
+    Attributes:
+        maxsize (int): Max number of cached users. 0 disables the cache.
+    """
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.RLock()
+        self.__entries: OrderedDict[str, _Entry] = OrderedDict()
+        self.__peer_owners: dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.__entries))
+
+    def resize(self, maxsize: int) -> None:
+        with self.__lock:
+            self.maxsize = maxsize
+            self.__evict()
+
+    def clear(self) -> None:
+        """Drops every entry and resets the counters."""
+        with self.__lock:
+            self.__entries.clear()
+            self.__peer_owners.clear()
+            self.hits = self.misses = 0
+
+    def __evict(self) -> None:
+        while len(self.__entries) > self.maxsize:
+            _, entry = self.__entries.popitem(last=False)
+            self.__forget_peers(entry)
+
+    def __forget_peers(self, entry: _Entry) -> None:
+        for peers in entry.peers.values():
+            for peer in peers:
+                self.__peer_owners.pop(peer.peer_id, None)
+
+    def __entry(self, user_id: Union[int, str]) -> Optional[_Entry]:
+        """Returns the entry for writing, creating it if needed. None if the cache is disabled."""
+        if self.maxsize <= 0:
+            return None
+        key = str(user_id)
+        entry = self.__entries.get(key)
+        if entry is None:
+            entry = self.__entries[key] = _Entry()
+            self.__evict()
+        else:
+            self.__entries.move_to_end(key)
+        return entry
+
+    def __lookup(self, user_id: Union[int, str]) -> Optional[_Entry]:
+        entry = self.__entries.get(str(user_id))
+        if entry is not None:
+            self.__entries.move_to_end(str(user_id))
+        return entry
+
+    def get_client(self, user_id: Union[int, str]) -> Optional["Client"]:
+        with self.__lock:
+            entry = self.__lookup(user_id)
+            if entry is None or entry.client is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry.client
+
+    def put_client(self, client: "Client") -> None:
+        with self.__lock:
+            if entry := self.__entry(client.userdata.user_id):
+                entry.client = client
+
+    def get_peers(self, user_id: Union[int, str], variant: Any) -> Optional[list]:
+        """Returns copies of the cached peers, or None if they aren't cached."""
+        with self.__lock:
+            entry = self.__lookup(user_id)
+            if entry is None or variant not in entry.peers:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return [peer.model_copy() for peer in entry.peers[variant]]
+
+    def put_peers(self, user_id: Union[int, str], variant: Any, peers: list) -> None:
+        with self.__lock:
+            if entry := self.__entry(user_id):
+                entry.peers[variant] = [peer.model_copy() for peer in peers]
+                for peer in peers:
+                    self.__peer_owners[peer.peer_id] = str(user_id)
+
+    def invalidate(self, user_id: Union[int, str]) -> None:
+        """Drops the client and its peers."""
+        with self.__lock:
+            if entry := self.__entries.pop(str(user_id), None):
+                self.__forget_peers(entry)
+
+    def invalidate_peer(self, peer_id: int) -> None:
+        """Drops the owner of the peer if its peers are cached."""
+        with self.__lock:
+            if (user_id := self.__peer_owners.get(peer_id)) is not None:
+                self.invalidate(user_id)
+
+
+client_cache = ClientCache()
+"""Process-wide cache of `Client`s. Sized by `init_db`."""
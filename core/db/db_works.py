@@ -1,18 +1,27 @@
 import datetime
+import functools
 import random
-from typing import Optional, Union
+import weakref
+from collections import defaultdict
+from typing import TYPE_CHECKING, Iterable, Optional, Union
 
 from peewee import SQL, DoesNotExist
 from playhouse.shortcuts import model_to_dict
 from pydantic import BaseModel, ConfigDict, PrivateAttr
 
+from core.db.cache import client_cache
 from core.db.enums import ClientStatusChoices, PeerStatusChoices, ProtocolType
 from core.db.model_serializer import BasePeer, User, WireguardPeer, XrayPeer
 from core.db.models import (PeersTableModel, UserModel, WireguardPeerModel,
-                            XrayPeerModel, db)
+                            XrayPeerModel, db, reader)
+from core.db.stats import service_stats
 from core.logs import core_logger
-from core.wg.keygen import (generate_preshared_key, generate_private_key,
-                            generate_public_key)
+from core.utils.ip_utils import ip_to_int, parse_ipv4_interface
+from core.wg.key_pool import key_pool
+from core.wg.keygen import generate_preshared_key, generate_public_key
+
+if TYPE_CHECKING:
+    from core.db.write_buffer import StatusWriteBuffer
 
 # TODO: read BasePeer field names instead of hardcoding
 BASE_PEER_FIELDS = ("id",
@@ -22,6 +31,106 @@ BASE_PEER_FIELDS = ("id",
                     "peer_status",
                     "peer_timer")
 
+PEER_ROW_COLUMNS = (PeersTableModel.user,
+                    PeersTableModel.id,
+                    PeersTableModel.peer_name,
+                    PeersTableModel.peer_type,
+                    PeersTableModel.peer_status,
+                    PeersTableModel.peer_timer)
+"""Columns for `BasePeer.ROW_FIELDS` without the leading `id`, which depends on the selected table"""
+
+WIREGUARD_ROW_COLUMNS = (WireguardPeerModel.id,
+                         *PEER_ROW_COLUMNS,
+                         WireguardPeerModel.public_key,
+                         WireguardPeerModel.private_key,
+                         WireguardPeerModel.preshared_key,
+                         WireguardPeerModel.shared_ips,
+                         WireguardPeerModel.is_amnezia,
+                         WireguardPeerModel.Jc,
+                         WireguardPeerModel.Jmin,
+                         WireguardPeerModel.Jmax)
+"""Columns in the `WireguardPeer.ROW_FIELDS` order"""
+
+XRAY_ROW_COLUMNS = (XrayPeerModel.id,
+                    *PEER_ROW_COLUMNS,
+                    XrayPeerModel.inbound_id,
+                    XrayPeerModel.flow)
+"""Columns in the `XrayPeer.ROW_FIELDS` order"""
+
+status_buffers: "weakref.WeakSet[StatusWriteBuffer]" = weakref.WeakSet()
+"""Write-behind buffers of statuses, every `StatusWriteBuffer` registers itself.
+Direct writes of `Client` drop the pending changes they supersede, so a later flush doesn't bring the old value back."""
+
+def invalidates_client(method):
+    """Drops the client from `client_cache` after the `Client` method has written to the database."""
+    @functools.wraps(method)
+    def wrapper(self: "Client", *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            client_cache.invalidate(self.userdata.user_id)
+    return wrapper
+
+def wireguard_ip_condition(ip_address: str):
+    """
+    Builds a condition that matches a Wireguard peer by IP address.
+
+    IPv4 addresses are looked up by the indexed `ipv4` column. Other addresses are compared
+    with `shared_ips` as is: `ipv4 == None` would turn into `IS NULL` and match every peer without IPv4.
+    """
+    ipv4 = ip_to_int(ip_address)
+    if ipv4 is None:
+        return WireguardPeerModel.shared_ips == ip_address
+    return WireguardPeerModel.ipv4 == ipv4
+
+def select_wireguard_peers(trusted: bool = False):
+    """
+    Builds a query that selects Wireguard peers joined with their base peers.
+
+    Args:
+        trusted (bool): If True, the query returns plain tuples for `WireguardPeer.from_row`
+            instead of model instances for `WireguardPeer.model_validate`.
+    """
+    columns = WIREGUARD_ROW_COLUMNS if trusted else (
+        PeersTableModel, WireguardPeerModel, PeersTableModel.id.alias("peer_id")
+    )
+    query = (WireguardPeerModel.select(*columns)
+             .join(PeersTableModel, on=(PeersTableModel.id == WireguardPeerModel.peer)))
+    return query.tuples() if trusted else query
+
+def select_xray_peers(trusted: bool = False):
+    """
+    Builds a query that selects Xray peers joined with their base peers.
+
+    Args:
+        trusted (bool): If True, the query returns plain tuples for `XrayPeer.from_row`
+            instead of model instances for `XrayPeer.model_validate`.
+    """
+    columns = XRAY_ROW_COLUMNS if trusted else (
+        PeersTableModel, XrayPeerModel, PeersTableModel.id.alias("peer_id")
+    )
+    query = (XrayPeerModel.select(*columns)
+             .join(PeersTableModel, on=(PeersTableModel.id == XrayPeerModel.peer)))
+    return query.tuples() if trusted else query
+
+def select_base_peers(trusted: bool = False):
+    """
+    Builds a query that selects base peers.
+
+    Args:
+        trusted (bool): If True, the query returns plain tuples for `BasePeer.from_row`
+            instead of model instances for `BasePeer.model_validate`.
+    """
+    if trusted:
+        return PeersTableModel.select(PeersTableModel.id, *PEER_ROW_COLUMNS).tuples()
+    return PeersTableModel.select()
+
+def serialize_peers(peer_class: type[BasePeer], rows, trusted: bool = False) -> list:
+    """Serializes query results of `select_*_peers` with the matching `trusted` flag."""
+    if trusted:
+        return [peer_class.from_row(row) for row in rows]
+    return [peer_class.model_validate(model) for model in rows]
+
 class Client(BaseModel):
     """
     Client class for managing user data and associated peers in the database.
@@ -47,6 +156,7 @@ class Client(BaseModel):
             raise AttributeError("model attribute was not found in kwargs.")
         self.__model = kwargs["model"]
 
+    @invalidates_client
     @core_logger.catch()
     def __update_client(self, **kwargs) -> bool:
         """
@@ -62,6 +172,7 @@ class Client(BaseModel):
                 .where(UserModel.user_id == self.userdata.user_id)
                 .execute()) == 1
 
+    @invalidates_client
     @core_logger.catch()
     def __add_peer(self,
                    peer_name: str,
@@ -122,6 +233,7 @@ class Client(BaseModel):
                 core_logger.exception(f"Error while adding peer: {e}")
                 return None
 
+    @invalidates_client
     def __update_peer(self, peer_id: int, **kwargs) -> bool:
         """
         Updates information for a specific peer in the database.
@@ -151,6 +263,10 @@ class Client(BaseModel):
             else:
                 protocol_specific_fields[k] = v
 
+        if "shared_ips" in protocol_specific_fields:
+            protocol_specific_fields["ipv4"], protocol_specific_fields["ipv4_mask"] = \
+                parse_ipv4_interface(protocol_specific_fields["shared_ips"]) or (None, 32)
+
         with db.atomic() as transaction:
             try:
                 if peer_fields:
@@ -177,6 +293,7 @@ class Client(BaseModel):
                         case _:
                             core_logger.warning(f"Unknown protocol type: {protocol}")
                             return False
+                return True
             except Exception as e:
                 transaction.rollback()
                 core_logger.error(f"Error while updating peer: {e}")
@@ -192,7 +309,8 @@ class Client(BaseModel):
             peer_name: Optional[str] = None
         ) -> Optional[WireguardPeer]:
         """
-        Adds wireguard peer to database. Automatically generates peer keys if they're not present in arguments.
+        Adds wireguard peer to database. Peer keys that are not present in arguments
+        are taken from `key_pool`, so the peer is created without waiting for key generation.
 
         Args:
             shared_ips (str): Comma-separated list of IPs.
@@ -208,9 +326,16 @@ class Client(BaseModel):
         wireguard_args = {
             "shared_ips": shared_ips
         }
-        wireguard_args["private_key"] = private_key or generate_private_key(is_amnezia=is_amnezia)
-        wireguard_args["public_key"] = public_key or generate_public_key(wireguard_args["private_key"], is_amnezia=is_amnezia)
-        wireguard_args["preshared_key"] = preshared_key or generate_preshared_key(is_amnezia=is_amnezia)
+        wireguard_args["ipv4"], wireguard_args["ipv4_mask"] = parse_ipv4_interface(shared_ips) or (None, 32)
+        if private_key:
+            wireguard_args["private_key"] = private_key
+            wireguard_args["public_key"] = public_key or generate_public_key(private_key, is_amnezia=is_amnezia)
+            wireguard_args["preshared_key"] = preshared_key or generate_preshared_key(is_amnezia=is_amnezia)
+        else:
+            keys = key_pool.pop()
+            wireguard_args["private_key"] = keys.private_key
+            wireguard_args["public_key"] = public_key or keys.public_key
+            wireguard_args["preshared_key"] = preshared_key or keys.preshared_key
 
         if not peer_name:
             peer_name = f"{self.userdata.name}_{ClientFactory.get_latest_peer_id() + 1}"
@@ -228,11 +353,15 @@ class Client(BaseModel):
         wireguard_args["Jmin"] = Jmin
         wireguard_args["Jmax"] = Jmax
 
-        return self.__add_peer(
+        peer_type = ProtocolType.AMNEZIA_WIREGUARD if is_amnezia else ProtocolType.WIREGUARD
+        peer = self.__add_peer(
             peer_name=peer_name,
-            peer_type=ProtocolType.AMNEZIA_WIREGUARD if is_amnezia else ProtocolType.WIREGUARD,
+            peer_type=peer_type,
             **wireguard_args
         )
+        if peer:
+            service_stats.add_peer(peer.peer_id, self.userdata.user_id, peer_type, peer.peer_status)
+        return peer
 
     def add_xray_peer(self, flow: str, inbound_id: int, peer_name: Optional[str] = None) -> XrayPeer:
         if not peer_name:
@@ -244,6 +373,8 @@ class Client(BaseModel):
             flow=flow,
             inbound_id=inbound_id,
         )
+        if peer:
+            service_stats.add_peer(peer.peer_id, self.userdata.user_id, ProtocolType.XRAY, peer.peer_status)
         with core_logger.contextualize(peer=peer):
             core_logger.info(f"New peer was created.")
         return peer
@@ -251,8 +382,9 @@ class Client(BaseModel):
     def __get_peers(
             self,
             protocol_type: Optional[ProtocolType] = None,
-            *criteria
-        ) -> Optional[list[Union[PeersTableModel, WireguardPeerModel, XrayPeerModel]]]:
+            *criteria,
+            trusted: bool = False
+        ) -> Union[list[BasePeer], list[WireguardPeer], list[XrayPeer]]:
         """
         Retrieve peers from the database based on protocol type and additional criteria.
 
@@ -261,62 +393,42 @@ class Client(BaseModel):
 
         Args:
             protocol_type (Optional[ProtocolType]): The protocol type to filter peers by.
-                If specified as WIREGUARD or AMNEZIA_WIREGUARD, returns WireguardPeerModel data.
-                If specified as XRAY, returns XrayPeerModel data.
-                If None or any other value, returns basic PeersTableModel data.
+                If specified as WIREGUARD or AMNEZIA_WIREGUARD, returns `WireguardPeer`s.
+                If specified as XRAY, returns `XrayPeer`s.
+                If None or any other value, returns `BasePeer`s.
             *criteria: Additional criteria to filter the query results.
+            trusted (bool): If True, peers are built from plain rows without validation.
+                See `BasePeer.from_row`. Defaults to False.
 
         Returns:
-            Optional[list[Union[PeersTableModel, WireguardPeerModel, XrayPeerModel]]]:
-                A list of peer models matching the specified criteria. The model type depends on
-                the protocol_type parameter. Returns None if no peers are found.
+            Union[list[BasePeer], list[WireguardPeer], list[XrayPeer]]:
+                A list of serialized peers matching the specified criteria.
         """
         match protocol_type:
             case ProtocolType.WIREGUARD | ProtocolType.AMNEZIA_WIREGUARD:
-                return list(
-                    WireguardPeerModel.select(
-                        PeersTableModel,
-                        WireguardPeerModel,
-                        PeersTableModel.id.alias("peer_id")
-                    )
-                    .join(
-                        PeersTableModel,
-                        on=(PeersTableModel.id == WireguardPeerModel.peer)
-                    )
-                    .where(PeersTableModel.user == self.__model, *criteria)
-                )
+                peer_class, query = WireguardPeer, select_wireguard_peers(trusted)
             case ProtocolType.XRAY:
-                return list(XrayPeerModel.select(
-                                PeersTableModel,
-                                XrayPeerModel,
-                                PeersTableModel.id.alias("peer_id")
-                            )
-                            .join(
-                                PeersTableModel,
-                                on=(PeersTableModel.id == XrayPeerModel.peer)
-                            )
-                            .where(PeersTableModel.user == self.__model, *criteria)
-                            )
+                peer_class, query = XrayPeer, select_xray_peers(trusted)
             case _:
-                return list(PeersTableModel.select()
-                            .where(PeersTableModel.user == self.__model, *criteria)
-                            )
+                peer_class, query = BasePeer, select_base_peers(trusted)
+
+        query = query.where(PeersTableModel.user == self.__model, *criteria)
+        with reader() as database:
+            return serialize_peers(peer_class, query.bind(database), trusted)
 
     @core_logger.catch()
-    def get_wireguard_peers(self, is_amnezia: bool) -> list[WireguardPeer]:
+    def get_wireguard_peers(self, is_amnezia: bool, trusted: bool = False) -> list[WireguardPeer]:
         # is_amnezia doesn't really matter here, but it's here for consistency
-        peer_models = self.__get_peers(ProtocolType.WIREGUARD if not is_amnezia
-                                       else ProtocolType.AMNEZIA_WIREGUARD)
+        return self.__get_peers(ProtocolType.WIREGUARD if not is_amnezia
+                                else ProtocolType.AMNEZIA_WIREGUARD, trusted=trusted)
 
-        return [WireguardPeer.model_validate(model) for model in peer_models]
-
-    def get_xray_peers(self) -> list[XrayPeer]:
-        peer_models = self.__get_peers(ProtocolType.XRAY)
-        return [XrayPeer.model_validate(model) for model in peer_models]
+    def get_xray_peers(self, trusted: bool = False) -> list[XrayPeer]:
+        return self.__get_peers(ProtocolType.XRAY, trusted=trusted)
 
     def get_all_peers(
             self,
-            protocol_specific: bool = False
+            protocol_specific: bool = False,
+            trusted: bool = False
         ) -> Union[list[BasePeer], list[Union[WireguardPeer, XrayPeer]]]:
         """
         Retrieve all peers from the database.
@@ -326,18 +438,29 @@ class Client(BaseModel):
             protocol_specific (bool):
                 If True, returns protocol specific Wireguard and Xray peer models.
                 If False, returns base peer models. Defaults to False.
+            trusted (bool):
+                If True, peers are built from plain rows without validation. Defaults to False.
         Returns:
             Union[list[BasePeer], list[Union[WireguardPeer, XrayPeer]]]: A list of peers.
             When `protocol_specific` is False, returns a list of `BasePeer` objects.
             When `protocol_specific` is True, returns a concatenated list of `WireguardPeer` and `XrayPeer` objects.
+
+        Note:
+            Results are cached in `client_cache` until the client or its peers are changed.
         """
+        # peers built without validation aren't handed to callers that asked for validated ones
+        variant = (protocol_specific, trusted)
+        peers = client_cache.get_peers(self.userdata.user_id, variant)
+        if peers is not None:
+            return peers
+
         if protocol_specific:
-            return self.get_wireguard_peers(is_amnezia=True) + self.get_xray_peers()
+            peers = self.get_wireguard_peers(is_amnezia=True, trusted=trusted) + self.get_xray_peers(trusted=trusted)
+        else:
+            peers = self.__get_peers(trusted=trusted)
 
-        return [
-            BasePeer.model_validate(model)
-            for model in self.__get_peers()
-        ]
+        client_cache.put_peers(self.userdata.user_id, variant, peers)
+        return peers
 
     @core_logger.catch()
     def change_peer_name(self, peer_id: int, peer_name: str) -> bool:
@@ -348,34 +471,53 @@ class Client(BaseModel):
 
     def set_status(self, status: ClientStatusChoices) -> bool:
         self.userdata.status = status
-        return self.__update_client(status=status.value)
+        for buffer in status_buffers:
+            buffer.discard_client_status(self.userdata.user_id)
+        result = self.__update_client(status=status.value)
+        if result:
+            service_stats.set_client_status(self.userdata.user_id, status)
+        return result
 
     def set_expire_time(self, expire_time: datetime.datetime) -> bool:
         self.userdata.expire_time = expire_time
         core_logger.info(f"Setting expire time to {expire_time} for user {self.userdata.user_id}")
         return self.__update_client(expire_time=expire_time)
 
+    def set_traffic_limit(self, traffic_limit: Optional[int]) -> bool:
+        """Sets the traffic quota of the user in bytes, `None` brings back the global one."""
+        self.userdata.traffic_limit = traffic_limit
+        core_logger.info(f"Setting traffic limit to {traffic_limit} for user {self.userdata.user_id}")
+        return self.__update_client(traffic_limit=traffic_limit)
+
     @core_logger.catch()
     def set_peer_status(self, peer_id: int, peer_status: PeerStatusChoices) -> bool:
+        for buffer in status_buffers:
+            buffer.discard_peer_status(peer_id)
         result = self.__update_peer(peer_id, peer_status=peer_status.value)
+        if result:
+            service_stats.set_peer_status(peer_id, peer_status)
         with core_logger.contextualize(peer_id=peer_id, result=result):
             core_logger.debug(f"Tried to change peer status to {peer_status}")
         return result
 
     @core_logger.catch()
     def set_peer_timer(self, peer_id: int, time: datetime.datetime) -> bool:
+        for buffer in status_buffers:
+            buffer.discard_peer_timer(peer_id)
         result = self.__update_peer(peer_id, peer_timer=time)
         with core_logger.contextualize(peer_id=peer_id, result=result):
             core_logger.debug(f"Tried to change peer timer to {time}")
         return result
 
     @core_logger.catch()
-    def get_connected_peers(self) -> list[BasePeer]:
-        return [
-            BasePeer.model_validate(model)
-            for model in self.__get_peers(None, PeersTableModel.peer_status == PeerStatusChoices.STATUS_CONNECTED.value)
-        ]
+    def get_connected_peers(self, trusted: bool = False) -> list[BasePeer]:
+        return self.__get_peers(
+            None,
+            PeersTableModel.peer_status == PeerStatusChoices.STATUS_CONNECTED.value,
+            trusted=trusted
+        )
 
+    @invalidates_client
     def delete_peers(self) -> bool:
         """
         Deletes all peer records associated with the current user from the database.
@@ -383,10 +525,13 @@ class Client(BaseModel):
         Returns:
             bool: True if operation was successfully executed, False otherwise.
         """
-        return (PeersTableModel.delete()
-                .where(PeersTableModel.user == self.userdata.user_id)
-                .execute()) == 1
+        result = (PeersTableModel.delete()
+                  .where(PeersTableModel.user == self.userdata.user_id)
+                  .execute()) == 1
+        service_stats.remove_client_peers(self.userdata.user_id)
+        return result
 
+    @invalidates_client
     def delete_wireguard_peer_by_ip(self, ip_address: str) -> bool:
         """Delete wireguard peer by `ip_address`
 
@@ -395,20 +540,16 @@ class Client(BaseModel):
         Returns:
             bool: True if successful. False otherwise
         """
-        # format IP for regex pattern
-        formatted_ip = ip_address.replace(".", "\\.")
-
         try:
             peer = (PeersTableModel
                    .select()
                    .join(WireguardPeerModel)
-                   .where(WireguardPeerModel.shared_ips.regexp(
-                       rf"(?:[, ]|^){formatted_ip}(?:[, ]|$)"
-                   ) )
+                   .where(wireguard_ip_condition(ip_address))
                    .where(PeersTableModel.user == self.__model)
                    .get())
 
             peer.delete_instance()
+            service_stats.remove_peer(peer.id)
             return True
         except DoesNotExist:
             core_logger.info(f"Wireguard peer with IP {ip_address} not found.")
@@ -439,10 +580,12 @@ class ClientFactory(BaseModel):
             if model.name != name:
                 model.name = name
                 model.save()
+                client_cache.invalidate(self.user_id)
                 with core_logger.contextualize(model=model):
                     core_logger.info(f"User has changed his username, updating it in DB")
         except DoesNotExist:
             model: UserModel = UserModel.create(user_id=self.user_id, name=name, **kwargs)
+            service_stats.set_client_status(model.user_id, ClientStatusChoices(model.status))
             with core_logger.contextualize(model=model):
                 core_logger.info(f"New user was created.")
             created = True
@@ -457,11 +600,7 @@ class ClientFactory(BaseModel):
             Optional[Client]: A Client instance containing the user model and validated user data,
                              or None if the user does not exist in the database.
         """
-        try:
-            model = UserModel.get(UserModel.user_id == self.user_id)
-            return Client(model=model, userdata=User.model_validate(model))
-        except DoesNotExist:
-            return None
+        return ClientFactory.get_client_by_id(self.user_id)
 
     @staticmethod
     def get_client_by_id(user_id: Union[int, str]) -> Optional[Client]:
@@ -474,13 +613,24 @@ class ClientFactory(BaseModel):
         Returns:
             Optional[Client]: A Client instance containing the user model and validated user data,
                              or None if the user does not exist in the database.
+
+        Note:
+            Clients are cached in `client_cache`, so repeated calls return the same instance
+            until the client is changed.
         """
+        if client := client_cache.get_client(user_id):
+            return client
+
         try:
-            model = UserModel.get(UserModel.user_id == user_id)
-            return Client(model=model, userdata=User.model_validate(model))
+            with reader() as database:
+                model = UserModel.select().where(UserModel.user_id == user_id).bind(database).get()
         except DoesNotExist:
             return None
 
+        client = Client(model=model, userdata=User.model_validate(model))
+        client_cache.put_client(client)
+        return client
+
     @staticmethod
     def select_clients() -> list[Client]:
         """
@@ -489,7 +639,101 @@ class ClientFactory(BaseModel):
         Returns:
             list[Client]: A list of Client objects.
         """
-        return [Client(model=i, userdata=User.model_validate(i)) for i in UserModel.select()]
+        with reader() as database:
+            return [Client(model=i, userdata=User.model_validate(i)) for i in UserModel.select().bind(database)]
+
+    @staticmethod
+    def select_expiring_clients(
+            until: datetime.datetime,
+            since: Optional[datetime.datetime] = None
+        ) -> list[Client]:
+        """
+        Retrieves not blocked clients whose `expire_time` is before `until`.
+        Uses the index on `UserModel.expire_time`, so only expiring clients are read.
+
+        Args:
+            until (datetime.datetime): Clients expiring at this moment or later are skipped.
+            since (Optional[datetime.datetime]): If present, clients that expired before this moment are skipped.
+
+        Returns:
+            list[Client]: Expiring clients ordered by `expire_time`.
+        """
+        query = (UserModel.select()
+                 .where(UserModel.expire_time < until,
+                        UserModel.status != ClientStatusChoices.STATUS_ACCOUNT_BLOCKED.value)
+                 .order_by(UserModel.expire_time))
+        if since is not None:
+            query = query.where(UserModel.expire_time >= since)
+
+        with reader() as database:
+            return [Client(model=model, userdata=User.model_validate(model)) for model in query.bind(database)]
+
+    @staticmethod
+    def block_expired_clients(until: datetime.datetime) -> list[Client]:
+        """
+        Marks every not blocked client whose `expire_time` is before `until` as
+        `ClientStatusChoices.STATUS_ACCOUNT_BLOCKED` with a single `UPDATE ... RETURNING`,
+        so the clients are selected and blocked by the same statement on the writer connection.
+
+        Peers of the clients are left untouched, disable them afterwards.
+
+        Returns:
+            list[Client]: Blocked clients with the updated status, ordered by `expire_time`.
+        """
+        blocked = (UserModel.update(status=ClientStatusChoices.STATUS_ACCOUNT_BLOCKED.value)
+                   .where(UserModel.expire_time < until,
+                          UserModel.status != ClientStatusChoices.STATUS_ACCOUNT_BLOCKED.value)
+                   .returning(UserModel)
+                   .execute())
+        clients = [Client(model=model, userdata=User.model_validate(model))
+                   for model in sorted(blocked, key=lambda model: model.expire_time)]
+
+        for client in clients:
+            client_cache.invalidate(client.userdata.user_id)
+            service_stats.set_client_status(client.userdata.user_id, ClientStatusChoices.STATUS_ACCOUNT_BLOCKED)
+        return clients
+
+    @staticmethod
+    def select_clients_with_peers(
+            trusted: bool = False,
+            user_ids: Optional[Iterable[Union[int, str]]] = None
+        ) -> list[tuple[Client, list[Union[WireguardPeer, XrayPeer]]]]:
+        """
+        Retrieves all clients together with their protocol specific peers.
+
+        Unlike calling `Client.get_all_peers` for every client, this method issues a fixed number
+        of queries (users, Wireguard peers and Xray peers) regardless of the number of clients
+        and groups the peers by their owners in memory.
+
+        Args:
+            trusted (bool): If True, peers are built from plain rows without validation.
+                See `BasePeer.from_row`. Defaults to False.
+            user_ids (Optional[Iterable[Union[int, str]]]): If present, only these clients are selected.
+
+        Returns:
+            list[tuple[Client, list[Union[WireguardPeer, XrayPeer]]]]:
+                A list of `(Client, peers)` tuples. Peers are ordered the same way
+                `Client.get_all_peers(protocol_specific=True)` orders them: Wireguard peers first, then Xray peers.
+        """
+        peers_by_user: dict[str, list[Union[WireguardPeer, XrayPeer]]] = defaultdict(list)
+        users_query = UserModel.select()
+        peers_criteria = []
+        if user_ids is not None:
+            user_ids = [str(user_id) for user_id in user_ids]
+            users_query = users_query.where(UserModel.user_id.in_(user_ids))
+            peers_criteria.append(PeersTableModel.user.in_(user_ids))
+
+        with reader() as database:
+            for peer_class, query in ((WireguardPeer, select_wireguard_peers(trusted)),
+                                      (XrayPeer, select_xray_peers(trusted))):
+                query = query.where(*peers_criteria) if peers_criteria else query
+                for peer in serialize_peers(peer_class, query.bind(database), trusted):
+                    peers_by_user[peer.user_id].append(peer)
+
+            return [
+                (Client(model=model, userdata=User.model_validate(model)), peers_by_user.get(model.user_id, []))
+                for model in users_query.bind(database)
+            ]
 
     @staticmethod
     def get_peer_by_id(peer_id: int, protocol_specific: bool = False) -> Optional[BasePeer]:
@@ -511,6 +755,14 @@ class ClientFactory(BaseModel):
             core_logger.exception(f"Error while getting peer: {e}")
             return None
 
+    @staticmethod
+    def __select_wireguard_peer_by_ip(ip_address: str):
+        """
+        Builds a query that selects a Wireguard peer (joined with its base peer) by IP address.
+        Uses the unique index on `WireguardPeerModel.ipv4`, so the lookup doesn't scan the table.
+        """
+        return select_wireguard_peers().where(wireguard_ip_condition(ip_address))
+
     @staticmethod
     def get_peer_by_ip(ip_address: str) -> Optional[WireguardPeer]:
         """
@@ -524,7 +776,8 @@ class ClientFactory(BaseModel):
                 Returns None if the peer doesn't exist or if there's an error during retrieval.
         """
         try:
-            model = WireguardPeerModel.get(WireguardPeerModel.shared_ips == ip_address)
+            with reader() as database:
+                model = ClientFactory.__select_wireguard_peer_by_ip(ip_address).bind(database).get()
             return WireguardPeer.model_validate(model)
         except DoesNotExist:
             return None
@@ -535,7 +788,8 @@ class ClientFactory(BaseModel):
     @staticmethod
     def get_wireguard_peer(ip_address: str) -> Optional[WireguardPeer]:
         try:
-            model = WireguardPeerModel.get(WireguardPeerModel.shared_ips == ip_address)
+            with reader() as database:
+                model = ClientFactory.__select_wireguard_peer_by_ip(ip_address).bind(database).get()
             return WireguardPeer.model_validate(model)
         except DoesNotExist:
             return None
@@ -549,16 +803,20 @@ class ClientFactory(BaseModel):
             return None
 
     def delete_client(self) -> bool:
-        return UserModel.delete_by_id(self.user_id)
+        return ClientFactory.delete_client_by_id(self.user_id)
 
     @staticmethod
     def delete_client_by_id(user_id: Union[int, str]) -> bool:
-        return UserModel.delete_by_id(user_id)
+        result = UserModel.delete_by_id(user_id)
+        client_cache.invalidate(user_id)
+        service_stats.remove_client(user_id)
+        return result
 
     @staticmethod
     def count_clients() -> int:
         """Returns the number of clients in the database."""
-        return UserModel.select().count()
+        with reader() as database:
+            return UserModel.select().bind(database).count()
 
     @staticmethod
     def get_latest_peer_id() -> int:
@@ -570,13 +828,16 @@ class ClientFactory(BaseModel):
 
     @staticmethod
     def get_used_ip_addresses() -> list[str]:
-        return [i.shared_ips for i in WireguardPeerModel.select(WireguardPeerModel.shared_ips)]
+        with reader() as database:
+            return [i.shared_ips for i in WireguardPeerModel.select(WireguardPeerModel.shared_ips).bind(database)]
 
     @staticmethod
     def delete_peer(peer: BasePeer) -> Union[BasePeer, bool]:
         try:
             p = PeersTableModel.get(PeersTableModel.id == peer.peer_id)
             p.delete_instance()
+            client_cache.invalidate(p.user_id)
+            service_stats.remove_peer(p.id)
             return p
         except DoesNotExist:
             core_logger.info(f"Peer with ID {peer.peer_id} not found.")
@@ -619,6 +880,8 @@ class ClientFactory(BaseModel):
 
             # actually deleting the row from every table because of cascading
             peer.delete_instance()
+            client_cache.invalidate(peer.user_id)
+            service_stats.remove_peer(peer_id)
             return serialized_model
         except DoesNotExist:
             core_logger.info(f"Peer with ID {peer_id} not found.")
@@ -1,11 +1,17 @@
 import datetime
-from typing import Optional, Union
+from typing import Iterable, Optional, Union
 
+from peewee import ModelSelect
 from pydantic import BaseModel
 
 from core.db.enums import ClientStatusChoices, PeerStatusChoices
 from core.db.model_serializer import BasePeer, User, WireguardPeer, XrayPeer
 
+def select_wireguard_peers(trusted: bool = False) -> ModelSelect: ...
+def select_xray_peers(trusted: bool = False) -> ModelSelect: ...
+def select_base_peers(trusted: bool = False) -> ModelSelect: ...
+def serialize_peers(peer_class: type[BasePeer], rows: Iterable, trusted: bool = False) -> list: ...
+
 class Client(BaseModel):
     userdata: User
 
@@ -22,11 +28,12 @@ class Client(BaseModel):
     def delete_wireguard_peer_by_ip(self, ip_address: str) -> bool: ...
     def get_all_peers(
             self,
-            protocol_specific: bool = False
+            protocol_specific: bool = False,
+            trusted: bool = False
         ) -> Union[list[BasePeer], list[Union[WireguardPeer, XrayPeer]]]: ...
-    def get_wireguard_peers(self, is_amnezia: bool) -> list[WireguardPeer]: ...
-    def get_xray_peers(self) -> list[XrayPeer]: ...
-    def get_connected_peers(self) -> list[BasePeer]: ...
+    def get_wireguard_peers(self, is_amnezia: bool, trusted: bool = False) -> list[WireguardPeer]: ...
+    def get_xray_peers(self, trusted: bool = False) -> list[XrayPeer]: ...
+    def get_connected_peers(self, trusted: bool = False) -> list[BasePeer]: ...
     def set_status(self, status: ClientStatusChoices) -> bool: ...
     def set_expire_time(self, expire_date: datetime.datetime) -> bool: ...
     def set_peer_status(self, peer_id: int, peer_status: PeerStatusChoices) -> None: ...
@@ -42,6 +49,18 @@ class ClientFactory(BaseModel):
 
     @staticmethod
     def select_clients() -> list[Client]: ...
+    @staticmethod
+    def select_expiring_clients(
+        until: datetime.datetime,
+        since: Optional[datetime.datetime] = None
+    ) -> list[Client]: ...
+    @staticmethod
+    def block_expired_clients(until: datetime.datetime) -> list[Client]: ...
+    @staticmethod
+    def select_clients_with_peers(
+        trusted: bool = False,
+        user_ids: Optional[Iterable[Union[int, str]]] = None
+    ) -> list[tuple[Client, list[Union[WireguardPeer, XrayPeer]]]]: ...
 
     @staticmethod
     def get_peer_by_id(peer_id: int, protocol_specific: bool = False) \
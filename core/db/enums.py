@@ -9,6 +9,7 @@ class ClientStatusChoices(Enum):
     STATUS_TIME_EXPIRED = 3
     STATUS_CONNECTED = 4
     STATUS_DISCONNECTED = 5
+    STATUS_QUOTA_EXCEEDED = 6
 
 
     @staticmethod
@@ -27,6 +28,8 @@ class ClientStatusChoices(Enum):
                 return "Подключён к сети"
             case status.STATUS_DISCONNECTED:
                 return "Отключён от сети"
+            case status.STATUS_QUOTA_EXCEEDED:
+                return "Лимит трафика исчерпан"
             case _:
                 return "Ты как сюда попал, дурной?"
 
@@ -0,0 +1,76 @@
+from peewee import BigIntegerField, Database, IntegerField
+from playhouse.migrate import SqliteMigrator, migrate
+
+from core.logs import core_logger
+from core.utils.ip_utils import parse_ipv4_interface
+
+
+def migrate_db(database: Database) -> None:
+    """
+    Brings the schema of an existing database up to date with the models.
+    Every migration is idempotent and does nothing on a fresh database,
+    since `create_tables` creates the tables with the latest schema.
+
+    Args:
+        database (Database): Connected database instance.
+    """
+    add_wireguard_ipv4_columns(database)
+    add_user_traffic_limit_column(database)
+
+def add_wireguard_ipv4_columns(database: Database) -> None:
+    """
+    Adds the `ipv4` and `ipv4_mask` columns to the `WireguardPeers` table
+    and backfills them from `shared_ips`.
+
+    Note:
+        The unique index on `ipv4` is created afterwards by `create_tables`.
+        If several peers share the same address, only the first one gets the `ipv4` value,
+        the others are left with NULL so the index can still be created.
+    """
+    if not database.table_exists("WireguardPeers"):
+        return
+
+    columns = {column.name for column in database.get_columns("WireguardPeers")}
+    if "ipv4" in columns:
+        return
+
+    migrator = SqliteMigrator(database)
+    with database.atomic():
+        migrate(
+            migrator.add_column("WireguardPeers", "ipv4", IntegerField(default=None, null=True)),
+            migrator.add_column("WireguardPeers", "ipv4_mask", IntegerField(default=32)),
+        )
+
+        seen_addresses = set()
+        rows = database.execute_sql('SELECT "id", "shared_ips" FROM "WireguardPeers"').fetchall()
+        for row_id, shared_ips in rows:
+            parsed = parse_ipv4_interface(shared_ips or "")
+            if parsed is None:
+                core_logger.warning(f"Couldn't parse IPv4 address of Wireguard peer {row_id}: {shared_ips}")
+                continue
+            if parsed[0] in seen_addresses:
+                core_logger.warning(f"Wireguard peer {row_id} shares IP address {shared_ips} with another peer.")
+                continue
+            seen_addresses.add(parsed[0])
+            database.execute_sql(
+                'UPDATE "WireguardPeers" SET "ipv4" = ?, "ipv4_mask" = ? WHERE "id" = ?',
+                (*parsed, row_id)
+            )
+
+    core_logger.info(f"Migrated {len(rows)} Wireguard peers: added indexed IPv4 column.")
+
+def add_user_traffic_limit_column(database: Database) -> None:
+    """
+    Adds the nullable `traffic_limit` column to the `Users` table.
+    Existing users get NULL, so they keep the global traffic quota.
+    """
+    if not database.table_exists("Users"):
+        return
+
+    columns = {column.name for column in database.get_columns("Users")}
+    if "traffic_limit" in columns:
+        return
+
+    migrator = SqliteMigrator(database)
+    migrate(migrator.add_column("Users", "traffic_limit", BigIntegerField(default=None, null=True)))
+    core_logger.info("Migrated users: added per-user traffic limit column.")
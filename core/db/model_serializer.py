@@ -1,11 +1,14 @@
 from datetime import datetime
-from typing import Any, Optional, Union
+from typing import Any, ClassVar, Optional, Union
 
 from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 from core.db.enums import ClientStatusChoices, PeerStatusChoices, ProtocolType
 from core.db.models import PeersTableModel
 
+_PEER_TYPES = {protocol.value: protocol for protocol in ProtocolType}
+_PEER_STATUSES = {status.value: status for status in PeerStatusChoices}
+
 
 class User(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -15,6 +18,7 @@ class User(BaseModel):
     registered_at: datetime
     status: ClientStatusChoices
     expire_time: Optional[datetime] = Field(default=None)
+    traffic_limit: Optional[int] = Field(default=None)
 
 
 class BasePeer(BaseModel):
@@ -52,6 +56,29 @@ class BasePeer(BaseModel):
     peer_status: PeerStatusChoices = Field()
     peer_timer: Optional[datetime] = Field(default=None)
 
+    ROW_FIELDS: ClassVar[tuple[str, ...]] = (
+        "id", "user_id", "peer_id", "peer_name", "peer_type", "peer_status", "peer_timer"
+    )
+    """Order of the columns in a row accepted by `from_row`"""
+
+    @classmethod
+    def from_row(cls, row: tuple):
+        """
+        Builds the model from a database row without validation.
+
+        Use it only for rows that come straight from our own schema: the values are trusted,
+        so only enum columns are converted and everything else is stored as is.
+        Compared to `model_validate` it skips the `apply_peer_fields` validator and field validation,
+        which makes it several times faster on large selections.
+
+        Args:
+            row (tuple): Column values in the `ROW_FIELDS` order.
+        """
+        data = dict(zip(cls.ROW_FIELDS, row))
+        data["peer_type"] = _PEER_TYPES[data["peer_type"]]
+        data["peer_status"] = _PEER_STATUSES[data["peer_status"]]
+        return cls.model_construct(**data)
+
     @model_validator(mode="before")
     @classmethod
     def apply_peer_fields(cls, data):
@@ -97,6 +124,10 @@ class WireguardPeer(BasePeer):
     Jmin: Optional[int] = Field(default=None)
     Jmax: Optional[int] = Field(default=None)
 
+    ROW_FIELDS: ClassVar[tuple[str, ...]] = BasePeer.ROW_FIELDS + (
+        "public_key", "private_key", "preshared_key", "shared_ips", "is_amnezia", "Jc", "Jmin", "Jmax"
+    )
+
 class XrayPeer(BasePeer):
     """A data model representing an XRay peer configuration.
     This class extends BasePeer and defines the structure for XRay peer data,
@@ -110,3 +141,5 @@ class XrayPeer(BasePeer):
     # Xray fields
     inbound_id: int
     flow: str
+
+    ROW_FIELDS: ClassVar[tuple[str, ...]] = BasePeer.ROW_FIELDS + ("inbound_id", "flow")
@@ -1,13 +1,24 @@
 import datetime
+from contextlib import contextmanager
+from typing import Iterator, Optional
 
-from peewee import (BooleanField, CharField, DateTimeField, ForeignKeyField,
-                    IntegerField, Model)
+from peewee import (BigIntegerField, BooleanField, CharField, DateField,
+                    DateTimeField, ForeignKeyField, IntegerField, Model)
+from playhouse.pool import PooledSqliteExtDatabase
 from playhouse.sqlite_ext import AutoIncrementField, SqliteExtDatabase
 
+from core.db.cache import client_cache
 from core.db.enums import ClientStatusChoices, PeerStatusChoices, ProtocolType
+from core.db.migrations import migrate_db
 from core.logs import core_logger
 
-db = SqliteExtDatabase(None, regexp_function=True)
+db = SqliteExtDatabase(None)
+"""Writer connection. Every model is bound to it."""
+read_db = PooledSqliteExtDatabase(None)
+"""Small pool of read-only connections for heavy read paths. Stays uninitialized for in-memory databases."""
+
+READER_PRAGMAS = ("cache_size", "mmap_size", "busy_timeout")
+"""Pragmas that are applied to the read-only connections as well"""
 
 class BaseModel(Model):
     class Meta:
@@ -21,9 +32,13 @@ class UserModel(BaseModel):
         default=ClientStatusChoices.STATUS_CREATED.value,
         choices=tuple(
             (status.value, status.name) for status in ClientStatusChoices
-        )
+        ),
+        index=True
     )
-    expire_time = DateTimeField(default=None, null=True)
+    expire_time = DateTimeField(default=None, null=True, index=True)
+    """Indexed for the nightly expiration job, see `ClientFactory.select_expiring_clients`"""
+    traffic_limit = BigIntegerField(default=None, null=True)
+    """Max traffic per quota period in bytes, NULL means the global `traffic_quota_gb`. See `QuotaEngine`"""
     registered_at = DateTimeField(default=datetime.datetime.now)
 
     class Meta:
@@ -59,6 +74,10 @@ class WireguardPeerModel(BaseModel):
     private_key = CharField()
     preshared_key = CharField()
     shared_ips = CharField()
+    ipv4 = IntegerField(default=None, null=True, unique=True)
+    """First IPv4 address of `shared_ips` as an integer. Indexed, use it for lookups by IP address."""
+    ipv4_mask = IntegerField(default=32)
+    """Prefix length of the `ipv4` address"""
 
     # AmneziaWG-specific fields
     is_amnezia = BooleanField(default=False)
@@ -81,9 +100,134 @@ class XrayPeerModel(BaseModel):
         table_name = "XrayPeers"
 
 
-def init_db(path: str):
-    db.init(database=path, pragmas={"foreign_keys": 1})
+class PeerSessionModel(BaseModel):
+    """Finished connection session of a peer. Rows are only appended, see `core.db.sessions.SessionWriter`."""
+    peer = ForeignKeyField(PeersTableModel, backref="sessions", on_delete="CASCADE")
+    started_at = DateTimeField()
+    ended_at = DateTimeField(index=True)
+    """Indexed for the compaction job, see `compact_sessions`"""
+    end_status = IntegerField(
+        choices=tuple(
+            (status.value, status.name) for status in PeerStatusChoices
+        )
+    )
+    """Status the peer got when the session ended, e.g. `PeerStatusChoices.STATUS_TIME_EXPIRED`"""
+
+    class Meta:
+        table_name = "PeerSessions"
+        indexes = (
+            (("peer", "started_at"), False),
+        )
+
+
+class PeerSessionRollupModel(BaseModel):
+    """Daily totals of compacted `PeerSessionModel` rows."""
+    peer = ForeignKeyField(PeersTableModel, backref="session_rollups", on_delete="CASCADE")
+    day = DateField()
+    sessions = IntegerField(default=0)
+    online_seconds = IntegerField(default=0)
+
+    class Meta:
+        table_name = "PeerSessionRollups"
+        indexes = (
+            (("peer", "day"), True),
+        )
+
+
+class PeerTrafficModel(BaseModel):
+    """Daily traffic of a peer, rolled up by `core.db.traffic.TrafficAccounting`. Directions are seen from the server."""
+    peer = ForeignKeyField(PeersTableModel, backref="traffic", on_delete="CASCADE")
+    day = DateField(index=True)
+    """Indexed for the top users query, see `TrafficAccounting.top_users`"""
+    rx_bytes = BigIntegerField(default=0)
+    """Bytes received from the peer, i.e. uploaded by the user"""
+    tx_bytes = BigIntegerField(default=0)
+    """Bytes sent to the peer, i.e. downloaded by the user"""
+
+    class Meta:
+        table_name = "PeerTraffic"
+        indexes = (
+            (("peer", "day"), True),
+        )
+
+
+def init_db(path: str, pragmas: Optional[dict] = None, read_pool_size: int = 4, client_cache_size: int = 1024):
+    """
+    Initializes the writer connection and the pool of read-only connections.
+
+    Args:
+        path (str): Path to the database file. `:memory:` disables the read pool,
+            since in-memory databases can't be shared between connections.
+        pragmas (Optional[dict]): SQLite pragmas, e.g. `journal_mode`, `synchronous`, `busy_timeout`.
+            `foreign_keys` is always enabled.
+        read_pool_size (int): Max number of read-only connections. Defaults to 4.
+        client_cache_size (int): Max number of users in `client_cache`. 0 disables the cache. Defaults to 1024.
+    """
+    pragmas = {"foreign_keys": 1, **(pragmas or {})}
+    # sqlite3 waits `timeout` seconds on a locked database before failing, keep it in sync with busy_timeout
+    timeout = pragmas.get("busy_timeout", 5000) / 1000
+
+    db.init(database=path, pragmas=pragmas, timeout=timeout)
     db.connect()
-    db.create_tables((UserModel, PeersTableModel, WireguardPeerModel, XrayPeerModel))
-    core_logger.info(f"Database initialized at {path}")
+    # existing tables have to be migrated before creating indexes on the new columns
+    migrate_db(db)
+    db.create_tables((
+        UserModel,
+        PeersTableModel,
+        WireguardPeerModel,
+        XrayPeerModel,
+        PeerSessionModel,
+        PeerSessionRollupModel,
+        PeerTrafficModel
+    ))
+
+    client_cache.clear()
+    client_cache.resize(client_cache_size)
+
+    if not read_db.deferred:
+        read_db.close_all()
+        read_db.init(None)
+
+    if path != ":memory:" and read_pool_size > 0:
+        reader_pragmas = {k: v for k, v in pragmas.items() if k in READER_PRAGMAS}
+        reader_pragmas["query_only"] = 1
+        read_db.init(
+            path,
+            pragmas=reader_pragmas,
+            max_connections=read_pool_size,
+            # for pooled databases it's the time to wait for a free connection
+            timeout=timeout,
+            # pooled connections are handed over between the event loop and the database thread,
+            # but only one thread uses a connection at a time
+            check_same_thread=False,
+        )
+
+    with core_logger.contextualize(pragmas=pragmas, read_pool_size=read_pool_size, client_cache_size=client_cache_size):
+        core_logger.info(f"Database initialized at {path}")
     return db
+
+@contextmanager
+def reader() -> Iterator[SqliteExtDatabase]:
+    """
+    Checks out a read-only connection from the pool for the current thread.
+    Falls back to the writer connection if the read pool is not initialized.
+
+    Bind queries to the yielded database to run them on the read-only connection:
+
+    Example:
+        >>> with reader() as database:
+        ...     users = list(UserModel.select().bind(database))
+    """
+    if read_db.deferred:
+        yield db
+        return
+
+    opened = read_db.is_closed()
+    if opened:
+        read_db.connect()
+    try:
+        yield read_db
+    finally:
+        # nested `reader()` calls share the connection, only the outermost one returns it to the pool
+        if opened:
+            read_db.close()
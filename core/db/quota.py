@@ -0,0 +1,221 @@
+import datetime
+import threading
+from enum import StrEnum
+from typing import Optional, Union
+
+from peewee import fn
+
+from core.db.enums import ClientStatusChoices
+from core.db.models import PeersTableModel, PeerTrafficModel, UserModel, reader
+from core.logs import core_logger
+
+
+class QuotaPeriod(StrEnum):
+    MONTHLY = "monthly"
+    """Usage since the first day of the current month"""
+    ROLLING = "rolling"
+    """Usage over the last `rolling_days` days, including today"""
+
+
+class QuotaEngine:
+    """
+    Traffic quota of users, evaluated incrementally.
+
+    Usage is loaded from `PeerTrafficModel` once by `load`, then traffic deltas of every sample are added
+    by `add`. `evaluate` only looks at users that had traffic since the previous evaluation
+    and at users that are over quota, so a tick costs O(active users) and never touches the database.
+
+    Usage is kept in daily buckets, when the window moves old buckets are dropped
+    and users that were over quota are evaluated again.
+
+    Every user can have their own limit in `UserModel.traffic_limit`, users without one get `limit_bytes`.
+    Until `load` is called, or while every limit is 0, every update is ignored.
+
+    Attributes:
+        limit_bytes (int): Max traffic of a user per period, in both directions. 0 means no limit.
+        period (QuotaPeriod): How the period is counted.
+        rolling_days (int): Length of a rolling period.
+    """
+    def __init__(
+            self,
+            limit_bytes: int = 0,
+            period: QuotaPeriod = QuotaPeriod.MONTHLY,
+            rolling_days: int = 30
+        ):
+        self.configure(limit_bytes, period, rolling_days)
+        self.__lock = threading.Lock()
+        self.__loaded = False
+        self.__usage: dict[str, dict[datetime.date, int]] = {}
+        """user_id -> day -> bytes"""
+        self.__dirty: set[str] = set()
+        """Users whose usage changed since the previous evaluation"""
+        self.__exceeded: set[str] = set()
+        self.__limits: dict[str, int] = {}
+        """user_id -> bytes, only users with their own limit"""
+        self.__window_start: Optional[datetime.date] = None
+
+    @property
+    def is_enabled(self) -> bool:
+        return self.limit_bytes > 0 or any(self.__limits.values())
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.__loaded
+
+    @property
+    def exceeded(self) -> set[str]:
+        """Users that are blocked for exceeding the quota."""
+        with self.__lock:
+            return set(self.__exceeded)
+
+    def configure(self, limit_bytes: int, period: QuotaPeriod, rolling_days: int) -> None:
+        if limit_bytes < 0 or rolling_days < 1:
+            raise ValueError("Quota limit must be non-negative and the rolling period must be at least one day")
+        self.limit_bytes = limit_bytes
+        self.period = QuotaPeriod(period)
+        self.rolling_days = rolling_days
+
+    def window_start(self, today: Optional[datetime.date] = None) -> datetime.date:
+        today = today or datetime.date.today()
+        if self.period == QuotaPeriod.MONTHLY:
+            return today.replace(day=1)
+        return today - datetime.timedelta(days=self.rolling_days - 1)
+
+    def limit_for(self, user_id: Union[int, str]) -> int:
+        """Returns the limit of the user in bytes, 0 if the user has no limit."""
+        return self.__limits.get(str(user_id), self.limit_bytes)
+
+    def set_limit(self, user_id: Union[int, str], limit: Optional[int]) -> None:
+        """
+        Changes the limit of the user, `None` brings back `limit_bytes`. The user is evaluated on the next tick.
+        Call it after the limit is saved to `UserModel.traffic_limit`.
+        """
+        if limit is not None and limit < 0:
+            raise ValueError("Quota limit must be non-negative")
+        with self.__lock:
+            if limit is None:
+                self.__limits.pop(str(user_id), None)
+            else:
+                self.__limits[str(user_id)] = limit
+            self.__dirty.add(str(user_id))
+            loaded = self.__loaded
+        # the first limit on a server without the global quota, usage wasn't loaded yet
+        if not loaded and self.is_enabled:
+            self.load()
+
+    def load(self, today: Optional[datetime.date] = None) -> None:
+        """Loads per-user limits, usage of the current window with a single GROUP BY and users that are over quota."""
+        with reader() as database:
+            limits = {
+                str(user_id): limit for user_id, limit in (UserModel
+                                                           .select(UserModel.user_id, UserModel.traffic_limit)
+                                                           .where(UserModel.traffic_limit.is_null(False))
+                                                           .tuples()
+                                                           .bind(database))
+            }
+        with self.__lock:
+            self.__limits = limits
+        if not self.is_enabled:
+            return
+
+        start = self.window_start(today)
+        with reader() as database:
+            rows = (PeerTrafficModel
+                    .select(PeersTableModel.user, PeerTrafficModel.day,
+                            fn.SUM(PeerTrafficModel.rx_bytes + PeerTrafficModel.tx_bytes))
+                    .join(PeersTableModel)
+                    .where(PeerTrafficModel.day >= start)
+                    .group_by(PeersTableModel.user, PeerTrafficModel.day)
+                    .tuples()
+                    .bind(database))
+            usage: dict[str, dict[datetime.date, int]] = {}
+            for user_id, day, used in rows:
+                if isinstance(day, str):
+                    day = datetime.date.fromisoformat(day)
+                usage.setdefault(str(user_id), {})[day] = used
+            exceeded = {
+                str(user_id) for user_id, in (UserModel
+                                              .select(UserModel.user_id)
+                                              .where(UserModel.status == ClientStatusChoices.STATUS_QUOTA_EXCEEDED.value)
+                                              .tuples()
+                                              .bind(database))
+            }
+
+        with self.__lock:
+            self.__usage = usage
+            self.__exceeded = exceeded
+            # everyone is evaluated on the first tick
+            self.__dirty = set(usage) | exceeded
+            self.__window_start = start
+            self.__loaded = True
+        core_logger.info(
+            f"Traffic quotas loaded. Users with traffic: {len(usage)}, over quota: {len(exceeded)}, "
+            f"with own limits: {len(limits)}."
+        )
+
+    def add(self, usage: dict[str, int], day: Optional[datetime.date] = None) -> None:
+        """Adds traffic of users, in bytes."""
+        day = day or datetime.date.today()
+        with self.__lock:
+            if not self.__loaded or not self.is_enabled:
+                return
+            for user_id, used in usage.items():
+                if not used:
+                    continue
+                days = self.__usage.setdefault(str(user_id), {})
+                days[day] = days.get(day, 0) + used
+                self.__dirty.add(str(user_id))
+
+    def get_usage(self, user_id: Union[int, str], today: Optional[datetime.date] = None) -> int:
+        """Returns traffic of the user in the current window, in bytes."""
+        start = self.window_start(today)
+        with self.__lock:
+            return sum(used for day, used in self.__usage.get(str(user_id), {}).items() if day >= start)
+
+    def evaluate(self, today: Optional[datetime.date] = None) -> tuple[list[str], list[str]]:
+        """
+        Finds users that went over quota and users over quota that are back under it.
+        Call `mark_exceeded` and `mark_restored` once they're blocked and unblocked.
+
+        Returns:
+            tuple[list[str], list[str]]: IDs of users to block and IDs of users to unblock.
+        """
+        start = self.window_start(today)
+        with self.__lock:
+            if not self.__loaded or not self.is_enabled:
+                return [], []
+
+            if start != self.__window_start:
+                for user_id in list(self.__usage):
+                    days = {day: used for day, used in self.__usage[user_id].items() if day >= start}
+                    if days:
+                        self.__usage[user_id] = days
+                    else:
+                        del self.__usage[user_id]
+                self.__dirty |= self.__exceeded
+                self.__window_start = start
+
+            to_block, to_unblock = [], []
+            for user_id in self.__dirty:
+                limit = self.__limits.get(user_id, self.limit_bytes)
+                over_quota = 0 < limit <= sum(self.__usage.get(user_id, {}).values())
+                if over_quota and user_id not in self.__exceeded:
+                    to_block.append(user_id)
+                elif not over_quota and user_id in self.__exceeded:
+                    to_unblock.append(user_id)
+            self.__dirty.clear()
+        return to_block, to_unblock
+
+    def mark_exceeded(self, user_id: Union[int, str]) -> None:
+        with self.__lock:
+            self.__exceeded.add(str(user_id))
+
+    def mark_restored(self, user_id: Union[int, str]) -> None:
+        """Forgets that the user is over quota, e.g. after the admin unblocked them.
+        The user is blocked again by the next evaluation after new traffic if they're still over quota."""
+        with self.__lock:
+            self.__exceeded.discard(str(user_id))
+
+
+quota_engine = QuotaEngine()
+"""Process-wide quota engine. Configured and loaded by `config.loader`."""
@@ -0,0 +1,205 @@
+import asyncio
+import datetime
+import threading
+from typing import Optional
+
+from peewee import EXCLUDED, fn
+
+from core.db.async_db import db_thread
+from core.db.enums import PeerStatusChoices
+from core.db.models import PeerSessionModel, PeerSessionRollupModel, db, reader
+from core.logs import core_logger
+
+
+class SessionWriter:
+    """
+    Append-only, batched writer of peer connection sessions.
+
+    Sessions are opened and closed in memory, finished sessions are queued
+    and inserted by `flush` with a single `executemany` in one transaction.
+    Rows are never updated, so a check cycle with thousands of events costs one commit.
+
+    Attributes:
+        max_pending (int): Number of queued sessions that forces a flush right away.
+
+    Note:
+        Open sessions live only in memory. Close them with `close_all` before shutting down,
+        otherwise they are lost.
+    """
+    def __init__(self, max_pending: int = 5000):
+        self.max_pending = max_pending
+        self.__lock = threading.Lock()
+        self.__open: dict[int, datetime.datetime] = {}
+        """peer_id -> start of the session"""
+        self.__pending: list[tuple[int, datetime.datetime, datetime.datetime, int]] = []
+
+    @property
+    def pending(self) -> int:
+        """Number of finished sessions waiting to be written."""
+        return len(self.__pending)
+
+    @property
+    def open_sessions(self) -> dict[int, datetime.datetime]:
+        return dict(self.__open)
+
+    def open(self, peer_id: int, at: Optional[datetime.datetime] = None) -> None:
+        """Starts a session of the peer. Does nothing if the session is already open."""
+        with self.__lock:
+            self.__open.setdefault(peer_id, at or datetime.datetime.now())
+
+    def close(self, peer_id: int, status: PeerStatusChoices, at: Optional[datetime.datetime] = None) -> bool:
+        """
+        Finishes the session of the peer and queues it for writing.
+
+        Args:
+            peer_id (int): ID of the peer.
+            status (PeerStatusChoices): Status the peer got when the session ended.
+            at (Optional[datetime.datetime]): End of the session. Defaults to now.
+
+        Returns:
+            bool: False if the peer had no open session.
+        """
+        with self.__lock:
+            started_at = self.__open.pop(peer_id, None)
+            if started_at is None:
+                return False
+            self.__pending.append((peer_id, started_at, at or datetime.datetime.now(), status.value))
+        self.__flush_if_full()
+        return True
+
+    def close_all(self, status: PeerStatusChoices = PeerStatusChoices.STATUS_DISCONNECTED) -> int:
+        """Finishes every open session. Returns the number of closed sessions."""
+        now = datetime.datetime.now()
+        with self.__lock:
+            opened, self.__open = self.__open, {}
+            self.__pending.extend((peer_id, started_at, now, status.value) for peer_id, started_at in opened.items())
+        return len(opened)
+
+    def __flush_if_full(self) -> None:
+        if self.pending >= self.max_pending:
+            core_logger.debug("Session writer is full, flushing it.")
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Inserts all finished sessions in a single transaction.
+        Sessions of peers that were deleted in the meantime are skipped.
+        If the transaction fails, sessions are put back into the queue.
+
+        Returns:
+            int: Number of sessions passed to the database.
+        """
+        with self.__lock:
+            sessions, self.__pending = self.__pending, []
+
+        if not sessions:
+            return 0
+
+        try:
+            with db.atomic():
+                db.cursor().executemany(
+                    'INSERT INTO "PeerSessions" ("peer_id", "started_at", "ended_at", "end_status") '
+                    'SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM "PeersTable" WHERE "id" = ?)',
+                    [
+                        (peer_id, started_at, ended_at, status, peer_id)
+                        for peer_id, started_at, ended_at, status in sessions
+                    ]
+                )
+        except Exception as e:
+            core_logger.exception(f"Couldn't flush session writer: {e}")
+            with self.__lock:
+                self.__pending = sessions + self.__pending
+            return 0
+
+        with core_logger.contextualize(sessions=len(sessions)):
+            core_logger.debug("Session writer flushed.")
+        return len(sessions)
+
+    async def run(self, flush_interval: float) -> None:
+        """Flushes the writer on `db_thread` every `flush_interval` seconds."""
+        while True:
+            await asyncio.sleep(flush_interval)
+            await db_thread.run(self.flush)
+
+    def get_online_time(
+            self,
+            peer_id: int,
+            since: datetime.datetime,
+            until: Optional[datetime.datetime] = None
+        ) -> datetime.timedelta:
+        """
+        Sums up how long the peer was online between `since` and `until`,
+        including compacted days, queued and still open sessions.
+
+        Note:
+            Compacted days are counted as a whole. For periods older than
+            the compaction horizon pass `since` at midnight to get an exact result.
+        """
+        until = until or datetime.datetime.now()
+        with reader() as database:
+            rollup_seconds = (PeerSessionRollupModel
+                              .select(fn.COALESCE(fn.SUM(PeerSessionRollupModel.online_seconds), 0))
+                              .where(PeerSessionRollupModel.peer == peer_id,
+                                     PeerSessionRollupModel.day >= since.date(),
+                                     PeerSessionRollupModel.day <= until.date())
+                              .bind(database)
+                              .scalar())
+            sessions = list(PeerSessionModel
+                            .select(PeerSessionModel.started_at, PeerSessionModel.ended_at)
+                            .where(PeerSessionModel.peer == peer_id,
+                                   PeerSessionModel.ended_at > since,
+                                   PeerSessionModel.started_at < until)
+                            .tuples()
+                            .bind(database))
+
+        with self.__lock:
+            sessions.extend((started_at, ended_at) for p_id, started_at, ended_at, _ in self.__pending if p_id == peer_id)
+            if peer_id in self.__open:
+                sessions.append((self.__open[peer_id], until))
+
+        online = datetime.timedelta(seconds=rollup_seconds)
+        for started_at, ended_at in sessions:
+            overlap = min(ended_at, until) - max(started_at, since)
+            if overlap > datetime.timedelta():
+                online += overlap
+        return online
+
+
+def compact_sessions(before: datetime.datetime) -> int:
+    """
+    Merges sessions that ended before `before` into daily rollups and deletes them, in a single transaction.
+    A session is accounted to the day it started on.
+
+    Returns:
+        int: Number of compacted sessions.
+    """
+    day = fn.DATE(PeerSessionModel.started_at)
+    seconds = fn.SUM(
+        (fn.JULIANDAY(PeerSessionModel.ended_at) - fn.JULIANDAY(PeerSessionModel.started_at)) * 86400
+    )
+    totals = (PeerSessionModel
+              .select(PeerSessionModel.peer, day, fn.COUNT(PeerSessionModel.id), fn.ROUND(seconds).cast("INTEGER"))
+              .where(PeerSessionModel.ended_at < before)
+              .group_by(PeerSessionModel.peer, day))
+
+    with db.atomic():
+        (PeerSessionRollupModel
+         .insert_from(totals, fields=[
+             PeerSessionRollupModel.peer,
+             PeerSessionRollupModel.day,
+             PeerSessionRollupModel.sessions,
+             PeerSessionRollupModel.online_seconds
+         ])
+         .on_conflict(
+             conflict_target=[PeerSessionRollupModel.peer, PeerSessionRollupModel.day],
+             update={
+                 PeerSessionRollupModel.sessions: PeerSessionRollupModel.sessions + EXCLUDED.sessions,
+                 PeerSessionRollupModel.online_seconds:
+                     PeerSessionRollupModel.online_seconds + EXCLUDED.online_seconds
+             }
+         )
+         .execute())
+        compacted = PeerSessionModel.delete().where(PeerSessionModel.ended_at < before).execute()
+
+    core_logger.info(f"Compacted {compacted} peer sessions that ended before {before}.")
+    return compacted
@@ -0,0 +1,192 @@
+import datetime
+import threading
+from collections import Counter
+from typing import NamedTuple, Optional, Union
+
+from peewee import fn
+
+from core.db.enums import ClientStatusChoices, PeerStatusChoices, ProtocolType
+from core.db.models import PeersTableModel, UserModel, reader
+from core.logs import core_logger
+
+
+class StatsSnapshot(NamedTuple):
+    clients_by_status: dict[ClientStatusChoices, int]
+    peers_by_status: dict[PeerStatusChoices, int]
+    peers_by_protocol: dict[ProtocolType, int]
+    reconciled_at: Optional[datetime.datetime]
+
+    @property
+    def total_clients(self) -> int:
+        return sum(self.clients_by_status.values())
+
+    @property
+    def total_peers(self) -> int:
+        return sum(self.peers_by_protocol.values())
+
+
+class ServiceStats:
+    """
+    Materialized counters of clients per status and peers per status and per protocol.
+
+    Counters are loaded from the database once by `reconcile` and then updated incrementally
+    by the status-change paths in `Client`, `ClientFactory` and `StatusWriteBuffer`,
+    so reading them never touches the database. `reconcile` should be called periodically:
+    it compares the counters with GROUP BY aggregates and reloads them if they've drifted.
+
+    Until the first `reconcile` call every update is ignored.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__loaded = False
+        self.__reconciled_at: Optional[datetime.datetime] = None
+        self.__clients: dict[str, ClientStatusChoices] = {}
+        self.__peers: dict[int, tuple[str, ProtocolType, PeerStatusChoices]] = {}
+        """peer_id -> (user_id, protocol, status)"""
+        self.__clients_by_status: Counter = Counter()
+        self.__peers_by_status: Counter = Counter()
+        self.__peers_by_protocol: Counter = Counter()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.__loaded
+
+    def snapshot(self) -> StatsSnapshot:
+        with self.__lock:
+            return StatsSnapshot(
+                clients_by_status=+self.__clients_by_status,
+                peers_by_status=+self.__peers_by_status,
+                peers_by_protocol=+self.__peers_by_protocol,
+                reconciled_at=self.__reconciled_at
+            )
+
+    def set_client_status(self, user_id: Union[int, str], status: ClientStatusChoices) -> None:
+        """Registers a new client or changes the status of a known one."""
+        with self.__lock:
+            if not self.__loaded:
+                return
+            old_status = self.__clients.get(str(user_id))
+            if old_status is not None:
+                self.__clients_by_status[old_status] -= 1
+            self.__clients[str(user_id)] = status
+            self.__clients_by_status[status] += 1
+
+    def remove_client(self, user_id: Union[int, str]) -> None:
+        """Forgets the client and all of its peers."""
+        with self.__lock:
+            if not self.__loaded:
+                return
+            if (status := self.__clients.pop(str(user_id), None)) is not None:
+                self.__clients_by_status[status] -= 1
+            self.__remove_peers_of(str(user_id))
+
+    def add_peer(self, peer_id: int, user_id: Union[int, str], protocol: ProtocolType, status: PeerStatusChoices) -> None:
+        with self.__lock:
+            if not self.__loaded:
+                return
+            self.__remove_peer(peer_id)
+            self.__peers[peer_id] = (str(user_id), protocol, status)
+            self.__peers_by_status[status] += 1
+            self.__peers_by_protocol[protocol] += 1
+
+    def set_peer_status(self, peer_id: int, status: PeerStatusChoices) -> None:
+        """Changes the status of a known peer. Unknown peers are picked up by the next `reconcile`."""
+        with self.__lock:
+            if not self.__loaded or peer_id not in self.__peers:
+                return
+            user_id, protocol, old_status = self.__peers[peer_id]
+            self.__peers_by_status[old_status] -= 1
+            self.__peers[peer_id] = (user_id, protocol, status)
+            self.__peers_by_status[status] += 1
+
+    def remove_peer(self, peer_id: int) -> None:
+        with self.__lock:
+            if self.__loaded:
+                self.__remove_peer(peer_id)
+
+    def remove_client_peers(self, user_id: Union[int, str]) -> None:
+        with self.__lock:
+            if self.__loaded:
+                self.__remove_peers_of(str(user_id))
+
+    def __remove_peer(self, peer_id: int) -> None:
+        if (peer := self.__peers.pop(peer_id, None)) is not None:
+            _, protocol, status = peer
+            self.__peers_by_status[status] -= 1
+            self.__peers_by_protocol[protocol] -= 1
+
+    def __remove_peers_of(self, user_id: str) -> None:
+        for peer_id in [peer_id for peer_id, peer in self.__peers.items() if peer[0] == user_id]:
+            self.__remove_peer(peer_id)
+
+    def load(self) -> None:
+        """Loads every client and peer status from the database and rebuilds the counters."""
+        with reader() as database:
+            clients = {
+                user_id: ClientStatusChoices(status)
+                for user_id, status in UserModel.select(UserModel.user_id, UserModel.status).tuples().bind(database)
+            }
+            peers = {
+                peer_id: (user_id, ProtocolType(protocol), PeerStatusChoices(status))
+                for peer_id, user_id, protocol, status in PeersTableModel.select(
+                    PeersTableModel.id,
+                    PeersTableModel.user,
+                    PeersTableModel.peer_type,
+                    PeersTableModel.peer_status
+                ).tuples().bind(database)
+            }
+
+        with self.__lock:
+            self.__clients = clients
+            self.__peers = peers
+            self.__clients_by_status = Counter(clients.values())
+            self.__peers_by_status = Counter(status for _, _, status in peers.values())
+            self.__peers_by_protocol = Counter(protocol for _, protocol, _ in peers.values())
+            self.__loaded = True
+            self.__reconciled_at = datetime.datetime.now()
+
+    def reconcile(self) -> bool:
+        """
+        Compares the counters with GROUP BY aggregates of the tables and reloads them on mismatch.
+
+        Returns:
+            bool: True if the counters were correct, False if they had to be (re)loaded.
+        """
+        if not self.__loaded:
+            self.load()
+            return False
+
+        with reader() as database:
+            clients_by_status = Counter({
+                ClientStatusChoices(status): count
+                for status, count in UserModel.select(UserModel.status, fn.COUNT(UserModel.user_id))
+                .group_by(UserModel.status).tuples().bind(database)
+            })
+            peers_by_status = Counter({
+                PeerStatusChoices(status): count
+                for status, count in PeersTableModel.select(PeersTableModel.peer_status, fn.COUNT(PeersTableModel.id))
+                .group_by(PeersTableModel.peer_status).tuples().bind(database)
+            })
+            peers_by_protocol = Counter({
+                ProtocolType(protocol): count
+                for protocol, count in PeersTableModel.select(PeersTableModel.peer_type, fn.COUNT(PeersTableModel.id))
+                .group_by(PeersTableModel.peer_type).tuples().bind(database)
+            })
+
+        with self.__lock:
+            is_correct = (
+                clients_by_status == self.__clients_by_status
+                and peers_by_status == self.__peers_by_status
+                and peers_by_protocol == self.__peers_by_protocol
+            )
+            if is_correct:
+                self.__reconciled_at = datetime.datetime.now()
+                return True
+
+        core_logger.warning("Service stats have drifted from the database, reloading them.")
+        self.load()
+        return False
+
+
+service_stats = ServiceStats()
+"""Process-wide service statistics. Loaded by `config.loader`."""
@@ -0,0 +1,247 @@
+import asyncio
+import datetime
+import threading
+import time
+from array import array
+from typing import Iterable, NamedTuple, Optional
+
+from peewee import fn
+
+from core.db.async_db import db_thread
+from core.db.models import (PeersTableModel, PeerTrafficModel, UserModel, db,
+                            reader)
+from core.logs import core_logger
+
+
+class TrafficUsage(NamedTuple):
+    rx_bytes: int
+    """Received from the peers, i.e. uploaded by the user"""
+    tx_bytes: int
+    """Sent to the peers, i.e. downloaded by the user"""
+
+    @property
+    def total(self) -> int:
+        return self.rx_bytes + self.tx_bytes
+
+
+class TopUser(NamedTuple):
+    user_id: str
+    name: str
+    usage: TrafficUsage
+
+
+class TrafficRing:
+    """
+    Traffic of a single peer over the last `size` slots.
+
+    Two fixed-size arrays are indexed by `slot % size`, slots skipped between samples are zeroed
+    when the ring moves forward, so memory doesn't grow with time.
+    """
+    __slots__ = ("rx", "tx", "slot")
+
+    def __init__(self, size: int, slot: int):
+        self.rx = array("Q", bytes(8 * size))
+        self.tx = array("Q", bytes(8 * size))
+        self.slot = slot
+        """Latest slot the ring holds"""
+
+    def add(self, slot: int, rx: int, tx: int) -> None:
+        size = len(self.rx)
+        if slot > self.slot:
+            for skipped in range(max(self.slot + 1, slot - size + 1), slot + 1):
+                self.rx[skipped % size] = 0
+                self.tx[skipped % size] = 0
+            self.slot = slot
+        elif slot <= self.slot - size:
+            return
+        self.rx[slot % size] += rx
+        self.tx[slot % size] += tx
+
+    def total(self, since_slot: int, until_slot: int) -> TrafficUsage:
+        size = len(self.rx)
+        first = max(since_slot, until_slot - size + 1, self.slot - size + 1)
+        last = min(until_slot, self.slot)
+        rx = tx = 0
+        for slot in range(first, last + 1):
+            rx += self.rx[slot % size]
+            tx += self.tx[slot % size]
+        return TrafficUsage(rx, tx)
+
+
+class TrafficAccounting:
+    """
+    Turns cumulative transfer counters of peers into traffic deltas.
+
+    Deltas go into a `TrafficRing` per peer for recent usage and into daily totals
+    that `flush` upserts into `PeerTrafficModel` with a single `executemany`.
+
+    A counter that went down means the interface (or the 3x-ui stats) was reset,
+    the new value is counted as traffic since the reset. The first sample of a peer
+    is only a baseline, since the counter may include traffic accounted before a restart.
+
+    Attributes:
+        slot_seconds (int): Length of a ring slot.
+        slots (int): Number of slots in a ring. Rings cover `slot_seconds * slots` seconds.
+    """
+    def __init__(self, slot_seconds: int = 3600, slots: int = 24):
+        self.slot_seconds = slot_seconds
+        self.slots = slots
+        self.__lock = threading.Lock()
+        self.__counters: dict[int, tuple[int, int]] = {}
+        """peer_id -> the latest cumulative (rx, tx)"""
+        self.__rings: dict[int, TrafficRing] = {}
+        self.__pending: dict[tuple[int, datetime.date], list[int]] = {}
+        """(peer_id, day) -> [rx, tx] not written yet"""
+
+    @property
+    def pending(self) -> int:
+        """Number of daily totals waiting to be written."""
+        return len(self.__pending)
+
+    def __slot(self, at: float) -> int:
+        return int(at // self.slot_seconds)
+
+    def record(self, samples: Iterable[tuple[int, int, int]], at: Optional[float] = None) -> dict[int, TrafficUsage]:
+        """
+        Records cumulative counters of peers taken at the same moment.
+
+        Args:
+            samples (Iterable[tuple[int, int, int]]): `(peer_id, rx_bytes, tx_bytes)` counters.
+            at (Optional[float]): Unix timestamp of the samples. Defaults to now.
+
+        Returns:
+            dict[int, TrafficUsage]: Traffic of the peers that had any since their previous sample.
+        """
+        at = at or time.time()
+        slot = self.__slot(at)
+        day = datetime.date.fromtimestamp(at)
+        deltas = {}
+        with self.__lock:
+            for peer_id, rx, tx in samples:
+                previous = self.__counters.get(peer_id)
+                self.__counters[peer_id] = (rx, tx)
+                if previous is None:
+                    continue
+                if rx < previous[0] or tx < previous[1]:
+                    delta_rx, delta_tx = rx, tx
+                else:
+                    delta_rx, delta_tx = rx - previous[0], tx - previous[1]
+                if not delta_rx and not delta_tx:
+                    continue
+
+                deltas[peer_id] = TrafficUsage(delta_rx, delta_tx)
+                ring = self.__rings.get(peer_id)
+                if ring is None:
+                    ring = self.__rings[peer_id] = TrafficRing(self.slots, slot)
+                ring.add(slot, delta_rx, delta_tx)
+                totals = self.__pending.setdefault((peer_id, day), [0, 0])
+                totals[0] += delta_rx
+                totals[1] += delta_tx
+        return deltas
+
+    def retain(self, peer_ids: Iterable[int]) -> None:
+        """Forgets counters and rings of peers that are not in `peer_ids`, e.g. deleted ones."""
+        peer_ids = set(peer_ids)
+        with self.__lock:
+            for peer_id in self.__counters.keys() - peer_ids:
+                del self.__counters[peer_id]
+                self.__rings.pop(peer_id, None)
+
+    def flush(self) -> int:
+        """
+        Adds pending daily totals to `PeerTrafficModel` in a single transaction.
+        Totals of peers that were deleted in the meantime are skipped.
+        If the transaction fails, totals are put back.
+
+        Returns:
+            int: Number of totals passed to the database.
+        """
+        with self.__lock:
+            totals, self.__pending = self.__pending, {}
+
+        if not totals:
+            return 0
+
+        try:
+            with db.atomic():
+                db.cursor().executemany(
+                    'INSERT INTO "PeerTraffic" ("peer_id", "day", "rx_bytes", "tx_bytes") '
+                    'SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM "PeersTable" WHERE "id" = ?) '
+                    'ON CONFLICT ("peer_id", "day") DO UPDATE SET '
+                    '"rx_bytes" = "rx_bytes" + excluded."rx_bytes", "tx_bytes" = "tx_bytes" + excluded."tx_bytes"',
+                    [(peer_id, day.isoformat(), rx, tx, peer_id) for (peer_id, day), (rx, tx) in totals.items()]
+                )
+        except Exception as e:
+            core_logger.exception(f"Couldn't flush traffic totals: {e}")
+            with self.__lock:
+                for key, (rx, tx) in totals.items():
+                    pending = self.__pending.setdefault(key, [0, 0])
+                    pending[0] += rx
+                    pending[1] += tx
+            return 0
+
+        with core_logger.contextualize(totals=len(totals)):
+            core_logger.debug("Traffic totals flushed.")
+        return len(totals)
+
+    async def run(self, flush_interval: float) -> None:
+        """Flushes the totals on `db_thread` every `flush_interval` seconds."""
+        while True:
+            await asyncio.sleep(flush_interval)
+            await db_thread.run(self.flush)
+
+    def get_recent_usage(self, peer_ids: Iterable[int], seconds: Optional[int] = None) -> TrafficUsage:
+        """
+        Sums up traffic of the peers over the last `seconds` from the rings, without touching the database.
+        Defaults to everything the rings hold.
+        """
+        until_slot = self.__slot(time.time())
+        since_slot = until_slot - (seconds // self.slot_seconds if seconds else self.slots) + 1
+        rx = tx = 0
+        with self.__lock:
+            for peer_id in peer_ids:
+                if (ring := self.__rings.get(peer_id)) is not None:
+                    usage = ring.total(since_slot, until_slot)
+                    rx += usage.rx_bytes
+                    tx += usage.tx_bytes
+        return TrafficUsage(rx, tx)
+
+    def get_usage(self, peer_ids: list[int], since: datetime.date) -> TrafficUsage:
+        """Sums up traffic of the peers since the start of the `since` day, including pending totals."""
+        with reader() as database:
+            rx, tx = (PeerTrafficModel
+                      .select(fn.COALESCE(fn.SUM(PeerTrafficModel.rx_bytes), 0),
+                              fn.COALESCE(fn.SUM(PeerTrafficModel.tx_bytes), 0))
+                      .where(PeerTrafficModel.peer.in_(peer_ids), PeerTrafficModel.day >= since)
+                      .tuples()
+                      .bind(database)
+                      .get())
+
+        peer_ids = set(peer_ids)
+        with self.__lock:
+            for (peer_id, day), (pending_rx, pending_tx) in self.__pending.items():
+                if peer_id in peer_ids and day >= since:
+                    rx += pending_rx
+                    tx += pending_tx
+        return TrafficUsage(rx, tx)
+
+    def top_users(self, since: datetime.date, limit: int = 10) -> list[TopUser]:
+        """
+        Returns users with the most traffic since the start of the `since` day.
+        Pending totals are flushed first, so it has to run on `db_thread`.
+        """
+        self.flush()
+        rx = fn.SUM(PeerTrafficModel.rx_bytes)
+        tx = fn.SUM(PeerTrafficModel.tx_bytes)
+        with reader() as database:
+            rows = (PeerTrafficModel
+                    .select(UserModel.user_id, UserModel.name, rx, tx)
+                    .join(PeersTableModel)
+                    .join(UserModel)
+                    .where(PeerTrafficModel.day >= since)
+                    .group_by(UserModel.user_id)
+                    .order_by((rx + tx).desc())
+                    .limit(limit)
+                    .tuples()
+                    .bind(database))
+            return [TopUser(user_id, name, TrafficUsage(rx, tx)) for user_id, name, rx, tx in rows]
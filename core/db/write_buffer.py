@@ -0,0 +1,172 @@
+import asyncio
+import datetime
+import threading
+from typing import Union
+
+from core.db.async_db import db_thread
+from core.db.cache import client_cache
+from core.db.db_works import status_buffers
+from core.db.enums import ClientStatusChoices, PeerStatusChoices
+from core.db.models import db
+from core.db.stats import service_stats
+from core.logs import core_logger
+
+BLOCKED_CLIENT_STATUSES = (
+    ClientStatusChoices.STATUS_IP_BLOCKED.value,
+    ClientStatusChoices.STATUS_ACCOUNT_BLOCKED.value,
+    ClientStatusChoices.STATUS_QUOTA_EXCEEDED.value,
+)
+
+
+class StatusWriteBuffer:
+    """
+    Write-behind buffer for peer and client status changes.
+
+    Status changes are coalesced in memory (the latest value per peer/client wins)
+    and written to the database by `flush` in a single transaction using `executemany`,
+    so a check cycle where hundreds of peers change their state costs one commit instead of
+    several commits per peer.
+
+    Attributes:
+        max_pending (int): Number of pending changes that forces a flush right away.
+
+    Buffered statuses never overwrite blocked ones (blocked peers and blocked, banned or over quota clients),
+    so a connection status buffered before an admin ban or the expiry block doesn't undo it when flushed.
+    Direct writes of `Client` drop the pending changes of the same peer or client for the same reason.
+
+    Note:
+        Until the buffer is flushed, the database contains outdated statuses.
+        Flush the buffer before reading statuses back from the database.
+    """
+    def __init__(self, max_pending: int = 5000):
+        self.max_pending = max_pending
+        self.__lock = threading.Lock()
+        self.__peer_statuses: dict[int, int] = {}
+        self.__peer_timers: dict[int, datetime.datetime] = {}
+        self.__client_statuses: dict[str, int] = {}
+        status_buffers.add(self)
+
+    @property
+    def pending(self) -> int:
+        """Number of changes waiting to be written."""
+        return len(self.__peer_statuses) + len(self.__peer_timers) + len(self.__client_statuses)
+
+    @property
+    def pending_peer_statuses(self) -> dict[int, PeerStatusChoices]:
+        return {peer_id: PeerStatusChoices(status) for peer_id, status in self.__peer_statuses.items()}
+
+    @property
+    def pending_peer_timers(self) -> dict[int, datetime.datetime]:
+        return dict(self.__peer_timers)
+
+    @property
+    def pending_client_statuses(self) -> dict[str, ClientStatusChoices]:
+        return {user_id: ClientStatusChoices(status) for user_id, status in self.__client_statuses.items()}
+
+    def set_peer_status(self, peer_id: int, peer_status: PeerStatusChoices) -> None:
+        with self.__lock:
+            self.__peer_statuses[peer_id] = peer_status.value
+        self.__flush_if_full()
+
+    def set_peer_timer(self, peer_id: int, time: datetime.datetime) -> None:
+        with self.__lock:
+            self.__peer_timers[peer_id] = time
+        self.__flush_if_full()
+
+    def set_client_status(self, user_id: Union[int, str], status: ClientStatusChoices) -> None:
+        with self.__lock:
+            self.__client_statuses[str(user_id)] = status.value
+        self.__flush_if_full()
+
+    def discard_peer_status(self, peer_id: int) -> None:
+        with self.__lock:
+            self.__peer_statuses.pop(peer_id, None)
+
+    def discard_peer_timer(self, peer_id: int) -> None:
+        with self.__lock:
+            self.__peer_timers.pop(peer_id, None)
+
+    def discard_client_status(self, user_id: Union[int, str]) -> None:
+        with self.__lock:
+            self.__client_statuses.pop(str(user_id), None)
+
+    def __flush_if_full(self) -> None:
+        if self.pending >= self.max_pending:
+            core_logger.debug("Status write buffer is full, flushing it.")
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Writes all pending changes in a single transaction.
+        If the transaction fails, changes are put back into the buffer
+        unless they were overwritten by newer ones in the meantime.
+
+        Returns:
+            int: Number of written changes.
+        """
+        with self.__lock:
+            peer_statuses, self.__peer_statuses = self.__peer_statuses, {}
+            peer_timers, self.__peer_timers = self.__peer_timers, {}
+            client_statuses, self.__client_statuses = self.__client_statuses, {}
+
+        written = len(peer_statuses) + len(peer_timers) + len(client_statuses)
+        if not written:
+            return 0
+
+        blocked_clients = ", ".join(str(status) for status in BLOCKED_CLIENT_STATUSES)
+        written_peer_statuses, written_client_statuses = {}, {}
+        try:
+            with db.atomic():
+                cursor = db.cursor()
+                # statuses are written one by one to know which rows weren't skipped as blocked
+                for peer_id, status in peer_statuses.items():
+                    cursor.execute(
+                        'UPDATE "PeersTable" SET "peer_status" = ? WHERE "id" = ? AND "peer_status" != ?',
+                        (status, peer_id, PeerStatusChoices.STATUS_BLOCKED.value)
+                    )
+                    if cursor.rowcount:
+                        written_peer_statuses[peer_id] = status
+                if peer_timers:
+                    cursor.executemany(
+                        'UPDATE "PeersTable" SET "peer_timer" = ? WHERE "id" = ?',
+                        [(timer, peer_id) for peer_id, timer in peer_timers.items()]
+                    )
+                for user_id, status in client_statuses.items():
+                    cursor.execute(
+                        f'UPDATE "Users" SET "status" = ? WHERE "user_id" = ? AND "status" NOT IN ({blocked_clients})',
+                        (status, user_id)
+                    )
+                    if cursor.rowcount:
+                        written_client_statuses[user_id] = status
+        except Exception as e:
+            core_logger.exception(f"Couldn't flush status write buffer: {e}")
+            with self.__lock:
+                # newer values have priority over the failed ones
+                self.__peer_statuses = peer_statuses | self.__peer_statuses
+                self.__peer_timers = peer_timers | self.__peer_timers
+                self.__client_statuses = client_statuses | self.__client_statuses
+            return 0
+
+        for peer_id in peer_statuses.keys() | peer_timers.keys():
+            client_cache.invalidate_peer(peer_id)
+        for user_id in client_statuses:
+            client_cache.invalidate(user_id)
+
+        for peer_id, status in written_peer_statuses.items():
+            service_stats.set_peer_status(peer_id, PeerStatusChoices(status))
+        for user_id, status in written_client_statuses.items():
+            service_stats.set_client_status(user_id, ClientStatusChoices(status))
+
+        with core_logger.contextualize(
+            peer_statuses=len(peer_statuses),
+            peer_timers=len(peer_timers),
+            client_statuses=len(client_statuses)
+        ):
+            core_logger.debug("Status write buffer flushed.")
+        return written
+
+    async def run(self, flush_interval: float) -> None:
+        """Flushes the buffer on `db_thread` every `flush_interval` seconds, so no change waits longer than that."""
+        while True:
+            await asyncio.sleep(flush_interval)
+            await db_thread.run(self.flush)
@@ -0,0 +1,92 @@
+import time
+from enum import StrEnum
+from typing import Optional
+
+from core.logs import core_logger
+
+
+class BreakerState(StrEnum):
+    CLOSED = "closed"
+    """Calls go through"""
+    OPEN = "open"
+    """Calls are rejected without reaching the service"""
+    HALF_OPEN = "half_open"
+    """A single trial call checks whether the service is back"""
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a service that keeps failing, so callers fail at once instead of waiting for timeouts.
+
+    After `failure_threshold` failures in a row the breaker opens and rejects calls for `reset_timeout` seconds.
+    Then one trial call is let through: its success closes the breaker, its failure opens it again.
+
+    Meant to be used from a single event loop, so no locking is done.
+
+    Attributes:
+        name (str): Name of the service for logs.
+        failure_threshold (int): Failures in a row that open the breaker.
+        reset_timeout (float): Seconds the breaker stays open before a trial call.
+        failures (int): Failures in a row so far.
+        trips (int): How many times the breaker has opened.
+        last_error (Optional[str]): The last failure.
+    """
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.trips = 0
+        self.last_error: Optional[str] = None
+        self.__state = BreakerState.CLOSED
+        self.__opened_at = 0.0
+        self.__trial = False
+
+    @property
+    def state(self) -> BreakerState:
+        if self.__state == BreakerState.OPEN and self.retry_in == 0:
+            return BreakerState.HALF_OPEN
+        return self.__state
+
+    @property
+    def retry_in(self) -> float:
+        """Seconds until the open breaker lets a trial call through, 0 if it isn't open."""
+        if self.__state != BreakerState.OPEN:
+            return 0
+        return max(0.0, self.__opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """Tells whether a call may go through. A call that was allowed must be followed by a `record_*` call."""
+        state = self.state
+        if state == BreakerState.CLOSED:
+            return True
+        if state == BreakerState.OPEN or self.__trial:
+            return False
+        self.__state = BreakerState.HALF_OPEN
+        self.__trial = True
+        return True
+
+    def record_success(self) -> None:
+        if self.__state != BreakerState.CLOSED:
+            core_logger.info(f"{self.name} is available again, circuit breaker closed.")
+        self.__state = BreakerState.CLOSED
+        self.failures = 0
+        self.__trial = False
+
+    def record_failure(self, error: str) -> None:
+        self.failures += 1
+        self.last_error = error
+        self.__trial = False
+        if self.__state == BreakerState.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.__state != BreakerState.OPEN:
+                self.trips += 1
+                core_logger.warning(
+                    f"{self.name} failed {self.failures} times in a row, "
+                    f"calls are suspended for {self.reset_timeout} seconds: {error}"
+                )
+            self.__state = BreakerState.OPEN
+            self.__opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """Gives the trial slot back when an allowed call ended without an outcome, e.g. was cancelled."""
+        self.__trial = False
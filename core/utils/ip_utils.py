@@ -1,6 +1,6 @@
 import ipaddress
 import queue
-from typing import Union
+from typing import Optional, Union
 
 from core.logs import core_logger
 
@@ -73,3 +73,33 @@ def generate_ip_addresses(basic_ip: str, mask: Union[str, int] = "32") -> list[s
 
 def get_ip_prefix(ip_address: str) -> str:
     return '.'.join(ip_address.split('.')[:3])
+
+def ip_to_int(ip_address: str) -> Optional[int]:
+    """Converts IPv4 address (with or without prefix length) to integer.
+
+    Returns:
+        Optional[int]: Integer representation of the address. None if the address is not a valid IPv4 address.
+    """
+    parsed = parse_ipv4_interface(ip_address)
+    return parsed[0] if parsed else None
+
+def parse_ipv4_interface(shared_ips: str) -> Optional[tuple[int, int]]:
+    """
+    Parses the first IPv4 address from a comma-separated list of IPs.
+
+    Args:
+        shared_ips (str): IP addresses of the peer. Example: `10.0.0.2`, `10.0.0.2/32, fd00::2/128`
+
+    Returns:
+        Optional[tuple[int, int]]: A tuple of integer representation of the address and its prefix length.
+        None if there's no valid IPv4 address in the string.
+    """
+    first_ip = shared_ips.split(",")[0].strip()
+    try:
+        interface = ipaddress.ip_interface(first_ip)
+    except ValueError:
+        return None
+
+    if interface.version != 4:
+        return None
+    return int(interface.ip), interface.network.prefixlen
@@ -1,6 +1,6 @@
-from typing import Optional, Union
+from typing import Union
 
-from core.db.db_works import Client
+from core.db.async_db import AsyncClient
 from core.db.enums import PeerStatusChoices, ProtocolType
 from core.db.model_serializer import WireguardPeer, XrayPeer
 from core.logs import core_logger
@@ -8,36 +8,64 @@ from core.wg.wg_work import WGHub
 from core.xray.xray_worker import XrayWorker
 
 
-def enable_peers(
+def wireguard_peers(peers: list[Union[WireguardPeer, XrayPeer]]) -> list[WireguardPeer]:
+    return [peer for peer in peers if peer.peer_type in (ProtocolType.WIREGUARD, ProtocolType.AMNEZIA_WIREGUARD)]
+
+def xray_peers(peers: list[Union[WireguardPeer, XrayPeer]]) -> list[XrayPeer]:
+    return [peer for peer in peers if peer.peer_type == ProtocolType.XRAY]
+
+def _warn_unknown(peers: list[Union[WireguardPeer, XrayPeer]], action: str) -> None:
+    for peer in peers:
+        if peer.peer_type not in (ProtocolType.WIREGUARD, ProtocolType.AMNEZIA_WIREGUARD, ProtocolType.XRAY):
+            core_logger.warning(f"Unknown peer type: {peer.peer_type}. Can't {action} peer.")
+
+async def enable_peers(
         wghub: WGHub,
         xray_worker: XrayWorker,
         peers: list[Union[WireguardPeer, XrayPeer]],
-        client: Client
+        client: AsyncClient
     ) -> None:
-    for peer in peers:
-        match peer.peer_type:
-            case ProtocolType.WIREGUARD | ProtocolType.AMNEZIA_WIREGUARD:
-                wghub.enable_peer(peer)
-            case ProtocolType.XRAY:
-                xray_worker.enable_peer(peer, expire_time=client.userdata.expire_time)
-            case _:
-                core_logger.warning(f"Unknown peer type: {peer.peer_type}. Can't enable peer.")
+    # every Wireguard peer is enabled with a single config write and sync,
+    # every Xray peer with a single update of its inbound
+    if wg_peers := wireguard_peers(peers):
+        await wghub.enable_peers(wg_peers)
+    if x_peers := xray_peers(peers):
+        await xray_worker.set_enabled_many(x_peers, True, expiry_time=client.userdata.expire_time)
+    _warn_unknown(peers, "enable")
 
-        client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
+    for peer in peers:
+        await client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
 
-def disable_peers(
+async def disable_peers(
         wghub: WGHub,
         xray_worker: XrayWorker,
         peers: list[Union[WireguardPeer, XrayPeer]],
-        client: Client = None
+        client: AsyncClient = None
     ) -> None:
-    for peer in peers:
-        match peer.peer_type:
-            case ProtocolType.WIREGUARD | ProtocolType.AMNEZIA_WIREGUARD:
-                wghub.disable_peer(peer)
-            case ProtocolType.XRAY:
-                xray_worker.disable_peer(peer, expire_time=client.userdata.expire_time)
-            case _:
-                core_logger.warning(f"Unknown peer type: {peer.peer_type}. Can't disable peer.")
-
-        client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_BLOCKED)
+    await disable_clients_peers(wghub, xray_worker, [(client, peers)])
+
+async def disable_clients_peers(
+        wghub: WGHub,
+        xray_worker: XrayWorker,
+        clients: list[tuple[AsyncClient, list[Union[WireguardPeer, XrayPeer]]]]
+    ) -> None:
+    """
+    Disables peers of many clients at once: a single Wireguard sync and a single update per 3x-ui inbound.
+    Every Xray client gets the expiry time of its own user.
+    """
+    peers = [peer for _, client_peers in clients for peer in client_peers]
+    if wg_peers := wireguard_peers(peers):
+        await wghub.disable_peers(wg_peers)
+    if x_peers := xray_peers(peers):
+        expiry_times = {
+            peer.peer_id: client.userdata.expire_time
+            for client, client_peers in clients if client is not None
+            for peer in xray_peers(client_peers)
+        }
+        # peers that failed are logged by the worker and fixed by the reconciler later
+        await xray_worker.set_enabled_many(x_peers, False, expiry_times=expiry_times)
+    _warn_unknown(peers, "disable")
+
+    for client, client_peers in clients:
+        for peer in client_peers:
+            await client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_BLOCKED)
@@ -0,0 +1,224 @@
+import asyncio
+from typing import NamedTuple, Optional, Union
+
+from core.db.async_db import AsyncClientFactory
+from core.db.enums import PeerStatusChoices
+from core.db.model_serializer import WireguardPeer, XrayPeer
+from core.logs import core_logger
+from core.wg.wg_config import WGConfig
+from core.wg.wg_work import WGCommandError, WGHub, WGPeerStats
+from core.xray.xray_worker import XrayWorker
+
+
+class ReconcilePlan(NamedTuple):
+    """
+    Fixes that bring the Wireguard config, the interface and 3x-ui to the state stored in the database.
+    The database is the source of truth and is never changed.
+    """
+    config_upsert: list[WireguardPeer]
+    """Peers that are missing from the config file or have outdated keys or addresses"""
+    config_remove: list[str]
+    """Public keys of config peers that have no row in the database"""
+    config_enable: list[str]
+    config_disable: list[str]
+    interface_sync: list[str]
+    """Public keys of peers whose state on the interface differs from the database"""
+    xray_add: list[XrayPeer]
+    xray_enable: list[XrayPeer]
+    xray_disable: list[XrayPeer]
+    xray_remove: list[tuple[int, str]]
+    """`(inbound_id, client_id)` of 3x-ui clients that were created by the bot but have no peer"""
+    unavailable: list[str]
+    """Views that couldn't be read and were left out"""
+
+    @property
+    def config_changes(self) -> int:
+        return len(self.config_upsert) + len(self.config_remove) + len(self.config_enable) + len(self.config_disable)
+
+    @property
+    def xray_changes(self) -> int:
+        return len(self.xray_add) + len(self.xray_enable) + len(self.xray_disable) + len(self.xray_remove)
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.config_changes and not self.interface_sync and not self.xray_changes
+
+
+def _normalize_ips(ips: Union[str, list, tuple, None]) -> frozenset[str]:
+    if not ips:
+        return frozenset()
+    if isinstance(ips, str):
+        ips = ips.split(",")
+    return frozenset(ip if "/" in ip else f"{ip}/32" for ip in (str(ip).strip() for ip in ips) if ip)
+
+
+def _is_enabled(peer: Union[WireguardPeer, XrayPeer]) -> bool:
+    return PeerStatusChoices.xray_enabled(peer.peer_status)
+
+
+def compute_plan(
+        wireguard_peers: list[WireguardPeer],
+        xray_peers: list[XrayPeer],
+        config: WGConfig,
+        interface: Optional[dict[str, WGPeerStats]],
+        xray_clients: Optional[dict[str, tuple[int, bool]]]
+    ) -> ReconcilePlan:
+    """
+    Compares the views as sets keyed by public key or peer ID. Every view is walked once.
+
+    Args:
+        wireguard_peers (list[WireguardPeer]): Wireguard peers from the database.
+        xray_peers (list[XrayPeer]): Xray peers from the database.
+        config (WGConfig): Parsed Wireguard config file.
+        interface (Optional[dict[str, WGPeerStats]]): Peers on the interface, None if it couldn't be read.
+        xray_clients (Optional[dict[str, tuple[int, bool]]]): 3x-ui clients, None if they couldn't be read.
+    """
+    plan = ReconcilePlan([], [], [], [], [], [], [], [], [], [])
+    desired = {peer.public_key: peer for peer in wireguard_peers}
+
+    for public_key, peer in desired.items():
+        allowed_ips = _normalize_ips(peer.shared_ips)
+        if public_key not in config:
+            plan.config_upsert.append(peer)
+        else:
+            attrs = config.get_peer(public_key)
+            if attrs.get("PresharedKey") != peer.preshared_key or _normalize_ips(attrs.get("AllowedIPs")) != allowed_ips:
+                plan.config_upsert.append(peer)
+            elif config.get_peer_enabled(public_key) != _is_enabled(peer):
+                (plan.config_enable if _is_enabled(peer) else plan.config_disable).append(public_key)
+
+        if interface is not None:
+            state = interface.get(public_key)
+            if _is_enabled(peer):
+                if state is None or _normalize_ips(state.allowed_ips) != allowed_ips:
+                    plan.interface_sync.append(public_key)
+            elif state is not None:
+                plan.interface_sync.append(public_key)
+
+    plan.config_remove.extend(key for key in config.get_peers(include_disabled=True) if key not in desired)
+    if interface is not None:
+        plan.interface_sync.extend(key for key in interface if key not in desired)
+    else:
+        plan.unavailable.append("interface")
+
+    if xray_clients is not None:
+        known = set()
+        for peer in xray_peers:
+            known.add(str(peer.peer_id))
+            client = xray_clients.get(str(peer.peer_id))
+            if client is None:
+                plan.xray_add.append(peer)
+            elif client[1] != _is_enabled(peer):
+                (plan.xray_enable if _is_enabled(peer) else plan.xray_disable).append(peer)
+        # clients created in the panel by hand have UUIDs, the bot uses peer IDs
+        plan.xray_remove.extend(
+            (inbound_id, client_id) for client_id, (inbound_id, _) in xray_clients.items()
+            if client_id not in known and client_id.isdigit()
+        )
+    else:
+        plan.unavailable.append("xray")
+    return plan
+
+
+class Reconciler:
+    """
+    Finds drift between the database, the Wireguard config file, the Wireguard interface and 3x-ui
+    and fixes it with batched changes.
+
+    Every view is read once per pass: a single database query, a single parse of the config file,
+    a single `wg show dump` and a single request per 3x-ui inbound.
+    """
+    def __init__(self, wghub: WGHub, xray: XrayWorker, inbound_ids: Optional[list[int]] = None):
+        self.wghub = wghub
+        self.xray = xray
+        self.inbound_ids = inbound_ids or []
+        """Inbounds that are checked for orphaned clients in addition to the inbounds of Xray peers"""
+
+    async def plan(self) -> ReconcilePlan:
+        """Reads all views and computes the fixes without changing anything."""
+        wireguard_peers, xray_peers = [], []
+        for _, peers in await AsyncClientFactory.select_clients_with_peers(trusted=True):
+            for peer in peers:
+                if isinstance(peer, WireguardPeer):
+                    wireguard_peers.append(peer)
+                elif isinstance(peer, XrayPeer):
+                    xray_peers.append(peer)
+
+        # the hub persists lazily, write its pending changes first so they don't show up as drift
+        await self.wghub.submit(self.wghub.write_config)
+        config = WGConfig(self.wghub.path)
+        await asyncio.to_thread(config.read_file)
+
+        try:
+            interface = await self.wghub.get_peer_stats()
+        except (OSError, WGCommandError) as e:
+            core_logger.warning(f"Couldn't read Wireguard interface for reconciliation: {e}")
+            interface = None
+
+        inbound_ids = {*self.inbound_ids, *(peer.inbound_id for peer in xray_peers)}
+        try:
+            xray_clients = await self.xray.get_inbound_clients(inbound_ids)
+        except Exception as e:
+            core_logger.warning(f"Couldn't read 3x-ui clients for reconciliation: {e}")
+            xray_clients = None
+
+        plan = compute_plan(wireguard_peers, xray_peers, config, interface, xray_clients)
+        with core_logger.contextualize(
+            config_changes=plan.config_changes,
+            interface_changes=len(plan.interface_sync),
+            xray_changes=plan.xray_changes,
+            unavailable=plan.unavailable
+        ):
+            core_logger.info("Reconciliation plan computed.")
+        return plan
+
+    def __fix_config(self, plan: ReconcilePlan) -> None:
+        """Applies config fixes to the in-memory config of the hub. Runs on the hub's thread."""
+        config = self.wghub.wgconfig
+        for public_key in plan.config_remove:
+            if public_key in config:
+                config.del_peer(public_key)
+        for peer in plan.config_upsert:
+            if peer.public_key in config:
+                config.del_peer(peer.public_key)
+            config.add_peer(peer.public_key, f"# {peer.peer_name}")
+            config.add_attr(peer.public_key, "PresharedKey", peer.preshared_key)
+            config.add_attr(peer.public_key, "AllowedIPs", ",".join(sorted(_normalize_ips(peer.shared_ips))))
+            if not _is_enabled(peer):
+                config.disable_peer(peer.public_key)
+        for public_key in plan.config_enable:
+            if public_key in config:
+                config.enable_peer(public_key)
+        for public_key in plan.config_disable:
+            if public_key in config:
+                config.disable_peer(public_key)
+
+    async def apply(self, plan: ReconcilePlan) -> None:
+        """
+        Applies the plan: config fixes and interface updates go to `WGHub` as a single command,
+        3x-ui clients are enabled and disabled with a single update per inbound.
+        """
+        if plan.config_changes or plan.interface_sync:
+            public_keys = set(plan.interface_sync)
+            if "interface" in plan.unavailable:
+                # the interface state is unknown, push every peer that was touched in the config
+                public_keys.update(peer.public_key for peer in plan.config_upsert)
+                public_keys.update(plan.config_remove + plan.config_enable + plan.config_disable)
+            await self.wghub.submit(lambda: self.__fix_config(plan), public_keys)
+
+        if plan.xray_changes:
+            await self.__fix_xray(plan)
+        core_logger.info("Reconciliation plan applied.")
+
+    async def __fix_xray(self, plan: ReconcilePlan) -> None:
+        peers_by_inbound: dict[int, list[XrayPeer]] = {}
+        for peer in plan.xray_add:
+            peers_by_inbound.setdefault(peer.inbound_id, []).append(peer)
+        for inbound_id, peers in peers_by_inbound.items():
+            await self.xray.add_peers(inbound_id, peers)
+        if plan.xray_enable:
+            await self.xray.set_enabled_many(plan.xray_enable, True)
+        if plan.xray_disable:
+            await self.xray.set_enabled_many(plan.xray_disable, False)
+        for inbound_id, client_id in plan.xray_remove:
+            await self.xray.delete_client(inbound_id, client_id)
@@ -1,21 +1,37 @@
 import asyncio
 import datetime
+import time
 from contextlib import suppress
-from typing import Callable, Coroutine, Union
+from enum import StrEnum
+from typing import Callable, Coroutine, Optional, Union
 
 from icmplib import async_ping
 
-from core.db.db_works import Client, ClientFactory
+from core.db.async_db import AsyncClient, AsyncClientFactory, db_thread
+from core.db.db_works import ClientFactory
 from core.db.enums import ClientStatusChoices, PeerStatusChoices, ProtocolType
 from core.db.model_serializer import BasePeer, WireguardPeer, XrayPeer
+from core.db.quota import quota_engine
+from core.db.sessions import SessionWriter, compact_sessions
+from core.db.stats import service_stats
+from core.db.traffic import TrafficAccounting
+from core.db.write_buffer import StatusWriteBuffer
 from core.logs import core_logger
-from core.utils.peers_utils import disable_peers
+from core.utils.peers_utils import (disable_clients_peers, disable_peers,
+                                    enable_peers)
 from core.watchdog.object import CallableObject
 from core.watchdog.observer import EventObserver
-from core.wg.wg_work import WGHub
+from core.wg.wg_work import WGCommandError, WGHub, WGPeerStats
 from core.xray.xray_worker import XrayWorker
 
 
+class ConnectionDetection(StrEnum):
+    HANDSHAKE = "handshake"
+    """Latest handshakes and received bytes from a single `wg show dump` per check cycle"""
+    ICMP = "icmp"
+    """Ping of every Wireguard peer"""
+
+
 class ConnectionEvents:
     def __init__(
             self,
@@ -24,7 +40,12 @@ class ConnectionEvents:
             listen_timer: int = 120,
             connected_only_listen_timer: int = 60,
             update_timer: int = 360,
-            active_hours: int = 5
+            active_hours: int = 5,
+            status_flush_interval: int = 5,
+            detection: ConnectionDetection = ConnectionDetection.HANDSHAKE,
+            handshake_timeout: int = 180,
+            traffic_sample_interval: int = 60,
+            traffic_flush_interval: int = 300
         ):
         self.listen_timer = listen_timer
         self.update_timer = update_timer
@@ -32,29 +53,78 @@ class ConnectionEvents:
         self.active_hours = active_hours
         self.wghub = wghub
         self.xray = xray
+        self.status_flush_interval = status_flush_interval
+        self.status_buffer = StatusWriteBuffer()
+        """Coalesces status changes of peers and clients. Flushed after every check cycle
+        and at least every `status_flush_interval` seconds."""
+        self.session_writer = SessionWriter()
+        """Records connection sessions of peers. Flushed along with `status_buffer`."""
+        self.traffic = TrafficAccounting()
+        """Traffic of peers, sampled every `traffic_sample_interval` and written every `traffic_flush_interval` seconds"""
+        self.traffic_sample_interval = traffic_sample_interval
+        self.traffic_flush_interval = traffic_flush_interval
         self.is_time_limitation_disabled: bool = active_hours == 0
         """If True, time limitation for all peers is disabled. It means that peers won't be automatically disconnected after a certain period of time."""
-
-        self.connected = EventObserver(required_types=[Client, BasePeer])
+        self.detection = detection
+        """How Wireguard peers are checked. Falls back to ICMP if handshakes can't be read"""
+        self.handshake_timeout = handshake_timeout
+        """Seconds since the latest handshake after which a Wireguard peer without new traffic is disconnected"""
+        self.__wg_stats: Optional[dict[str, WGPeerStats]] = None
+        """Peers on the Wireguard interface for the current check cycle, None if ICMP is used"""
+        self.__received_bytes: dict[str, int] = {}
+        """Bytes received from Wireguard peers by the previous check cycle"""
+        self.__xray_online: Optional[frozenset[str]] = None
+        """Emails of Xray clients online in the current check cycle, None if they couldn't be read"""
+
+        self.connected = EventObserver(required_types=[AsyncClient, BasePeer])
         """Decorated methods must have a `Client` and `BasePeer` argument"""
-        self.disconnected = EventObserver(required_types=[Client, BasePeer])
+        self.disconnected = EventObserver(required_types=[AsyncClient, BasePeer])
         """Decorated methods must have a `Client` and `BasePeer` argument"""
         # TODO: separate timer_observer into two different observers for warning and disconnect
-        self.timer_observer = EventObserver(required_types=[Client, BasePeer, bool])
+        self.timer_observer = EventObserver(required_types=[AsyncClient, BasePeer, bool])
         """Decorated methods must have a `Client`, `BasePeer` and `disconnect` boolean argument.
         `disconnect` describes whether the trigger is a warning (**False**) or a disconnect (**True**)"""
         self.startup = EventObserver()
 
-        self.clients: list[tuple[Client, list[Union[WireguardPeer, XrayPeer]]]] = [
-            (client, client.get_all_peers(protocol_specific=True)) for client in ClientFactory.select_clients()
+        self.__peers_by_user: dict[str, list[Union[WireguardPeer, XrayPeer]]] = {}
+        # the event loop isn't running yet, so the initial list is loaded synchronously
+        self.clients = [
+            (AsyncClient(client), peers) for client, peers in ClientFactory.select_clients_with_peers(trusted=True)
         ]
-        """List of all `Client`s and their `ConnectionPeer`s"""
+        # peers that are still connected since the last run start their sessions from now on
+        for _, peers in self.clients:
+            for peer in peers:
+                if peer.peer_status == PeerStatusChoices.STATUS_CONNECTED:
+                    self.session_writer.open(peer.peer_id)
 
         self.__clients_lock = asyncio.Lock()
         """Internal lock that prevents updating `self.clients`
         during client connection checks"""
 
-    async def __check_connection(self, client: Client, peer: BasePeer) -> bool:
+    @property
+    def clients(self) -> list[tuple[AsyncClient, list[Union[WireguardPeer, XrayPeer]]]]:
+        """List of all `Client`s and their `ConnectionPeer`s"""
+        return self.__clients
+
+    @clients.setter
+    def clients(self, value: list[tuple[AsyncClient, list[Union[WireguardPeer, XrayPeer]]]]):
+        self.__clients = value
+        self.__peers_by_user = {str(client.userdata.user_id): peers for client, peers in value}
+
+    async def __has_connected_peers(self, client: AsyncClient) -> bool:
+        """Checks whether the client has connected peers using in-memory statuses.
+        Falls back to the database if the client is not tracked by the observer."""
+        peers = self.__peers_by_user.get(str(client.userdata.user_id))
+        if peers is None:
+            await db_thread.run(self.status_buffer.flush)
+            return len(await client.get_connected_peers()) > 0
+        return any(peer.peer_status == PeerStatusChoices.STATUS_CONNECTED for peer in peers)
+
+    def __set_client_status(self, client: AsyncClient, status: ClientStatusChoices):
+        client.userdata.status = status
+        self.status_buffer.set_client_status(client.userdata.user_id, status)
+
+    async def __check_connection(self, client: AsyncClient, peer: BasePeer) -> bool:
         """
         Check the connection status of a peer and handle any necessary state changes.
         This method verifies the peer's connection status by checking timer expiration
@@ -71,8 +141,9 @@ class ConnectionEvents:
             bool: True if the peer is connected, False otherwise
 
         Notes:
-            For WireGuard peers, a ping test is used to determine connectivity.
-            For Xray peers, the internal xray service is queried for connection status.
+            For WireGuard peers, the latest handshake and received bytes are used to determine connectivity,
+            or a ping test if handshakes can't be read.
+            For Xray peers, the snapshot of online 3x-ui clients taken at the start of the cycle is checked.
             The method will automatically emit connect/disconnect events when the
             peer's status changes.
         """
@@ -94,8 +165,7 @@ class ConnectionEvents:
                 await self.timer_observer.trigger(client, peer, disconnect=False)
 
         if peer.peer_type in (ProtocolType.WIREGUARD, ProtocolType.AMNEZIA_WIREGUARD):
-            host = await async_ping(peer.shared_ips)
-            if host.is_alive:
+            if await self.__is_wireguard_peer_alive(peer):
                 if peer.peer_status == PeerStatusChoices.STATUS_DISCONNECTED:
                     await self.emit_connect(client, peer)
                 return True
@@ -104,7 +174,11 @@ class ConnectionEvents:
                 await self.emit_disconnect(client, peer)
             return False
         elif peer.peer_type == ProtocolType.XRAY:
-            if self.xray.is_connected(peer):
+            if self.__xray_online is None:
+                # the state is unknown, keep the current one
+                return peer.peer_status == PeerStatusChoices.STATUS_CONNECTED
+
+            if peer.peer_name in self.__xray_online:
                 if peer.peer_status == PeerStatusChoices.STATUS_DISCONNECTED:
                     await self.emit_connect(client, peer)
                 return True
@@ -113,6 +187,105 @@ class ConnectionEvents:
                 await self.emit_disconnect(client, peer)
             return False
 
+    async def __load_wireguard_stats(self) -> None:
+        """Reads the state of all Wireguard peers for the check cycle with a single subprocess call."""
+        self.__wg_stats = None
+        if self.detection != ConnectionDetection.HANDSHAKE:
+            return
+        try:
+            self.__wg_stats = await self.wghub.get_peer_stats()
+        except (OSError, WGCommandError) as e:
+            core_logger.warning(f"Couldn't read Wireguard handshakes, falling back to ICMP: {e}")
+
+    async def __load_xray_online(self) -> None:
+        """Reads online Xray clients for the check cycle with a single request."""
+        self.__xray_online = None
+        if not any(isinstance(peer, XrayPeer) for _, peers in self.clients for peer in peers):
+            return
+        try:
+            self.__xray_online = await self.xray.get_online_clients()
+        except Exception as e:
+            core_logger.warning(f"Couldn't read online Xray clients, their statuses are left as is: {e}")
+
+    async def __is_wireguard_peer_alive(self, peer: WireguardPeer) -> bool:
+        """
+        A peer is alive if it has sent anything since the previous check cycle
+        or its latest handshake is younger than `handshake_timeout`.
+        """
+        if self.__wg_stats is None:
+            host = await async_ping(peer.shared_ips)
+            return host.is_alive
+
+        stats = self.__wg_stats.get(peer.public_key)
+        if stats is None:
+            # the peer isn't on the interface
+            return False
+
+        previous_rx = self.__received_bytes.get(peer.public_key)
+        self.__received_bytes[peer.public_key] = stats.transfer_rx
+        # counters start from zero when the interface is restarted
+        if previous_rx is not None and stats.transfer_rx > previous_rx:
+            return True
+        return stats.latest_handshake is not None and time.time() - stats.latest_handshake <= self.handshake_timeout
+
+    async def sample_traffic(self) -> int:
+        """
+        Reads transfer counters of all peers, one `wg show dump` and one 3x-ui request per inbound,
+        and records them in `self.traffic`.
+
+        Returns:
+            int: Number of peers that had traffic since the previous sample.
+        """
+        wireguard_peers: dict[str, int] = {}
+        xray_peers: dict[str, int] = {}
+        owners: dict[int, str] = {}
+        inbound_ids = set()
+        for client, peers in self.clients:
+            for peer in peers:
+                owners[peer.peer_id] = str(client.userdata.user_id)
+                if isinstance(peer, WireguardPeer):
+                    wireguard_peers[peer.public_key] = peer.peer_id
+                elif isinstance(peer, XrayPeer):
+                    xray_peers[peer.peer_name] = peer.peer_id
+                    inbound_ids.add(peer.inbound_id)
+
+        samples = []
+        if wireguard_peers:
+            try:
+                stats = await self.wghub.get_peer_stats()
+            except (OSError, WGCommandError) as e:
+                core_logger.warning(f"Couldn't read Wireguard transfer counters: {e}")
+            else:
+                samples.extend(
+                    (wireguard_peers[key], peer.transfer_rx, peer.transfer_tx)
+                    for key, peer in stats.items() if key in wireguard_peers
+                )
+        if xray_peers:
+            try:
+                traffic = await self.xray.get_clients_traffic(inbound_ids)
+            except Exception as e:
+                core_logger.warning(f"Couldn't read Xray traffic counters: {e}")
+            else:
+                samples.extend(
+                    (xray_peers[email], up, down) for email, (up, down) in traffic.items() if email in xray_peers
+                )
+
+        deltas = self.traffic.record(samples)
+        self.traffic.retain(owners)
+
+        usage_by_user: dict[str, int] = {}
+        for peer_id, usage in deltas.items():
+            usage_by_user[owners[peer_id]] = usage_by_user.get(owners[peer_id], 0) + usage.total
+        quota_engine.add(usage_by_user)
+
+        core_logger.debug(f"Traffic sampled. Active peers: {len(deltas)}.")
+        return len(deltas)
+
+    async def __sample_traffic_task(self):
+        while True:
+            await self.sample_traffic()
+            await asyncio.sleep(self.traffic_sample_interval)
+
     async def __listen_clients_task(self, listen_timer: int, connected_only: bool = False):
         while True:
             await self.run_check_connections(connected_only)
@@ -121,68 +294,72 @@ class ConnectionEvents:
                 core_logger.debug(f"Event has finished its job. Sleeping for {listen_timer} seconds...")
             await asyncio.sleep(listen_timer)
 
-    async def emit_connect(self, client: Client, peer: BasePeer):
+    async def emit_connect(self, client: AsyncClient, peer: BasePeer):
         """Propagates connection event to handlers.
         Sets the time until which the connection can be active.
 
         Updates Client status to `ClientStatusChoices.STATUS_CONNECTED`
         and Peer status to `PeerStatusChoices.STATUS_DISCONNECTED`"""
         new_time = datetime.datetime.now() + datetime.timedelta(hours=self.active_hours)
-        client.set_peer_timer(peer.peer_id, new_time)
-        client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_CONNECTED)
-        client.set_status(ClientStatusChoices.STATUS_CONNECTED)
+        self.status_buffer.set_peer_timer(peer.peer_id, new_time)
+        self.status_buffer.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_CONNECTED)
+        self.__set_client_status(client, ClientStatusChoices.STATUS_CONNECTED)
+        self.session_writer.open(peer.peer_id)
         # avoid triggering connection event multiple times
         peer.peer_status = PeerStatusChoices.STATUS_CONNECTED
         peer.peer_timer = new_time
         await self.connected.trigger(client, peer)
 
-    async def emit_disconnect(self, client: Client, peer: BasePeer):
+    async def emit_disconnect(self, client: AsyncClient, peer: BasePeer):
         """Propagates disconnect event to handlers.
 
         Updates Client status to `ClientStatusChoices.STATUS_DISCONNECTED`
         and Peer status to `PeerStatusChoices.STATUS_DISCONNECTED`"""
-        client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
+        self.status_buffer.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
+        self.session_writer.close(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
         # avoid triggering disconnection event multiple times
         peer.peer_status = PeerStatusChoices.STATUS_DISCONNECTED
-        if len(client.get_connected_peers()) == 0:
-            client.set_status(ClientStatusChoices.STATUS_DISCONNECTED)
+        if not await self.__has_connected_peers(client):
+            self.__set_client_status(client, ClientStatusChoices.STATUS_DISCONNECTED)
         await self.disconnected.trigger(client, peer)
 
-    async def emit_timeout_disconnect(self, client: Client, peer: BasePeer):
-        client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_TIME_EXPIRED)
+    async def emit_timeout_disconnect(self, client: AsyncClient, peer: BasePeer):
+        self.status_buffer.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_TIME_EXPIRED)
+        self.session_writer.close(peer.peer_id, PeerStatusChoices.STATUS_TIME_EXPIRED)
         # avoid triggering the timer_observer multiple times
         peer.peer_status = PeerStatusChoices.STATUS_TIME_EXPIRED
         match peer.peer_type:
             case ProtocolType.WIREGUARD | ProtocolType.AMNEZIA_WIREGUARD:
-                self.wghub.disable_peer(peer)
+                await self.wghub.disable_peer(peer)
             case ProtocolType.XRAY:
-                self.xray.disable_peer(peer)
-        if len(client.get_connected_peers()) == 0:
-            client.set_status(ClientStatusChoices.STATUS_TIME_EXPIRED)
+                await self.xray.disable_peer(peer)
+        if not await self.__has_connected_peers(client):
+            self.__set_client_status(client, ClientStatusChoices.STATUS_TIME_EXPIRED)
         await self.disconnected.trigger(client, peer)
 
-    def update_client_peers(self, client: Client):
+    async def update_client_peers(self, client: AsyncClient):
+        # statuses are read back from the database, so pending changes must be written first
+        await db_thread.run(self.status_buffer.flush)
+        peers = await client.get_all_peers(protocol_specific=True, trusted=True)
         self.clients[
             next((i for i, v in enumerate(self.clients) if v[0].userdata.user_id == client.userdata.user_id), None)
-        ] = (
-            client, client.get_all_peers(protocol_specific=True)
-        )
+        ] = (client, peers)
+        self.__peers_by_user[str(client.userdata.user_id)] = peers
 
         core_logger.debug(f"Updated client {client.userdata.user_id} peers.")
 
-    def update_clients_list(self):
+    async def update_clients_list(self):
         """Updates the list of clients and their peers.
         """
-        self.clients: list[tuple[Client, list[Union[WireguardPeer, XrayPeer]]]] = [
-            (client, client.get_all_peers(protocol_specific=True)) for client in ClientFactory.select_clients()
-        ]
+        await db_thread.run(self.status_buffer.flush)
+        self.clients = await AsyncClientFactory.select_clients_with_peers(trusted=True)
         core_logger.debug("Clients list updated.")
 
     # dunno how to name this method better
     async def __update_clients_list_task(self):
         while True:
             async with self.__clients_lock:
-                self.update_clients_list()
+                await self.update_clients_list()
                 core_logger.debug(f"Done updating clients list. Sleeping for {self.update_timer} sec")
 
             await asyncio.sleep(self.update_timer)
@@ -191,6 +368,10 @@ class ConnectionEvents:
         await self.startup.trigger()
         async with asyncio.TaskGroup() as group:
             group.create_task(self.__update_clients_list_task())
+            group.create_task(self.status_buffer.run(self.status_flush_interval))
+            group.create_task(self.session_writer.run(self.status_flush_interval))
+            group.create_task(self.traffic.run(self.traffic_flush_interval))
+            group.create_task(self.__sample_traffic_task())
             group.create_task(self.__listen_clients_task(self.listen_timer))
             group.create_task(
                 self.__listen_clients_task(
@@ -207,13 +388,16 @@ class ConnectionEvents:
             connected_only (bool, optional): Whether to only check connected clients. Defaults to False.
         """
         async with self.__clients_lock:
+            await self.__load_wireguard_stats()
+            await self.__load_xray_online()
             # looks cringy, but idk how to make it prettier
             # TODO: think about threading...
             async with asyncio.TaskGroup() as group:
                 for client, peers in self.clients:
                     if client.userdata.status in [
                         ClientStatusChoices.STATUS_ACCOUNT_BLOCKED,
-                        ClientStatusChoices.STATUS_TIME_EXPIRED]:
+                        ClientStatusChoices.STATUS_TIME_EXPIRED,
+                        ClientStatusChoices.STATUS_QUOTA_EXCEEDED]:
                         continue
 
                     for peer in peers:
@@ -231,6 +415,8 @@ class ConnectionEvents:
                         group.create_task(
                             self.__check_connection(client, peer)
                         )
+            await db_thread.run(self.status_buffer.flush)
+            await db_thread.run(self.session_writer.flush)
         with core_logger.contextualize(connected_only=connected_only):
             core_logger.debug("Created tasks for checking connections.")
 
@@ -239,13 +425,30 @@ class ConnectionEvents:
 
 
 class IntervalEvents:
-    def __init__(self, wg_hub: WGHub, xray: XrayWorker):
-        self.expire_date_warning_observer = EventObserver(required_types=[Client])
+    def __init__(
+            self,
+            wg_hub: WGHub,
+            xray: XrayWorker,
+            stats_reconcile_interval: int = 600,
+            session_retention_days: int = 7,
+            quota_check_interval: int = 60
+        ):
+        self.expire_date_warning_observer = EventObserver(required_types=[AsyncClient])
         """Observer triggers if there's one day left before blocking user. Requires `Client` as an argument."""
-        self.expire_date_block_observer = EventObserver(required_types=[Client])
+        self.expire_date_block_observer = EventObserver(required_types=[AsyncClient])
         """Observer triggers if the expiration date has passed. Requires `Client` as an argument."""
+        self.quota_exceeded_observer = EventObserver(required_types=[AsyncClient])
+        """Observer triggers if the client was blocked for exceeding the traffic quota. Requires `Client` as an argument."""
+        self.quota_restored_observer = EventObserver(required_types=[AsyncClient])
+        """Observer triggers if the client was unblocked since the quota period moved on. Requires `Client` as an argument."""
         self.wg_hub = wg_hub
         self.xray = xray
+        self.stats_reconcile_interval = stats_reconcile_interval
+        """Seconds between checks of `service_stats` against the database"""
+        self.session_retention_days = session_retention_days
+        """Sessions older than this number of days are merged into daily rollups"""
+        self.quota_check_interval = quota_check_interval
+        """Seconds between evaluations of `quota_engine`"""
 
     async def interval_runner(
             self, func: Union[CallableObject, Callable, Coroutine], interval: datetime.timedelta, *args, **kwargs
@@ -298,22 +501,77 @@ class IntervalEvents:
             core_logger.info(f"Job {func.callback.__name__} done.")
 
     async def __check_users_expire_date(self):
-        now = datetime.datetime.now()
-        for client in ClientFactory.select_clients():
-            if not isinstance(client.userdata.expire_time, datetime.datetime) or \
-               client.userdata.status == ClientStatusChoices.STATUS_ACCOUNT_BLOCKED:
-                continue
-
-            if client.userdata.expire_time.date() <= now.date():
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        tomorrow = today + datetime.timedelta(days=1)
+
+        # clients that expire today or earlier are blocked at once, peers are disabled afterwards
+        blocked = await AsyncClientFactory.block_expired_clients(until=tomorrow)
+        if blocked:
+            clients = await AsyncClientFactory.select_clients_with_peers(
+                trusted=True,
+                user_ids=[client.userdata.user_id for client in blocked]
+            )
+            for client, _ in clients:
                 core_logger.info(f"Blocking user {client.userdata.name} due to expired account.")
-                client.set_status(ClientStatusChoices.STATUS_ACCOUNT_BLOCKED)
-                peers = client.get_all_peers(protocol_specific=True)
-                disable_peers(self.wg_hub, self.xray, peers, client=client)
+            # peers of every blocked user go in one batch: a single sync and a single update per inbound
+            await disable_clients_peers(self.wg_hub, self.xray, clients)
+            for client, _ in clients:
                 await self.expire_date_block_observer.trigger(client)
-            elif (client.userdata.expire_time - datetime.timedelta(days=1)).date() <= now.date():
-                core_logger.info(f"Warning user {client.userdata.name} about the expiration date.")
-                await self.expire_date_warning_observer.trigger(client)
+
+        for client in await AsyncClientFactory.select_expiring_clients(
+            until=tomorrow + datetime.timedelta(days=1),
+            since=tomorrow
+        ):
+            core_logger.info(f"Warning user {client.userdata.name} about the expiration date.")
+            await self.expire_date_warning_observer.trigger(client)
+
+    async def __enforce_quotas(self):
+        to_block, to_unblock = quota_engine.evaluate()
+
+        if to_block:
+            for client, peers in await AsyncClientFactory.select_clients_with_peers(trusted=True, user_ids=to_block):
+                # blocked and expired users keep their status, otherwise unblocking them
+                # when the window moves on would enable their peers
+                if client.userdata.status not in [
+                    ClientStatusChoices.STATUS_CREATED,
+                    ClientStatusChoices.STATUS_CONNECTED,
+                    ClientStatusChoices.STATUS_DISCONNECTED]:
+                    continue
+                core_logger.info(f"Blocking user {client.userdata.name} due to exceeded traffic quota.")
+                await client.set_status(ClientStatusChoices.STATUS_QUOTA_EXCEEDED)
+                await disable_peers(self.wg_hub, self.xray, peers, client=client)
+                quota_engine.mark_exceeded(client.userdata.user_id)
+                await self.quota_exceeded_observer.trigger(client)
+
+        if to_unblock:
+            for client, peers in await AsyncClientFactory.select_clients_with_peers(trusted=True, user_ids=to_unblock):
+                quota_engine.mark_restored(client.userdata.user_id)
+                # the admin may have blocked the user in the meantime
+                if client.userdata.status != ClientStatusChoices.STATUS_QUOTA_EXCEEDED:
+                    continue
+                core_logger.info(f"Unblocking user {client.userdata.name}, traffic quota period has moved on.")
+                await client.set_status(ClientStatusChoices.STATUS_DISCONNECTED)
+                await enable_peers(self.wg_hub, self.xray, peers, client=client)
+                await self.quota_restored_observer.trigger(client)
+
+    async def __compact_sessions(self):
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        await db_thread.run(compact_sessions, today - datetime.timedelta(days=self.session_retention_days))
+
+    async def __reconcile_stats(self):
+        await db_thread.run(service_stats.reconcile)
 
     async def run_checkers(self):
         async with asyncio.TaskGroup() as group:
             group.create_task(self.scheduled_runner(self.__check_users_expire_date, datetime.time(3, 0)))
+            group.create_task(self.scheduled_runner(self.__compact_sessions, datetime.time(3, 30)))
+            group.create_task(self.interval_runner(
+                self.__reconcile_stats,
+                datetime.timedelta(seconds=self.stats_reconcile_interval)
+            ))
+            # always scheduled, since an admin can set the first per-user limit at any moment;
+            # `evaluate` returns nothing while there are no limits
+            group.create_task(self.interval_runner(
+                self.__enforce_quotas,
+                datetime.timedelta(seconds=self.quota_check_interval)
+            ))
@@ -0,0 +1,104 @@
+import threading
+from collections import deque
+from typing import NamedTuple, Optional
+
+from core.logs import core_logger
+from core.wg.keygen import generate_keypairs, generate_preshared_key
+
+
+class KeyMaterial(NamedTuple):
+    private_key: str
+    public_key: str
+    preshared_key: str
+
+
+class KeyPool:
+    """
+    Pool of pre-generated key material for new Wireguard peers.
+
+    A background thread refills the pool up to `high_watermark` every time it drops below `low_watermark`,
+    so taking keys is a constant-time pop. Every triple is handed out only once.
+    If the pool is empty or the thread is not started, keys are generated right away.
+
+    Attributes:
+        low_watermark (int): Size of the pool that triggers a refill.
+        high_watermark (int): Size the pool is refilled to.
+        batch_size (int): Number of keypairs generated at once by the refill thread.
+    """
+    def __init__(self, low_watermark: int = 16, high_watermark: int = 128, batch_size: int = 16):
+        self.set_watermarks(low_watermark, high_watermark)
+        self.batch_size = batch_size
+        self.__keys: deque[KeyMaterial] = deque()
+        self.__refill_needed = threading.Event()
+        self.__stopped = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self.__keys)
+
+    @property
+    def is_running(self) -> bool:
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def set_watermarks(self, low_watermark: int, high_watermark: int) -> None:
+        if not 0 <= low_watermark <= high_watermark:
+            raise ValueError("Watermarks must satisfy 0 <= low_watermark <= high_watermark")
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+
+    def start(self) -> None:
+        """Starts the refill thread, which fills the pool up to `high_watermark` right away."""
+        if self.is_running:
+            return
+        self.__stopped.clear()
+        self.__refill_needed.set()
+        self.__thread = threading.Thread(target=self.__worker, name="key-pool", daemon=True)
+        self.__thread.start()
+        core_logger.info("Key pool refill thread started.")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        if not self.is_running:
+            return
+        self.__stopped.set()
+        self.__refill_needed.set()
+        self.__thread.join(timeout)
+        self.__thread = None
+        core_logger.info("Key pool refill thread stopped.")
+
+    def __worker(self) -> None:
+        while True:
+            self.__refill_needed.wait()
+            self.__refill_needed.clear()
+            if self.__stopped.is_set():
+                return
+            self.fill()
+
+    def fill(self) -> int:
+        """Generates key material until the pool reaches `high_watermark`. Returns the number of added triples."""
+        added = 0
+        while not self.__stopped.is_set() and (missing := self.high_watermark - len(self.__keys)) > 0:
+            pairs = generate_keypairs(min(missing, self.batch_size))
+            self.__keys.extend(
+                KeyMaterial(private_key, public_key, generate_preshared_key()) for private_key, public_key in pairs
+            )
+            added += len(pairs)
+        if added:
+            core_logger.debug(f"Key pool refilled with {added} keys.")
+        return added
+
+    def pop(self) -> KeyMaterial:
+        """Takes key material out of the pool, generating it right away if the pool is empty."""
+        try:
+            keys = self.__keys.popleft()
+        except IndexError:
+            core_logger.debug("Key pool is empty, generating keys inline.")
+            (private_key, public_key), = generate_keypairs(1)
+            keys = KeyMaterial(private_key, public_key, generate_preshared_key())
+
+        if len(self.__keys) < self.low_watermark and self.is_running:
+            self.__refill_needed.set()
+        return keys
+
+
+key_pool = KeyPool()
+"""Process-wide key pool. Configured by `config.loader` and started by `run_bot`."""
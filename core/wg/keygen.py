@@ -1,36 +1,111 @@
+import base64
+import secrets
 import subprocess
+from enum import StrEnum
+from typing import Optional
 
+from core.logs import core_logger
 
-def generate_preshared_key(is_amnezia: bool = False) -> str:
-    command = "wg" if not is_amnezia else "awg"
-    return subprocess.run(
-        [command, "genpsk"],
-        check=True,
-        capture_output=True,
-        text=True
-    ).stdout.rstrip("\n")
+try:
+    from cryptography.hazmat.primitives.asymmetric.x25519 import \
+        X25519PrivateKey
+except ImportError:
+    core_logger.warning("cryptography is not available, Wireguard public keys are computed by `wg`/`awg` tools.")
+    X25519PrivateKey = None
+
+KEY_SIZE = 32
+
+
+class KeygenBackend(StrEnum):
+    NATIVE = "native"
+    """X25519 from `cryptography` (OpenSSL), doesn't spawn processes. Falls back to `SUBPROCESS` without it"""
+    SUBPROCESS = "subprocess"
+    """`wg`/`awg` command line tools"""
+
+
+def _clamp(scalar: bytes) -> bytes:
+    k = bytearray(scalar)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return bytes(k)
+
+def _public_key(private_key: bytes) -> bytes:
+    return X25519PrivateKey.from_private_bytes(private_key).public_key().public_bytes_raw()
+
+def _decode_key(key: str) -> bytes:
+    try:
+        raw = base64.b64decode(key, validate=True)
+    except ValueError:
+        raw = b""
+    if len(raw) != KEY_SIZE:
+        raise ValueError("Key must be a base64 encoded 32-byte value")
+    return raw
+
+def _new_private_key() -> bytes:
+    # `wg genkey` outputs an already clamped key
+    return _clamp(secrets.token_bytes(KEY_SIZE))
 
-def generate_private_key(is_amnezia: bool = False) -> str:
-    command = "wg" if not is_amnezia else "awg"
+def _public_key_backend(backend: KeygenBackend) -> KeygenBackend:
+    if backend == KeygenBackend.NATIVE and X25519PrivateKey is None:
+        return KeygenBackend.SUBPROCESS
+    return backend
+
+def _run(is_amnezia: bool, *args: str, stdin: Optional[str] = None) -> str:
     return subprocess.run(
-        [command, "genkey"],
+        ["wg" if not is_amnezia else "awg", *args],
+        input=stdin,
         check=True,
         capture_output=True,
         text=True
     ).stdout.rstrip("\n")
 
-def generate_public_key(private_key: str, is_amnezia: bool = False) -> str:
+
+def generate_preshared_key(is_amnezia: bool = False, backend: KeygenBackend = KeygenBackend.NATIVE) -> str:
+    if backend == KeygenBackend.SUBPROCESS:
+        return _run(is_amnezia, "genpsk")
+    return base64.b64encode(secrets.token_bytes(KEY_SIZE)).decode()
+
+def generate_private_key(is_amnezia: bool = False, backend: KeygenBackend = KeygenBackend.NATIVE) -> str:
+    if backend == KeygenBackend.SUBPROCESS:
+        return _run(is_amnezia, "genkey")
+    return base64.b64encode(_new_private_key()).decode()
+
+def generate_public_key(
+        private_key: str,
+        is_amnezia: bool = False,
+        backend: KeygenBackend = KeygenBackend.NATIVE
+    ) -> str:
     if not private_key:
         raise ValueError("Private key is empty")
 
-    command = "wg" if not is_amnezia else "awg"
-    return subprocess.run(
-        [command, "pubkey"],
-        input=private_key,
-        check=True,
-        capture_output=True,
-        text=True
-    ).stdout.rstrip("\n")
+    if _public_key_backend(backend) == KeygenBackend.SUBPROCESS:
+        return _run(is_amnezia, "pubkey", stdin=private_key)
+    return base64.b64encode(_public_key(_decode_key(private_key))).decode()
+
+def generate_keypairs(
+        count: int,
+        is_amnezia: bool = False,
+        backend: KeygenBackend = KeygenBackend.NATIVE
+    ) -> list[tuple[str, str]]:
+    """
+    Generates `count` keypairs at once.
+
+    Returns:
+        list[tuple[str, str]]: Base64 encoded `(private_key, public_key)` pairs.
+    """
+    if _public_key_backend(backend) == KeygenBackend.SUBPROCESS:
+        pairs = []
+        for _ in range(count):
+            private_key = generate_private_key(is_amnezia, backend)
+            pairs.append((private_key, generate_public_key(private_key, is_amnezia, backend)))
+        return pairs
+
+    pairs = []
+    for _ in range(count):
+        private_key = _new_private_key()
+        pairs.append((base64.b64encode(private_key).decode(), base64.b64encode(_public_key(private_key)).decode()))
+    return pairs
 
 if __name__ == "__main__":
     priv_key = generate_private_key()
@@ -0,0 +1,252 @@
+import os
+import shutil
+import tempfile
+from contextlib import suppress
+from typing import IO, Iterable, Iterator, Optional, Union
+
+AttrValue = Union[str, int, list[Union[str, int]]]
+
+
+def parse_line(line: str) -> tuple[str, list[Union[str, int]], str]:
+    """Splits `Attr = value, value # comment` into its parts."""
+    attr, _, value = line.partition("=")
+    value, hash_sign, comment = value.partition("#")
+    value = value.strip()
+    if value.isnumeric():
+        return attr.strip(), [int(value)], hash_sign + comment
+    return attr.strip(), [item.strip() for item in value.split(",")], hash_sign + comment
+
+
+class WGSection:
+    """
+    `[Interface]` or `[Peer]` section of a Wireguard config.
+
+    Lines are kept as they were read, so the file is written back without reformatting.
+    A disabled section is written with every line prefixed by `#! `,
+    which is the convention of the `wgconfig` package the files were created with.
+
+    Attributes:
+        comments (list[str]): Comment lines right before the section header, e.g. `# peer_name`.
+        lines (list[str]): Section header followed by attribute and comment lines.
+        enabled (bool): Whether the section is commented out.
+        attrs (dict[str, list]): Parsed attribute values.
+    """
+    __slots__ = ("comments", "lines", "enabled", "attrs")
+
+    def __init__(self, header: str, comments: Optional[list[str]] = None, enabled: bool = True):
+        self.comments = comments or []
+        self.lines = [header]
+        self.enabled = enabled
+        self.attrs: dict[str, list[Union[str, int]]] = {}
+
+    def add_line(self, line: str) -> None:
+        if not line.startswith("#"):
+            attr, value, _ = parse_line(line)
+            self.attrs.setdefault(attr, []).extend(value)
+        self.lines.append(line)
+
+    def add_attr(self, attr: str, value: Union[str, int]) -> None:
+        """Adds a value to the attribute. Values of an existing attribute are extended on its last line."""
+        if attr not in self.attrs:
+            self.add_line(f"{attr} = {value}")
+            return
+
+        for i in reversed(range(1, len(self.lines))):
+            line_attr, line_value, comment = parse_line(self.lines[i])
+            if line_attr == attr and not self.lines[i].startswith("#"):
+                line_value.append(value)
+                self.lines[i] = f"{attr} = {', '.join(str(item) for item in line_value)}" + (f" {comment}" if comment else "")
+                break
+        self.attrs[attr].append(value)
+
+    def get_attrs(self) -> dict[str, AttrValue]:
+        """Returns attributes with single values unpacked from their lists."""
+        return {attr: value if len(value) > 1 else value[0] for attr, value in self.attrs.items()}
+
+    def render(self) -> Iterator[str]:
+        prefix = "" if self.enabled else "#! "
+        for line in self.comments:
+            yield f"{prefix}{line}\n"
+        for line in self.lines:
+            yield f"{prefix}{line}\n"
+
+
+class WGConfig:
+    """
+    Wireguard config file with peers indexed by their public keys.
+
+    Adding, deleting, enabling and disabling a peer are dictionary operations
+    that don't depend on the number of peers. The file is rendered section by section
+    only when it's written.
+
+    Attributes:
+        path (str): Path to the config file.
+        interface (WGSection): The `[Interface]` section.
+        peers (dict[str, WGSection]): `[Peer]` sections by public key, in file order.
+    """
+    KEY_ATTR = "PublicKey"
+    DISABLED_PREFIX = "#! "
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.interface = WGSection("[Interface]")
+        self.peers: dict[str, WGSection] = {}
+
+    def __len__(self) -> int:
+        return len(self.peers)
+
+    def __contains__(self, public_key: str) -> bool:
+        return public_key in self.peers
+
+    def read_file(self) -> None:
+        if self.path is None:
+            raise ValueError("A path needs to be provided on object creation")
+        with open(self.path, "r") as file:
+            self.read_from_fileobj(file)
+
+    def read_from_fileobj(self, lines: Iterable[str]) -> None:
+        """
+        Parses a config line by line.
+
+        Comment lines directly before a section header (without a blank line in between)
+        belong to that section, which is where peer names are kept.
+
+        Raises:
+            ValueError: The config has an unknown section, a peer without a public key or a duplicate peer.
+        """
+        interface: Optional[WGSection] = None
+        peers: dict[str, WGSection] = {}
+        section: Optional[WGSection] = None
+        comments: list[str] = []
+        disabled_comments = False
+
+        def close_section(number: int) -> None:
+            if section is None or section is interface:
+                return
+            public_key = section.attrs.get(self.KEY_ATTR, [None])[0]
+            if not isinstance(public_key, str) or not public_key:
+                raise ValueError(f"Peer section ending at line {number} has no {self.KEY_ATTR}")
+            if public_key in peers:
+                raise ValueError(f"Peer {public_key} is defined twice, second time at line {number}")
+            peers[public_key] = section
+
+        number = 0
+        for number, raw_line in enumerate(lines, start=1):
+            disabled = raw_line.startswith(self.DISABLED_PREFIX)
+            line = raw_line[len(self.DISABLED_PREFIX):] if disabled else raw_line
+            line = line.strip()
+
+            if not line:
+                # comments separated from the next header by a blank line stay in the current section
+                if section is not None:
+                    section.lines.extend(comments)
+                comments = []
+                continue
+            if line.startswith("#"):
+                if not comments:
+                    disabled_comments = disabled
+                comments.append(line)
+                continue
+            if line.startswith("["):
+                close_section(number)
+                name = line[1:].partition("]")[0].lower()
+                if comments and disabled_comments != disabled:
+                    # the comments don't belong to this section
+                    if section is not None:
+                        section.lines.extend(comments)
+                    comments = []
+                section = WGSection(line, comments, enabled=not disabled)
+                comments = []
+                if name == "interface":
+                    interface = section
+                elif name != "peer":
+                    raise ValueError(f"Unsupported section [{name}] in line {number}")
+                continue
+            if section is None:
+                raise ValueError(f"Attribute outside of a section in line {number}")
+
+            section.lines.extend(comments)
+            comments = []
+            section.add_line(line)
+
+        if section is not None:
+            section.lines.extend(comments)
+        close_section(number)
+        self.interface = interface or WGSection("[Interface]")
+        self.peers = peers
+
+    def write_to_fileobj(self, file: IO[str]) -> None:
+        file.writelines(self.interface.render())
+        for peer in self.peers.values():
+            file.write("\n")
+            file.writelines(peer.render())
+
+    def write_file(self, path: Optional[str] = None) -> None:
+        """Streams the config into a temporary file next to `path` and atomically replaces `path` with it."""
+        path = path or self.path
+        if path is None:
+            raise ValueError("A path needs to be provided")
+
+        fd, temp_path = tempfile.mkstemp(prefix=".wgconfig-", dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, "w") as temp_file:
+                self.write_to_fileobj(temp_file)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            if os.path.exists(path):
+                shutil.copymode(path, temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(temp_path)
+            raise
+
+    def __get_section(self, public_key: Optional[str]) -> WGSection:
+        if public_key is None:
+            return self.interface
+        try:
+            return self.peers[public_key]
+        except KeyError:
+            raise KeyError(f"Peer {public_key} does not exist") from None
+
+    def get_interface(self) -> dict[str, AttrValue]:
+        return self.interface.get_attrs()
+
+    def get_peers(self, include_disabled: bool = False) -> list[str]:
+        """Returns public keys of the peers."""
+        return [key for key, peer in self.peers.items() if include_disabled or peer.enabled]
+
+    def get_peer(self, public_key: str) -> dict[str, AttrValue]:
+        return self.__get_section(public_key).get_attrs()
+
+    def get_peer_enabled(self, public_key: str) -> bool:
+        return self.__get_section(public_key).enabled
+
+    def get_peer_name(self, public_key: str) -> Optional[str]:
+        """Returns the name from the `# name` comment before the peer section, if there is one."""
+        comments = self.__get_section(public_key).comments
+        return comments[-1].lstrip("#").strip() if comments else None
+
+    def add_peer(self, public_key: str, leading_comment: Optional[str] = None) -> None:
+        if public_key in self.peers:
+            raise KeyError(f"Peer {public_key} already exists")
+        if leading_comment is not None and not leading_comment.strip().startswith("#"):
+            raise ValueError('A comment needs to start with a "#"')
+
+        section = WGSection("[Peer]", [leading_comment.strip()] if leading_comment is not None else None)
+        section.add_attr(self.KEY_ATTR, public_key)
+        self.peers[public_key] = section
+
+    def add_attr(self, public_key: Optional[str], attr: str, value: Union[str, int]) -> None:
+        """Adds an attribute value to the peer, or to the interface if `public_key` is None."""
+        self.__get_section(public_key).add_attr(attr, value)
+
+    def del_peer(self, public_key: str) -> None:
+        self.__get_section(public_key)
+        del self.peers[public_key]
+
+    def enable_peer(self, public_key: str) -> None:
+        self.__get_section(public_key).enabled = True
+
+    def disable_peer(self, public_key: str) -> None:
+        self.__get_section(public_key).enabled = False
@@ -1,91 +1,459 @@
+import asyncio
+import concurrent.futures
 import os
+import queue
 import subprocess
 import tempfile
-from typing import Callable, Union
-
-import wgconfig
+import threading
+import time
+from contextlib import ExitStack, suppress
+from typing import Any, Callable, Iterable, NamedTuple, Optional, Union
 
 from core.db.model_serializer import WireguardPeer
 from core.logs import core_logger
+from core.wg.wg_config import WGConfig
+
+
+class WGHubFuture(concurrent.futures.Future):
+    """Completion handle of a `WGHub` command. Wait for it with `result()` or `await` it."""
+
+    def __await__(self):
+        return asyncio.wrap_future(self).__await__()
+
+
+class WGPeerStats(NamedTuple):
+    """State of a peer on the Wireguard interface, as reported by `wg show <interface> dump`."""
+    public_key: str
+    endpoint: Optional[str]
+    latest_handshake: Optional[int]
+    """Unix timestamp of the latest handshake, None if there was none"""
+    transfer_rx: int
+    """Bytes received from the peer since the interface was brought up"""
+    transfer_tx: int
+    """Bytes sent to the peer since the interface was brought up"""
+    allowed_ips: tuple[str, ...] = ()
+
+
+def parse_wg_dump(output: str) -> dict[str, WGPeerStats]:
+    """
+    Parses the output of `wg show <interface> dump`.
+
+    The first line describes the interface and is skipped, every other line is a tab separated peer:
+    public key, preshared key, endpoint, allowed ips, latest handshake, received bytes, sent bytes, keepalive.
+
+    Returns:
+        dict[str, WGPeerStats]: Peers by public key.
+    """
+    peers = {}
+    for line in output.splitlines()[1:]:
+        fields = line.split("\t")
+        if len(fields) < 7:
+            continue
+        public_key, _, endpoint, allowed_ips, latest_handshake, transfer_rx, transfer_tx = fields[:7]
+        peers[public_key] = WGPeerStats(
+            public_key=public_key,
+            endpoint=endpoint if endpoint != "(none)" else None,
+            latest_handshake=int(latest_handshake) or None,
+            transfer_rx=int(transfer_rx),
+            transfer_tx=int(transfer_tx),
+            allowed_ips=tuple(allowed_ips.split(",")) if allowed_ips != "(none)" else ()
+        )
+    return peers
+
+
+class WGCommandError(subprocess.CalledProcessError):
+    """
+    `wg`, `awg` or `wg-quick` exited with an error or didn't finish in time.
+
+    It's a `subprocess.CalledProcessError`, so handlers of the latter catch it too.
+
+    Attributes:
+        cmd (list[str]): The command line.
+        returncode (Optional[int]): Exit code, None if the command was killed on timeout.
+        stderr (str): Error output of the command.
+        timeout (Optional[float]): Timeout that expired, None if the command failed by itself.
+    """
+    def __init__(
+            self,
+            cmd: list[str],
+            returncode: Optional[int],
+            output: str = "",
+            stderr: str = "",
+            timeout: Optional[float] = None
+        ):
+        super().__init__(returncode, cmd, output, stderr)
+        self.timeout = timeout
+
+    @property
+    def timed_out(self) -> bool:
+        return self.timeout is not None
+
+    def __str__(self) -> str:
+        command = " ".join(self.cmd)
+        if self.timed_out:
+            return f"Command '{command}' timed out after {self.timeout} seconds"
+        details = self.stderr.strip() if self.stderr else ""
+        return f"Command '{command}' failed with exit code {self.returncode}" + (f": {details}" if details else "")
+
+
+async def run_command(args: list[str], timeout: float, stdin: Optional[str] = None) -> str:
+    """
+    Runs a command without blocking the event loop. The command is killed on timeout or cancellation.
+
+    Returns:
+        str: Output of the command.
+
+    Raises:
+        OSError: The command couldn't be started, e.g. it's not installed.
+        WGCommandError: The command failed or didn't finish in `timeout` seconds.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            process.communicate(stdin.encode("utf-8") if stdin is not None else None),
+            timeout
+        )
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        with suppress(ProcessLookupError):
+            process.kill()
+        await process.wait()
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        raise WGCommandError(args, None, timeout=timeout) from None
+
+    output, errors = stdout.decode("utf-8", "replace"), stderr.decode("utf-8", "replace")
+    if process.returncode:
+        raise WGCommandError(args, process.returncode, output, errors)
+    return output
+
+
+def run_command_sync(args: list[str], timeout: float) -> str:
+    """Blocking version of `run_command` for threads that don't run an event loop."""
+    try:
+        result = subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise WGCommandError(args, None, timeout=timeout) from None
+    if result.returncode:
+        raise WGCommandError(args, result.returncode, result.stdout, result.stderr)
+    return result.stdout
+
+
+class _Command(NamedTuple):
+    mutation: Callable[[], Any]
+    public_keys: tuple[str, ...]
+    """Peers whose kernel state may be changed by the mutation"""
+    full_sync: bool
+    future: WGHubFuture
 
 
 class WGHub:
-    def __init__(self, path: str, is_amnezia: bool = False, auto_sync: bool = True):
+    """
+    Single writer of the Wireguard config file.
+
+    Mutators don't touch the file directly: they put a command into a queue and return a `WGHubFuture`.
+    The hub's thread waits `debounce` seconds for more commands and applies all of them to the in-memory config.
+    Then the batch is pushed to the server:
+
+    - incremental sync: changed peers are updated on the interface with a single `wg set`,
+      the config file is persisted lazily `persist_delay` seconds later and a full `syncconf`
+      runs every `full_sync_interval` seconds as a safety net;
+    - full sync: the config file is atomically rewritten and synced with `syncconf`.
+
+    Futures are resolved after the batch reaches the server.
+    While the thread is not started, every command is executed right away as a batch of one
+    and the config file is written immediately.
+
+    Every `wg` call is limited by `command_timeout`. Calls made from the event loop,
+    like `get_peer_stats`, run as asyncio subprocesses and never block it.
+
+    Attributes:
+        debounce (float): Seconds to wait for more commands before applying the batch.
+        max_batch_size (int): Max number of commands in a single batch.
+        incremental_sync (bool): Update changed peers with `wg set` instead of syncing the whole config.
+        persist_delay (float): Seconds the config file may lag behind the interface in incremental mode.
+        full_sync_interval (float): Seconds between full syncs in incremental mode.
+        command_timeout (float): Seconds a `wg` call may take before it's killed.
+    """
+    _STOP = object()
+
+    def __init__(
+            self,
+            path: str,
+            is_amnezia: bool = False,
+            auto_sync: bool = True,
+            debounce: float = 0.05,
+            max_batch_size: int = 1000,
+            incremental_sync: bool = True,
+            persist_delay: float = 5,
+            full_sync_interval: float = 600,
+            command_timeout: float = 30
+        ):
         self.path = path
-        self.wgconfig = wgconfig.WGConfig(path)
+        self.wgconfig = WGConfig(path)
         self.interface_name = os.path.basename(path).split(".")[0]
         self.auto_sync = auto_sync
+        self.debounce = debounce
+        self.max_batch_size = max_batch_size
+        self.incremental_sync = incremental_sync
+        self.persist_delay = persist_delay
+        self.full_sync_interval = full_sync_interval
+        self.command_timeout = command_timeout
+        self.__queue: queue.Queue = queue.Queue()
+        self.__thread: Optional[threading.Thread] = None
+        self.__lock = threading.Lock()
+        """Serializes inline batches while the thread is not started"""
+        self.__dirty_since: Optional[float] = None
+        """When the config file started to lag behind the in-memory config"""
+        self.__last_full_sync = time.monotonic()
 
         core_logger.debug(f"Path to configuration file: {self.path} => Interface name: {self.interface_name}")
         self.wgconfig.read_file()
         self.change_command_mode(is_amnezia)
 
-    @core_logger.catch()
-    def sync_config(self):
-        strip = subprocess.run([f"{self.command}-quick", "strip", self.path], check=True, capture_output=True, text=True)
+    @property
+    def is_running(self) -> bool:
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self.__last_full_sync = time.monotonic()
+        self.__thread = threading.Thread(target=self.__worker, name="wghub", daemon=True)
+        self.__thread.start()
+        core_logger.info("WGHub thread started.")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Applies already submitted commands, persists the config file and stops the thread."""
+        if not self.is_running:
+            return
+        self.__queue.put(self._STOP)
+        self.__thread.join(timeout)
+        self.__thread = None
+        core_logger.info("WGHub thread stopped.")
+
+    def __seconds_until_maintenance(self) -> Optional[float]:
+        deadlines = []
+        if self.__dirty_since is not None:
+            deadlines.append(self.__dirty_since + self.persist_delay)
+        if self.auto_sync and self.incremental_sync:
+            deadlines.append(self.__last_full_sync + self.full_sync_interval)
+        return max(0, min(deadlines) - time.monotonic()) if deadlines else None
+
+    def __maintain(self) -> None:
+        """Persists the lagging config file and runs the periodic full sync when they're due."""
+        now = time.monotonic()
+        try:
+            if self.auto_sync and self.incremental_sync and now >= self.__last_full_sync + self.full_sync_interval:
+                self.__persist()
+                self.__full_sync()
+                core_logger.info("Periodic full sync with Wireguard server done.")
+            elif self.__dirty_since is not None and now >= self.__dirty_since + self.persist_delay:
+                self.__persist()
+        except Exception as e:
+            core_logger.opt(exception=e).error(f"Couldn't persist or sync Wireguard config: {e}")
+            # don't retry in a busy loop
+            self.__last_full_sync = now
+            if self.__dirty_since is not None:
+                self.__dirty_since = now
+
+    def __worker(self) -> None:
+        while True:
+            try:
+                command = self.__queue.get(timeout=self.__seconds_until_maintenance())
+            except queue.Empty:
+                self.__maintain()
+                continue
+
+            batch = []
+            deadline = time.monotonic() + self.debounce
+            while command is not self._STOP:
+                batch.append(command)
+                if len(batch) >= self.max_batch_size:
+                    break
+                try:
+                    command = self.__queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            if batch:
+                self.__apply_batch(batch)
+            if command is self._STOP:
+                self.__persist()
+                return
+            self.__maintain()
+
+    def __apply_batch(self, batch: list[_Command]) -> None:
+        applied = []
+        public_keys = set()
+        full_sync = False
+        for command in batch:
+            try:
+                applied.append((command.future, command.mutation()))
+            except Exception as e:
+                core_logger.opt(exception=e).error(f"Couldn't apply Wireguard config change: {e}")
+                command.future.set_exception(e)
+                continue
+            public_keys.update(command.public_keys)
+            full_sync |= command.full_sync
+
+        if not applied:
+            return
+
+        try:
+            if not self.auto_sync:
+                self.__persist(force=True)
+                core_logger.warning("Auto sync is disabled. Config was applied to file, consider syncing it manually.")
+            elif full_sync or not self.incremental_sync:
+                self.__persist(force=True)
+                self.__full_sync()
+                core_logger.info(f"Config applied and synced with Wireguard server. Changes: {len(applied)}.")
+            else:
+                self.__set_peers(public_keys)
+                self.__dirty_since = self.__dirty_since or time.monotonic()
+                if not self.is_running:
+                    self.__persist()
+                core_logger.info(f"Peers updated on Wireguard interface. Changes: {len(applied)}.")
+        except Exception as e:
+            core_logger.opt(exception=e).error(f"Couldn't write or sync Wireguard config: {e}")
+            for future, _ in applied:
+                future.set_exception(e)
+            return
+
+        for future, result in applied:
+            future.set_result(result)
+
+    def submit(
+            self,
+            mutation: Callable[[], Any],
+            public_keys: Iterable[str] = (),
+            full_sync: bool = False
+        ) -> WGHubFuture:
+        """
+        Queues a change of `self.wgconfig`. The change is applied on the hub's thread,
+        or right away if the thread isn't started.
+
+        Args:
+            mutation (Callable[[], Any]): Function that changes `self.wgconfig` in memory.
+            public_keys (Iterable[str]): Peers that are changed by the mutation.
+                Their state on the interface is updated by the incremental sync.
+            full_sync (bool): Sync the whole config even in the incremental mode.
+
+        Returns:
+            WGHubFuture: Resolves with the result of `mutation` once the change reaches the server.
+        """
+        command = _Command(mutation, tuple(public_keys), full_sync, WGHubFuture())
+        if self.is_running:
+            self.__queue.put(command)
+        else:
+            with self.__lock:
+                self.__apply_batch([command])
+        return command.future
+
+    def __persist(self, force: bool = False) -> None:
+        if force or self.__dirty_since is not None:
+            self.write_config()
+            self.__dirty_since = None
+
+    def write_config(self) -> None:
+        """Atomically replaces the config file with the in-memory config."""
+        self.wgconfig.write_file()
+
+    def __full_sync(self) -> None:
+        stripped = run_command_sync([f"{self.command}-quick", "strip", self.path], self.command_timeout)
 
         with tempfile.NamedTemporaryFile() as temp_file:
-            temp_file.write(strip.stdout.encode("utf-8"))
+            temp_file.write(stripped.encode("utf-8"))
             temp_file.flush()
 
-            subprocess.run([self.command, "syncconf", self.interface_name, temp_file.name], check=True)
+            run_command_sync([self.command, "syncconf", self.interface_name, temp_file.name], self.command_timeout)
+        self.__last_full_sync = time.monotonic()
 
-        core_logger.info("Configuration synced with Wireguard server.")
+    def __set_peers(self, public_keys: Iterable[str]) -> None:
+        """Brings the given peers on the interface to their state in `self.wgconfig` with a single `wg set`."""
+        args = [self.command, "set", self.interface_name]
+        with ExitStack() as stack:
+            for public_key in sorted(public_keys):
+                args += ["peer", public_key]
+                try:
+                    enabled = self.wgconfig.get_peer_enabled(public_key)
+                except KeyError:
+                    enabled = False
+                if not enabled:
+                    args.append("remove")
+                    continue
 
-    def apply_and_sync(func: Callable):
-        @core_logger.catch(reraise=True)
-        def inner(self, peer: WireguardPeer):
-            func(self, peer)
+                peer = self.wgconfig.get_peer(public_key)
+                if preshared_key := peer.get("PresharedKey"):
+                    # `wg` reads preshared keys only from files
+                    key_file = stack.enter_context(tempfile.NamedTemporaryFile("w"))
+                    key_file.write(preshared_key)
+                    key_file.flush()
+                    args += ["preshared-key", key_file.name]
+                allowed_ips = peer.get("AllowedIPs", "")
+                if isinstance(allowed_ips, list):
+                    allowed_ips = ",".join(allowed_ips)
+                args += ["allowed-ips", allowed_ips.replace(" ", "")]
 
-            self.wgconfig.write_file()
-            if self.auto_sync:
-                self.sync_config()
-                core_logger.info("Config applied and synced with Wireguard server.")
-            else:
-                core_logger.warning("Auto sync is disabled. Config was applied to file, consider syncing it manually.")
+            if len(args) > 3:
+                run_command_sync(args, self.command_timeout)
+
+    async def get_peer_stats(self) -> dict[str, WGPeerStats]:
+        """
+        Reads handshakes and transfer counters of every peer on the interface with a single `wg show dump`.
+
+        Raises:
+            OSError: `wg` couldn't be started.
+            WGCommandError: `wg` failed, e.g. the interface is down, or timed out.
+        """
+        dump = await run_command([self.command, "show", self.interface_name, "dump"], self.command_timeout)
+        return parse_wg_dump(dump)
 
-        return inner
-
-    @apply_and_sync
-    def add_peer(self, peer: WireguardPeer):
-        self.wgconfig.add_peer(peer.public_key, f"# {peer.peer_name}")
-        self.wgconfig.add_attr(peer.public_key, "PresharedKey", peer.preshared_key)
-        self.wgconfig.add_attr(peer.public_key, "AllowedIPs", peer.shared_ips + "/32")
-        with core_logger.contextualize(peer=peer):
-            core_logger.info("A new peer has appeared.")
-
-    @apply_and_sync
-    def enable_peer(self, peer: WireguardPeer):
-        self.wgconfig.enable_peer(peer.public_key)
-        with core_logger.contextualize(peer=peer):
-            core_logger.info("Peer enabled.")
-
-    @apply_and_sync
-    @core_logger.catch()
-    def enable_peers(self, peers: list[WireguardPeer]):
-        for peer in peers:
-            self.wgconfig.enable_peer(peer.public_key)
-        with core_logger.contextualize(peers=peers):
-            core_logger.info("Peers enabled.")
-
-    @apply_and_sync
-    def disable_peer(self, peer: WireguardPeer):
-        self.wgconfig.disable_peer(peer.public_key)
-        with core_logger.contextualize(peer=peer):
-            core_logger.info("Peer disabled.")
-
-    @apply_and_sync
-    def disable_peers(self, peers: list[WireguardPeer]):
-        for peer in peers:
-            self.wgconfig.disable_peer(peer.public_key)
-        with core_logger.contextualize(peers=peers):
-            core_logger.info("Peers disabled.")
-
-    @apply_and_sync
-    def delete_peer(self, peer: WireguardPeer):
-        self.wgconfig.del_peer(peer.public_key)
-        with core_logger.contextualize(peer=peer):
-            core_logger.info("A peer has been destroyed.")
+    def sync_config(self) -> WGHubFuture:
+        """Writes the config file and syncs the whole config with the server."""
+        return self.submit(lambda: None, full_sync=True)
+
+    def add_peer(self, peer: WireguardPeer) -> WGHubFuture:
+        def mutation():
+            self.wgconfig.add_peer(peer.public_key, f"# {peer.peer_name}")
+            self.wgconfig.add_attr(peer.public_key, "PresharedKey", peer.preshared_key)
+            self.wgconfig.add_attr(peer.public_key, "AllowedIPs", peer.shared_ips + "/32")
+            with core_logger.contextualize(peer=peer):
+                core_logger.info("A new peer has appeared.")
+        return self.submit(mutation, [peer.public_key])
+
+    def enable_peer(self, peer: WireguardPeer) -> WGHubFuture:
+        return self.enable_peers([peer])
+
+    def enable_peers(self, peers: list[WireguardPeer]) -> WGHubFuture:
+        def mutation():
+            for peer in peers:
+                self.wgconfig.enable_peer(peer.public_key)
+            with core_logger.contextualize(peers=peers):
+                core_logger.info("Peers enabled.")
+        return self.submit(mutation, [peer.public_key for peer in peers])
+
+    def disable_peer(self, peer: WireguardPeer) -> WGHubFuture:
+        return self.disable_peers([peer])
+
+    def disable_peers(self, peers: list[WireguardPeer]) -> WGHubFuture:
+        def mutation():
+            for peer in peers:
+                self.wgconfig.disable_peer(peer.public_key)
+            with core_logger.contextualize(peers=peers):
+                core_logger.info("Peers disabled.")
+        return self.submit(mutation, [peer.public_key for peer in peers])
+
+    def delete_peer(self, peer: WireguardPeer) -> WGHubFuture:
+        def mutation():
+            self.wgconfig.del_peer(peer.public_key)
+            with core_logger.contextualize(peer=peer):
+                core_logger.info("A peer has been destroyed.")
+        return self.submit(mutation, [peer.public_key])
 
     def change_command_mode(self, is_amnezia: bool):
         """Changes command from `wg` to `awg` to be able to work with amnezia-wg
@@ -102,19 +470,29 @@ class WGHub:
             self.command = "wg"
             core_logger.info("Behaviour is set to default WG.")
 
-def disable_server(path: str) -> bool:
+async def disable_server(path: str, timeout: float = 60) -> bool:
     """Returns True if server was disabled successfully"""
     if not os.path.exists(path):
         return False
     core_logger.info("Disabling WG server...")
-    return "error" in subprocess.getoutput(f"wg-quick down {path}")
+    try:
+        await run_command(["wg-quick", "down", path], timeout)
+    except (OSError, WGCommandError) as e:
+        core_logger.error(f"Couldn't disable WG server: {e}")
+        return False
+    return True
 
-def enable_server(path: str) -> bool:
+async def enable_server(path: str, timeout: float = 60) -> bool:
     """Returns True if server was enabled successfully"""
     if not os.path.exists(path):
         return False
     core_logger.info("Enabling WG server...")
-    return "error" in subprocess.getoutput(f"wg-quick up {path}")
+    try:
+        await run_command(["wg-quick", "up", path], timeout)
+    except (OSError, WGCommandError) as e:
+        core_logger.error(f"Couldn't enable WG server: {e}")
+        return False
+    return True
 
 def make_wg_server_base_str(ip: str, endpoint_port: Union[str, int], private_key: str) -> str:
     return f"""[Interface]
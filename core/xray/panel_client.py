@@ -0,0 +1,357 @@
+import asyncio
+import json
+import random
+import time
+from typing import Any, Optional
+
+import aiohttp
+from py3xui.client import Client
+from py3xui.inbound import Inbound
+
+from core.logs import core_logger
+from core.utils.circuit_breaker import CircuitBreaker
+
+
+class PanelError(Exception):
+    """
+    3x-ui rejected a request, answered with something that isn't an API response or didn't answer in time.
+
+    Attributes:
+        status (Optional[int]): HTTP status of the response, None if there was no response.
+        transient (bool): The panel was unreachable or failed on its side, the request may succeed later.
+    """
+    def __init__(self, message: str, status: Optional[int] = None, transient: bool = False):
+        super().__init__(message)
+        self.status = status
+        self.transient = transient
+
+
+class PanelUnavailable(PanelError):
+    """The circuit breaker is open, the request wasn't sent."""
+
+
+class XuiPanelClient:
+    """
+    Asyncio client of the 3x-ui API.
+
+    Requests go through a single `aiohttp.ClientSession`, so connections to the panel are kept alive
+    and reused. At most `max_concurrency` requests are in flight, the rest wait for a free slot.
+    Every request is limited by `timeout` seconds, including the time spent waiting for a connection.
+
+    Writes to the clients of an inbound are serialized, so a batch update, which reads the inbound
+    and writes it back whole, doesn't lose clients added or removed by this client in the meantime.
+
+    The session cookie is obtained on the first request and renewed once it's older than `session_ttl`,
+    before 3x-ui expires it. When the panel stops accepting it anyway, the client logs in again once
+    and repeats the request; concurrent requests share that login.
+
+    Idempotent requests that fail because the panel is unreachable or answers with HTTP 5xx are retried
+    up to `retries` times with full jitter backoff. When `failure_threshold` requests in a row still fail,
+    `breaker` opens and requests fail with `PanelUnavailable` at once for `reset_timeout` seconds,
+    so callers don't wait for timeouts while the panel is down.
+
+    The session is created lazily in the running event loop. Call `close` before the loop stops.
+
+    Attributes:
+        base_url (str): URL of the panel including the web path, e.g. `https://host:port/path/`.
+        timeout (float): Seconds a request may take.
+        max_concurrency (int): Max number of requests in flight, also the size of the connection pool.
+        session_ttl (float): Seconds a session cookie is used before logging in again.
+        retries (int): Extra attempts of an idempotent request.
+        backoff (float): Upper bound of the first retry delay in seconds, doubled on every attempt.
+        backoff_max (float): Upper bound of any retry delay in seconds.
+        breaker (CircuitBreaker): Tracks whether the panel is reachable.
+    """
+    def __init__(
+            self,
+            base_url: str,
+            username: str,
+            password: str,
+            token: Optional[str] = None,
+            tls_verify: bool = True,
+            timeout: float = 10,
+            max_concurrency: int = 8,
+            session_ttl: float = 1800,
+            retries: int = 2,
+            backoff: float = 0.5,
+            backoff_max: float = 5,
+            failure_threshold: int = 5,
+            reset_timeout: float = 30
+        ):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.session_ttl = session_ttl
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker("3x-ui", failure_threshold, reset_timeout)
+        self.__username = username
+        self.__password = password
+        self.__token = token
+        self.__tls_verify = tls_verify
+        self.__session: Optional[aiohttp.ClientSession] = None
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__semaphore: Optional[asyncio.Semaphore] = None
+        self.__login_lock: Optional[asyncio.Lock] = None
+        self.__inbound_locks: dict[int, asyncio.Lock] = {}
+        self.__logins = 0
+        """Number of successful logins, tells requests whether someone has already renewed the cookie"""
+        self.__logged_in_at = 0.0
+
+    def __get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self.__session is None or self.__session.closed or self.__loop is not loop:
+            self.__drop_session()
+            self.__session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency,
+                    ssl=None if self.__tls_verify else False,
+                    keepalive_timeout=60
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                # the panel is often reached by IP, which the default jar doesn't keep cookies for
+                cookie_jar=aiohttp.CookieJar(unsafe=True)
+            )
+            self.__loop = loop
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.__login_lock = asyncio.Lock()
+            self.__inbound_locks = {}
+            self.__logins = 0
+        return self.__session
+
+    def __drop_session(self) -> None:
+        """Closes the session of the previous event loop, which can't be awaited from the current one."""
+        session, loop = self.__session, self.__loop
+        if session is None or session.closed:
+            return
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+            return
+
+        connector = session.connector
+        session.detach()
+        if connector is not None and not connector.closed:
+            try:
+                connector._close()
+            except RuntimeError:
+                # the loop is closed along with its transports, the connector is only marked as closed
+                pass
+
+    def __inbound_lock(self, inbound_id: int) -> asyncio.Lock:
+        self.__get_session()
+        return self.__inbound_locks.setdefault(inbound_id, asyncio.Lock())
+
+    @property
+    def session_age(self) -> Optional[float]:
+        """Seconds since the last login, None if the client isn't logged in."""
+        if self.__session is None or self.__session.closed or self.__logins == 0:
+            return None
+        return time.monotonic() - self.__logged_in_at
+
+    async def close(self) -> None:
+        if self.__session is not None and not self.__session.closed:
+            await self.__session.close()
+        self.__session = None
+
+    async def __send(
+            self,
+            method: str,
+            path: str,
+            data: Optional[dict[str, Any]] = None,
+            payload: Optional[dict[str, Any]] = None
+        ) -> Optional[dict]:
+        """Sends a request and returns its JSON body, None if the body isn't JSON (e.g. the login page)."""
+        session = self.__get_session()
+        try:
+            async with self.__semaphore:
+                async with session.request(method, self.base_url + path, data=data, json=payload,
+                                           headers={"Accept": "application/json"}) as response:
+                    if response.status in (401, 403, 404):
+                        # 3x-ui hides the API from unauthenticated clients
+                        return None
+                    if response.status >= 400:
+                        raise PanelError(
+                            f"{method} {path} failed with HTTP {response.status}",
+                            response.status,
+                            transient=response.status >= 500
+                        )
+                    try:
+                        return await response.json(content_type=None)
+                    except ValueError:
+                        return None
+        except asyncio.TimeoutError:
+            raise PanelError(f"{method} {path} timed out after {self.timeout} seconds", transient=True) from None
+        except aiohttp.ClientError as e:
+            raise PanelError(f"{method} {path} failed: {e}", transient=True) from e
+
+    async def login(self) -> None:
+        """
+        Raises:
+            PanelError: The credentials were rejected or the panel is unreachable.
+        """
+        self.__get_session()
+        logins = self.__logins
+        async with self.__login_lock:
+            if self.__logins != logins:
+                # renewed while we were waiting
+                return
+            data = {"username": self.__username, "password": self.__password}
+            if self.__token is not None:
+                data["loginSecret"] = self.__token
+            body = await self.__send("POST", "login", data)
+            if not body or not body.get("success"):
+                raise PanelError(f"Failed to login to 3x-ui API: {(body or {}).get('msg', 'no response')}")
+            self.__logins += 1
+            self.__logged_in_at = time.monotonic()
+        core_logger.info("Logged into 3x-ui API.")
+
+    async def request(
+            self,
+            method: str,
+            path: str,
+            data: Optional[dict[str, Any]] = None,
+            payload: Optional[dict[str, Any]] = None,
+            idempotent: Optional[bool] = None
+        ) -> Any:
+        """
+        Sends an API request with a form (`data`) or a JSON body (`payload`), logging in first if needed.
+
+        Args:
+            idempotent (bool, optional): Whether the request may be repeated, only GET requests are by default.
+
+        Returns:
+            Any: The `obj` field of the response.
+
+        Raises:
+            PanelUnavailable: The panel has been failing, the request wasn't sent.
+            PanelError: The request failed or the panel answered with `success: false`.
+        """
+        if not self.breaker.allow():
+            raise PanelUnavailable(
+                f"{method} {path} skipped, 3x-ui is unavailable for {self.breaker.retry_in:.0f} more seconds"
+            )
+        attempts = self.retries + 1 if (method == "GET" if idempotent is None else idempotent) else 1
+        try:
+            result = await self.__request_with_retries(method, path, data, payload, attempts)
+        except PanelError as e:
+            if e.transient:
+                self.breaker.record_failure(str(e))
+            else:
+                # the panel answered, it's reachable
+                self.breaker.record_success()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def __request_with_retries(
+            self,
+            method: str,
+            path: str,
+            data: Optional[dict[str, Any]],
+            payload: Optional[dict[str, Any]],
+            attempts: int
+        ) -> Any:
+        for attempt in range(attempts):
+            try:
+                return await self.__request(method, path, data, payload)
+            except PanelError as e:
+                if not e.transient or attempt + 1 == attempts:
+                    raise
+                # full jitter keeps clients that failed together from retrying together
+                delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+                core_logger.warning(f"{e}, retrying in {delay:.2f} seconds.")
+                await asyncio.sleep(delay)
+
+    async def __request(
+            self,
+            method: str,
+            path: str,
+            data: Optional[dict[str, Any]],
+            payload: Optional[dict[str, Any]]
+        ) -> Any:
+        session_age = self.session_age
+        if session_age is None or session_age > self.session_ttl:
+            await self.login()
+        logins = self.__logins
+        body = await self.__send(method, path, data, payload)
+        if body is None:
+            # the cookie has probably expired, renew it once
+            core_logger.warning(f"3x-ui didn't accept the session for {method} {path}, logging in again.")
+            if self.__logins == logins:
+                await self.login()
+            body = await self.__send(method, path, data, payload)
+            if body is None:
+                raise PanelError(f"{method} {path} returned no API response")
+        if not body.get("success"):
+            raise PanelError(f"{method} {path} was rejected: {body.get('msg')}")
+        return body.get("obj")
+
+    async def get_inbound(self, inbound_id: int) -> Inbound:
+        return Inbound.model_validate(await self.request("GET", f"panel/api/inbounds/get/{inbound_id}"))
+
+    async def add_clients(self, inbound_id: int, clients: list[Client]) -> None:
+        settings = {"clients": [client.model_dump(by_alias=True, exclude_defaults=True) for client in clients]}
+        async with self.__inbound_lock(inbound_id):
+            await self.request("POST", "panel/api/inbounds/addClient",
+                               {"id": inbound_id, "settings": json.dumps(settings)})
+
+    async def update_client(self, client: Client) -> None:
+        settings = {"clients": [client.model_dump(by_alias=True, exclude_defaults=True)]}
+        async with self.__inbound_lock(client.inbound_id):
+            await self.request(
+                "POST",
+                f"panel/api/inbounds/updateClient/{client.id}",
+                {"id": client.inbound_id, "settings": json.dumps(settings)},
+                idempotent=True
+            )
+
+    async def update_clients(self, inbound_id: int, changes: dict[str, dict[str, Any]]) -> set[str]:
+        """
+        Changes fields of many clients of the inbound with two requests: the inbound is read,
+        the clients are changed in its settings and the inbound is written back whole.
+
+        The inbound is handled as raw JSON, so fields this client doesn't know about are kept as they are.
+
+        Args:
+            inbound_id (int): The inbound of the clients.
+            changes (dict[str, dict[str, Any]]): Fields to set by client ID, named as in 3x-ui, e.g. `expiryTime`.
+
+        Returns:
+            set[str]: IDs of the clients that aren't in the inbound and were skipped.
+
+        Raises:
+            PanelError: The request failed or the panel returned a malformed inbound.
+        """
+        async with self.__inbound_lock(inbound_id):
+            inbound = await self.request("GET", f"panel/api/inbounds/get/{inbound_id}")
+            missing = set(changes)
+            try:
+                settings = json.loads(inbound.get("settings") or "{}")
+                for client in settings.get("clients") or []:
+                    client_id = str(client.get("id"))
+                    if client_id in changes:
+                        client.update(changes[client_id])
+                        missing.discard(client_id)
+            except (AttributeError, TypeError, ValueError) as e:
+                # e.g. `obj` is null or the settings aren't JSON, callers only expect `PanelError`
+                raise PanelError(f"Malformed inbound {inbound_id}: {e!r}") from e
+
+            if len(missing) < len(changes):
+                inbound["settings"] = json.dumps(settings)
+                # traffic counters are kept by 3x-ui separately and must not be sent back
+                inbound.pop("clientStats", None)
+                await self.request("POST", f"panel/api/inbounds/update/{inbound_id}", payload=inbound,
+                                   idempotent=True)
+        return missing
+
+    async def delete_client(self, inbound_id: int, client_id: str) -> None:
+        async with self.__inbound_lock(inbound_id):
+            await self.request("POST", f"panel/api/inbounds/{inbound_id}/delClient/{client_id}")
+
+    async def online(self) -> list[str]:
+        """Returns emails of the clients that are online."""
+        return await self.request("POST", "panel/api/inbounds/onlines", idempotent=True) or []
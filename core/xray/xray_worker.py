@@ -1,18 +1,66 @@
+import asyncio
 import datetime
 import re
-from typing import Optional
+import threading
+import time
+from typing import Iterable, NamedTuple, Optional
 from urllib.parse import quote
 
 from py3xui import Api
 from py3xui.client import Client
-from requests.exceptions import JSONDecodeError
+from py3xui.inbound import Inbound
 
 from core.db.enums import PeerStatusChoices
 from core.db.model_serializer import XrayPeer
 from core.logs import core_logger
+from core.xray.panel_client import PanelError, XuiPanelClient
+
+
+class InboundMeta(NamedTuple):
+    """Settings of a VLESS Reality inbound that connection strings are built from."""
+    port: int
+    remark: str
+    public_key: str
+    server_name: str
+    short_id: str
+    fingerprint: str
+
+    @classmethod
+    def from_inbound(cls, inbound: Inbound) -> "InboundMeta":
+        """
+        Raises:
+            ValueError: The inbound has no Reality settings.
+        """
+        try:
+            reality_settings = inbound.stream_settings.reality_settings
+            inbound_settings = reality_settings.get("settings")
+            return cls(
+                port=inbound.port,
+                remark=inbound.remark,
+                public_key=inbound_settings.get("publicKey"),
+                server_name=reality_settings.get("serverNames")[0],
+                short_id=reality_settings.get("shortIds")[0],
+                fingerprint=inbound_settings.get("fingerprint")
+            )
+        except (AttributeError, IndexError, TypeError) as e:
+            raise ValueError(f"Inbound {inbound.id} has no Reality settings: {e}") from e
+
+
+class XrayBatchResult(NamedTuple):
+    """Outcome of a batch update of Xray peers."""
+    updated: list[XrayPeer]
+    failed: dict[int, str]
+    """peer_id -> why the peer wasn't updated"""
 
 
 class XrayWorker:
+    """
+    Manages Xray peers as 3x-ui clients.
+
+    Every runtime call is a coroutine on top of `XuiPanelClient`, which keeps a pool of connections
+    to the panel and bounds the number of concurrent requests. The synchronous `py3xui.Api` in `self.api`
+    is only used at startup, before the event loop is running.
+    """
     def __init__(
             self,
             host: str,
@@ -21,12 +69,32 @@ class XrayWorker:
             username: str,
             password: str,
             token: Optional[str] = None,
-            tls: bool = True
+            tls: bool = True,
+            online_ttl: float = 5,
+            inbound_ttl: float = 3600,
+            request_timeout: float = 10,
+            max_concurrency: int = 8
         ):
         self.host = host
         self.port = port
+        self.online_ttl = online_ttl
+        """Seconds a snapshot of online clients is reused for"""
+        self.inbound_ttl = inbound_ttl
+        """Seconds cached inbound settings are used before they're fetched again"""
+        self.__inbounds_lock = threading.Lock()
+        self.__inbounds: dict[int, tuple[InboundMeta, float]] = {}
+        """inbound_id -> settings and the time they were fetched"""
+        self.__online: Optional[frozenset[str]] = None
+        self.__online_at = 0.0
+        self.__online_request: Optional[asyncio.Future] = None
         host = host + ':' + port + (f"/{web_path}/" if web_path else '')
         self.api = Api(host, username, password, token, use_tls_verify=tls)
+        self.panel = XuiPanelClient(
+            host, username, password, token,
+            tls_verify=tls,
+            timeout=request_timeout,
+            max_concurrency=max_concurrency
+        )
 
         if not self.__login():
             raise ValueError("Failed to login to 3x-ui API. Check your credentials.")
@@ -49,6 +117,10 @@ class XrayWorker:
             return False
         return True
 
+    async def close(self) -> None:
+        """Closes connections to the panel."""
+        await self.panel.close()
+
     @staticmethod
     def peer_to_client(peer: XrayPeer) -> Client:
         """
@@ -72,27 +144,55 @@ class XrayWorker:
             inbound_id=peer.inbound_id,
         )
 
-    def get_connection_string(self, peer: XrayPeer):
-        inbound = self.api.inbound.get_by_id(peer.inbound_id)
+    def cache_inbound(self, inbound: Inbound) -> InboundMeta:
+        """Caches settings of an already fetched inbound, e.g. the one checked at startup."""
+        meta = InboundMeta.from_inbound(inbound)
+        with self.__inbounds_lock:
+            self.__inbounds[inbound.id] = (meta, time.monotonic())
+        return meta
+
+    def invalidate_inbound(self, inbound_id: Optional[int] = None) -> None:
+        """Drops cached settings of the inbound, or of every inbound if `inbound_id` is None."""
+        with self.__inbounds_lock:
+            if inbound_id is None:
+                self.__inbounds.clear()
+            else:
+                self.__inbounds.pop(inbound_id, None)
+
+    async def get_inbound_meta(self, inbound_id: int) -> InboundMeta:
+        """
+        Returns settings of the inbound from the cache, fetching them if they're missing or older than `inbound_ttl`.
+        If the refresh fails, outdated settings are returned, since they almost never change.
+        """
+        with self.__inbounds_lock:
+            cached = self.__inbounds.get(inbound_id)
+        if cached is not None and time.monotonic() - cached[1] < self.inbound_ttl:
+            return cached[0]
 
-        inbound_settings = inbound.stream_settings.reality_settings.get("settings")
+        try:
+            inbound = await self.panel.get_inbound(inbound_id)
+        except PanelError as e:
+            if cached is None:
+                raise
+            core_logger.warning(f"Couldn't refresh settings of inbound {inbound_id}, using cached ones: {e}")
+            return cached[0]
+        return self.cache_inbound(inbound)
+
+    async def get_connection_string(self, peer: XrayPeer) -> str:
+        inbound = await self.get_inbound_meta(peer.inbound_id)
 
         host = re.sub(r"https?://|www\.", "", self.host)
-        public_key = inbound_settings.get("publicKey")
-        website_name = inbound.stream_settings.reality_settings.get("serverNames")[0]
-        short_id = inbound.stream_settings.reality_settings.get("shortIds")[0]
-        fingerprint = inbound_settings.get("fingerprint")
         remark = quote(inbound.remark)
         peer_name = quote(peer.peer_name)
 
         return (
             f"vless://{peer.peer_id}@{host}:{inbound.port}"
-            f"?type=tcp&security=reality&pbk={public_key}&fp={fingerprint}"
-            f"&sni={website_name}&sid={short_id}&spx=%2F&flow={peer.flow}#{remark}-{peer_name}"
+            f"?type=tcp&security=reality&pbk={inbound.public_key}&fp={inbound.fingerprint}"
+            f"&sni={inbound.server_name}&sid={inbound.short_id}&spx=%2F&flow={peer.flow}#{remark}-{peer_name}"
         )
 
     @core_logger.catch()
-    def add_peers(
+    async def add_peers(
         self, inbound_id: int, peers: list[XrayPeer], expiry_time: Optional[datetime.datetime] = None
     ) -> None:
         """
@@ -119,13 +219,13 @@ class XrayWorker:
                 client.expiry_time = int(expiry_time.timestamp() * 1000)
             clients.append(client)
 
-        self.api.client.add(inbound_id, clients)
+        await self.panel.add_clients(inbound_id, clients)
 
         with core_logger.contextualize(xray_peers=peers):
             core_logger.info(f"Added new Xray peers.")
 
     @core_logger.catch()
-    def update_peer(self, peer: XrayPeer, expiry_time: Optional[datetime.datetime] = None) -> None:
+    async def update_peer(self, peer: XrayPeer, expiry_time: Optional[datetime.datetime] = None) -> None:
         """
         Update an Xray peer in the API and optionally set its expiry time.
         """
@@ -133,51 +233,183 @@ class XrayWorker:
 
         if expiry_time is not None:
             client.expiry_time = int(expiry_time.timestamp() * 1000)
-        self.api.client.update(client.id, client)
+        await self.panel.update_client(client)
 
         with core_logger.contextualize(xray_peer=peer):
             core_logger.info(f"Updated Xray peer.")
 
     @core_logger.catch()
-    def delete_peer(self, peer: XrayPeer) -> None:
+    async def delete_peer(self, peer: XrayPeer) -> None:
         client = self.peer_to_client(peer)
-        self.api.client.delete(client.inbound_id, client.id)
+        await self.panel.delete_client(client.inbound_id, client.id)
 
         with core_logger.contextualize(xray_peer=peer):
             core_logger.info(f"Deleted Xray peer.")
 
+    async def get_online_clients(self, max_age: Optional[float] = None) -> frozenset[str]:
+        """
+        Returns emails of the clients that are online, fetched with a single request.
+
+        The snapshot is reused for `max_age` seconds (`online_ttl` by default).
+        Callers that come while the snapshot is being fetched wait for that request instead of making their own.
+
+        Raises:
+            PanelError: The panel couldn't be reached or rejected the request.
+        """
+        max_age = self.online_ttl if max_age is None else max_age
+        if self.__online is not None and time.monotonic() - self.__online_at < max_age:
+            return self.__online
+        if self.__online_request is None:
+            self.__online_request = asyncio.ensure_future(self.__fetch_online_clients())
+        # a cancelled caller must not cancel the request other callers are waiting for
+        return await asyncio.shield(self.__online_request)
+
+    async def __fetch_online_clients(self) -> frozenset[str]:
+        try:
+            online = frozenset(await self.panel.online())
+        finally:
+            self.__online_request = None
+        self.__online = online
+        self.__online_at = time.monotonic()
+        return online
+
     @core_logger.catch()
-    def is_connected(self, peer: XrayPeer) -> bool:
+    async def is_connected(self, peer: XrayPeer) -> bool:
         try:
-            online_clients = self.api.client.online()
-            for client in online_clients:
-                if client == peer.peer_name:
-                    return True
-            core_logger.debug(f"Peer {peer.peer_name} is not connected, online clients: {online_clients}.")
+            return peer.peer_name in await self.get_online_clients()
+        except PanelError as e:
+            core_logger.error(f"Couldn't read online Xray clients: {e}")
             return False
-        except JSONDecodeError:
-            # so, here 3x-ui API probably returned an empty response ( {} )
-            # which means that our token should be expired
-            # py3xui does not handle this case, so we need to do it ourselves
-            core_logger.error("Failed to decode JSON response from the API. Probably token expired, trying to re-login.")
 
-            if not self.__login():
-                core_logger.error("Failed to re-login to the 3x-ui API after token expiration.")
+    async def __get_inbounds(self, inbound_ids: Iterable[int]) -> list[Inbound]:
+        """Fetches the inbounds concurrently, a single request per inbound."""
+        return await asyncio.gather(*(self.panel.get_inbound(inbound_id) for inbound_id in inbound_ids))
 
-            return False
+    async def get_clients_traffic(self, inbound_ids: Iterable[int]) -> dict[str, tuple[int, int]]:
+        """
+        Reads traffic counters of all clients of the inbounds, a single request per inbound.
+
+        Returns:
+            dict[str, tuple[int, int]]: Cumulative `(up, down)` bytes by client email, i.e. peer name.
+        """
+        traffic = {}
+        for inbound in await self.__get_inbounds(inbound_ids):
+            for client in inbound.client_stats or []:
+                traffic[client.email] = (client.up, client.down)
+        return traffic
+
+    async def get_inbound_clients(self, inbound_ids: Iterable[int]) -> dict[str, tuple[int, bool]]:
+        """
+        Reads clients of the inbounds, a single request per inbound.
+
+        Returns:
+            dict[str, tuple[int, bool]]: `(inbound_id, enable)` by client ID.
+        """
+        clients = {}
+        for inbound in await self.__get_inbounds(inbound_ids):
+            for client in inbound.settings.clients or []:
+                clients[str(client.id)] = (inbound.id, client.enable)
+        return clients
 
     @core_logger.catch()
-    def enable_peer(self, peer: XrayPeer, expire_time: Optional[datetime.datetime] = None) -> None:
+    async def delete_client(self, inbound_id: int, client_id: str) -> None:
+        """Deletes a client that has no peer, e.g. one left behind by a crash."""
+        await self.panel.delete_client(inbound_id, client_id)
+        core_logger.info(f"Deleted Xray client {client_id} from inbound {inbound_id}.")
+
+    @core_logger.catch()
+    async def enable_peer(self, peer: XrayPeer, expire_time: Optional[datetime.datetime] = None) -> None:
         client = self.peer_to_client(peer)
         client.enable = True
         if expire_time is not None:
             client.expiry_time = int(expire_time.timestamp() * 1000)
-        self.api.client.update(peer.peer_id, client)
+        await self.panel.update_client(client)
 
     @core_logger.catch()
-    def disable_peer(self, peer: XrayPeer, expire_time: Optional[datetime.datetime] = None) -> None:
+    async def disable_peer(self, peer: XrayPeer, expire_time: Optional[datetime.datetime] = None) -> None:
         client = self.peer_to_client(peer)
         client.enable = False
         if expire_time is not None:
             client.expiry_time = int(expire_time.timestamp() * 1000)
-        self.api.client.update(peer.peer_id, client)
+        await self.panel.update_client(client)
+
+    async def update_peers(
+            self,
+            peers: list[XrayPeer],
+            expiry_time: Optional[datetime.datetime] = None,
+            enabled: Optional[bool] = None,
+            expiry_times: Optional[dict[int, Optional[datetime.datetime]]] = None
+        ) -> XrayBatchResult:
+        """
+        Updates many Xray peers with two requests per inbound instead of a request per peer.
+        Inbounds are updated concurrently.
+
+        Args:
+            peers (list[XrayPeer]): Peers to update, they may belong to different inbounds.
+            expiry_time (datetime.datetime, optional): Expiration time to set, left as is if None.
+            enabled (bool, optional): Whether clients are enabled, follows the peer status if None.
+            expiry_times (dict[int, Optional[datetime.datetime]], optional): Expiration times by `peer_id`
+                for peers of different users, override `expiry_time`.
+
+        Returns:
+            XrayBatchResult: Updated peers and the reason for each peer that wasn't updated.
+        """
+        peers_by_inbound: dict[int, list[XrayPeer]] = {}
+        for peer in peers:
+            peers_by_inbound.setdefault(peer.inbound_id, []).append(peer)
+
+        result = XrayBatchResult([], {})
+        await asyncio.gather(*(
+            self.__update_inbound_peers(inbound_id, inbound_peers, expiry_time, enabled, expiry_times or {}, result)
+            for inbound_id, inbound_peers in peers_by_inbound.items()
+        ))
+
+        if result.failed:
+            with core_logger.contextualize(failed=result.failed):
+                core_logger.error(f"Failed to update {len(result.failed)} of {len(peers)} Xray peers.")
+        if result.updated:
+            with core_logger.contextualize(xray_peers=[peer.peer_id for peer in result.updated]):
+                core_logger.info(f"Updated {len(result.updated)} Xray peers.")
+        return result
+
+    async def __update_inbound_peers(
+            self,
+            inbound_id: int,
+            peers: list[XrayPeer],
+            expiry_time: Optional[datetime.datetime],
+            enabled: Optional[bool],
+            expiry_times: dict[int, Optional[datetime.datetime]],
+            result: XrayBatchResult
+        ) -> None:
+        changes = {}
+        for peer in peers:
+            client = {
+                "email": peer.peer_name,
+                "enable": PeerStatusChoices.xray_enabled(peer.peer_status) if enabled is None else enabled,
+                "flow": peer.flow,
+            }
+            peer_expiry_time = expiry_times.get(peer.peer_id, expiry_time)
+            if peer_expiry_time is not None:
+                client["expiryTime"] = int(peer_expiry_time.timestamp() * 1000)
+            changes[str(peer.peer_id)] = client
+
+        try:
+            missing = await self.panel.update_clients(inbound_id, changes)
+        except PanelError as e:
+            result.failed.update((peer.peer_id, str(e)) for peer in peers)
+            return
+        for peer in peers:
+            if str(peer.peer_id) in missing:
+                result.failed[peer.peer_id] = f"client not found in inbound {inbound_id}"
+            else:
+                result.updated.append(peer)
+
+    async def set_enabled_many(
+            self,
+            peers: list[XrayPeer],
+            enabled: bool,
+            expiry_time: Optional[datetime.datetime] = None,
+            expiry_times: Optional[dict[int, Optional[datetime.datetime]]] = None
+        ) -> XrayBatchResult:
+        """Enables or disables many Xray peers, see `update_peers`."""
+        return await self.update_peers(peers, expiry_time, enabled, expiry_times)
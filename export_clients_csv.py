@@ -42,6 +42,7 @@ CSV_COLUMNS = [
 DEFAULT_CONFIG_PATH = "config.conf"
 DEFAULT_DELIMITER = ";"
 DEFAULT_ENCODING = "utf-8-sig"
+DEFAULT_BUSY_TIMEOUT = 5.0
 LayoutType = Literal["auto", "master", "canary"]
 
 
@@ -318,7 +319,12 @@ def export_clients_dump(
     resolved_output_path = Path(output_path).expanduser()
     resolved_db_path = db_path or _load_db_path_from_config(config_path)
 
-    connection = sqlite3.connect(resolved_db_path)
+    # read-only connection, so the dump never takes write locks on the bot's database
+    connection = sqlite3.connect(
+        f"{Path(resolved_db_path).expanduser().resolve().as_uri()}?mode=ro",
+        uri=True,
+        timeout=DEFAULT_BUSY_TIMEOUT,
+    )
     connection.row_factory = sqlite3.Row
 
     try:
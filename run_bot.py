@@ -12,14 +12,21 @@ from bot.commands import (get_admin_commands, get_default_commands,
                           set_admin_commands, set_user_commands)
 from bot.handlers import get_handlers_router
 from config.loader import (bot_cfg, bot_dispatcher, bot_instance, cfg,
-                           connections_observer, db_instance,
-                           interval_observer, ip_queue, wghub, xray_worker)
-from core.db.db_works import ClientFactory
+                           connections_observer, db_cfg, interval_observer,
+                           ip_queue, wghub, xray_worker)
+from core.db.async_db import AsyncClientFactory, db_thread
 from core.logs import bot_logger
+from core.wg.key_pool import key_pool
 
 
 def graceful_shutdown(sig, frame):
     bot_logger.critical("Recieved SIGINT signal, shutting down...")
+    wghub.stop()
+    db_thread.stop()
+    connections_observer.status_buffer.flush()
+    connections_observer.session_writer.close_all()
+    connections_observer.session_writer.flush()
+    connections_observer.traffic.flush()
     sys.exit(0)
 
 @bot_dispatcher.message(CommandStart())
@@ -29,15 +36,15 @@ async def cmd_start(message: Message) -> None:
     else:
         await set_user_commands(message.chat.id)
 
-    with db_instance.atomic():
-        # just in case.
-        client, created = ClientFactory(user_id=message.chat.id).get_or_create_client(
-            name=message.chat.username
-        )
+    # executed in a transaction, just in case.
+    client, created = await AsyncClientFactory.get_or_create_client(
+        message.chat.id,
+        name=message.chat.username
+    )
 
-        if created:
-            if cfg.is_canary:
-                ...
+    if created:
+        if cfg.is_canary:
+            ...
 
     keyboard = None
     faq_str = ""
@@ -104,10 +111,19 @@ async def main() -> None:
 
     signal.signal(signal.SIGINT, graceful_shutdown)
 
-    async with asyncio.TaskGroup() as group:
-        group.create_task(connections_observer.listen_events())
-        group.create_task(interval_observer.run_checkers())
-        group.create_task(bot_dispatcher.start_polling(bot_instance, handle_signals=False))
+    # in-memory databases can't be shared with another thread
+    if db_cfg.path != ":memory:":
+        db_thread.start()
+    key_pool.start()
+    wghub.start()
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(connections_observer.listen_events())
+            group.create_task(interval_observer.run_checkers())
+            group.create_task(bot_dispatcher.start_polling(bot_instance, handle_signals=False))
+    finally:
+        await xray_worker.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="heavens-gate", description="Run bot with core service.")
@@ -6,10 +6,10 @@ from typing import Any, Union
 import requests
 from colorama import Fore, Style, init
 from py3xui import Api
-from wgconfig import WGConfig
 
 from core.utils.ip_utils import check_ip_address, get_ip_prefix
 from core.wg.keygen import generate_private_key, generate_public_key
+from core.wg.wg_config import WGConfig
 
 init(autoreset=True)
 
@@ -146,7 +146,14 @@ def make_config(path):
     }
 
     config["db"] = {
-        "path": db_path
+        "path": db_path,
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": "-16000",
+        "mmap_size": "134217728",
+        "busy_timeout": "5000",
+        "read_pool_size": "4",
+        "client_cache_size": "1024",
     }
 
     config["core"] = {
@@ -156,7 +163,14 @@ def make_config(path):
         "connection_listen_timer": connection_listen_timer,
         "connection_update_timer": connection_update_timer,
         "connection_connected_only_listen_timer": connection_connected_only_listen_timer,
-        "logs_path": logs_path
+        "logs_path": logs_path,
+        "key_pool_low_watermark": "16",
+        "key_pool_high_watermark": "128",
+        "connection_detection": "handshake",
+        "handshake_timeout": "180",
+        "traffic_quota_gb": "0",
+        "traffic_quota_period": "monthly",
+        "traffic_quota_rolling_days": "30"
     }
 
     # making sure that all values are strings
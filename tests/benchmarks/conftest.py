@@ -0,0 +1,30 @@
+import os
+from pathlib import Path
+
+import pytest
+
+BENCHMARKS_DIR = Path(__file__).parent
+
+
+def pytest_collection_modifyitems(config, items):
+    """Benchmarks are slow, so they only run with `HG_BENCHMARKS=1` set."""
+    if os.getenv("HG_BENCHMARKS"):
+        return
+
+    skip_benchmark = pytest.mark.skip(reason="Set HG_BENCHMARKS=1 to run benchmarks")
+    for item in items:
+        if BENCHMARKS_DIR in item.path.parents:
+            item.add_marker(skip_benchmark)
+
+
+@pytest.fixture
+def report():
+    """Prints latency samples (in seconds) as a single line with percentiles in milliseconds."""
+    def inner(title: str, samples: list[float]) -> str:
+        ordered = sorted(samples)
+        p50 = ordered[len(ordered) // 2] * 1000
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+        line = f"{title}: n={len(ordered)} p50={p50:.3f}ms p99={p99:.3f}ms max={ordered[-1] * 1000:.3f}ms"
+        print(line)
+        return line
+    return inner
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from core.db.db_works import ClientFactory
+from core.db.enums import PeerStatusChoices
+from core.db.models import PeersTableModel, db, init_db
+
+USERS = 2000
+PEERS_PER_USER = 2
+WRITER_BATCH = 200
+READS = 2000
+
+
+def fill_database():
+    with db.atomic():
+        for user_id in range(USERS):
+            client, _ = ClientFactory(user_id=user_id).get_or_create_client(name=f"user_{user_id}")
+            for peer in range(PEERS_PER_USER):
+                number = user_id * PEERS_PER_USER + peer
+                client.add_wireguard_peer(
+                    shared_ips=f"10.{number // 65536}.{number // 256 % 256}.{number % 256}",
+                    public_key=f"pub{number}",
+                    private_key=f"priv{number}",
+                    preshared_key=f"psk{number}",
+                )
+
+
+def watchdog_writer(stop: threading.Event):
+    """Imitates watchdog cycles: flips statuses of peers in small transactions."""
+    status = PeerStatusChoices.STATUS_CONNECTED.value
+    while not stop.is_set():
+        for start in range(1, USERS * PEERS_PER_USER, WRITER_BATCH):
+            with db.atomic():
+                for peer_id in range(start, start + WRITER_BATCH):
+                    PeersTableModel.update(peer_status=status).where(PeersTableModel.id == peer_id).execute()
+            if stop.is_set():
+                break
+        status ^= 1
+    db.close()
+
+
+@pytest.mark.parametrize("journal_mode, read_pool_size", [("delete", 0), ("wal", 4)])
+def test_read_latency_during_writes(tmp_path, report, journal_mode, read_pool_size):
+    db_instance = init_db(
+        str(tmp_path / "bench.sqlite"),
+        pragmas={"journal_mode": journal_mode, "synchronous": "normal", "busy_timeout": 5000},
+        read_pool_size=read_pool_size,
+    )
+    fill_database()
+
+    stop = threading.Event()
+    writer = threading.Thread(target=watchdog_writer, args=(stop,))
+    writer.start()
+
+    samples = []
+    try:
+        for i in range(READS):
+            started = time.perf_counter()
+            client = ClientFactory(user_id=i % USERS).get_client()
+            client.get_all_peers(protocol_specific=True)
+            samples.append(time.perf_counter() - started)
+    finally:
+        stop.set()
+        writer.join()
+        db_instance.close()
+
+    report(f"handler reads, journal_mode={journal_mode}, read_pool_size={read_pool_size}", samples)
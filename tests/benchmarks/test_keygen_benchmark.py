@@ -0,0 +1,29 @@
+import shutil
+import time
+
+from core.wg.keygen import (KeygenBackend, generate_keypairs,
+                            generate_private_key, generate_public_key)
+
+KEYS = 200
+
+
+def keys_per_second(generate) -> float:
+    start = time.perf_counter()
+    generate()
+    return KEYS / (time.perf_counter() - start)
+
+
+def test_keygen_backends():
+    """Compares keypairs per second of the native and the subprocess backends."""
+    def single(backend: KeygenBackend):
+        for _ in range(KEYS):
+            generate_public_key(generate_private_key(backend=backend), backend=backend)
+
+    native = keys_per_second(lambda: single(KeygenBackend.NATIVE))
+    batch = keys_per_second(lambda: generate_keypairs(KEYS))
+    print(f"native: {native:.0f} keypairs/s, native batch: {batch:.0f} keypairs/s")
+
+    if shutil.which("wg") is not None:
+        subprocess = keys_per_second(lambda: single(KeygenBackend.SUBPROCESS))
+        print(f"subprocess: {subprocess:.0f} keypairs/s")
+        assert native > subprocess
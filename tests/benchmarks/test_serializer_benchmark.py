@@ -0,0 +1,58 @@
+import time
+
+from core.db.db_works import ClientFactory
+from core.db.enums import ProtocolType
+from core.db.models import PeersTableModel, UserModel, WireguardPeerModel, db
+
+PEERS = 10_000
+USERS = 100
+ROUNDS = 10
+
+
+def fill_database():
+    with db.atomic():
+        UserModel.insert_many(
+            [{"user_id": str(user_id), "name": f"user_{user_id}"} for user_id in range(USERS)]
+        ).execute()
+        PeersTableModel.insert_many([
+            {
+                "id": number + 1,
+                "user": str(number % USERS),
+                "peer_name": f"peer_{number}",
+                "peer_type": ProtocolType.WIREGUARD.value,
+            }
+            for number in range(PEERS)
+        ]).execute()
+        WireguardPeerModel.insert_many([
+            {
+                "peer": number + 1,
+                "public_key": f"pub{number}",
+                "private_key": f"priv{number}",
+                "preshared_key": f"psk{number}",
+                "shared_ips": f"10.{number // 65536}.{number // 256 % 256}.{number % 256}/32",
+                "ipv4": 0x0A000000 + number,
+            }
+            for number in range(PEERS)
+        ]).execute()
+
+
+def measure(trusted: bool) -> list[float]:
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        clients = ClientFactory.select_clients_with_peers(trusted=trusted)
+        samples.append(time.perf_counter() - start)
+    assert sum(len(peers) for _, peers in clients) == PEERS
+    return samples
+
+
+def test_trusted_serializer_at_10k_peers(db, report):
+    """Compares `model_validate` on peewee models against `from_row` on tuples for the watchdog refresh."""
+    fill_database()
+
+    validated = measure(trusted=False)
+    trusted = measure(trusted=True)
+
+    report("select_clients_with_peers, model_validate", validated)
+    report("select_clients_with_peers, from_row", trusted)
+    assert sorted(trusted)[ROUNDS // 2] < sorted(validated)[ROUNDS // 2]
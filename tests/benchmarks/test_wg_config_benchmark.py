@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from core.wg.wg_config import WGConfig
+
+ROUNDS = 1000
+
+
+def make_config(peers: int) -> str:
+    lines = ["[Interface]", "Address = 10.0.0.1/16", "ListenPort = 51820", "PrivateKey = server=", ""]
+    for number in range(peers):
+        lines += [
+            f"# peer_{number}",
+            "[Peer]",
+            f"PublicKey = pub{number}=",
+            f"PresharedKey = psk{number}=",
+            f"AllowedIPs = 10.0.{number // 256 % 256}.{number % 256}/32",
+            "",
+        ]
+    return "\n".join(lines)
+
+
+@pytest.mark.parametrize("peers", [10_000, 50_000])
+def test_wg_config(tmp_path, report, peers: int):
+    """Reads, changes and writes a config with many peers."""
+    path = tmp_path / "wg0.conf"
+    path.write_text(make_config(peers))
+    config = WGConfig(str(path))
+
+    start = time.perf_counter()
+    config.read_file()
+    print(f"{peers} peers: read in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    samples = []
+    for number in range(ROUNDS):
+        start = time.perf_counter()
+        config.disable_peer(f"pub{number * 7 % peers}=")
+        config.enable_peer(f"pub{number * 13 % peers}=")
+        samples.append(time.perf_counter() - start)
+    report(f"{peers} peers: disable + enable", samples)
+
+    samples = []
+    for number in range(ROUNDS):
+        start = time.perf_counter()
+        config.add_peer(f"new{number}=", f"# new_{number}")
+        config.add_attr(f"new{number}=", "AllowedIPs", f"10.1.{number // 256}.{number % 256}/32")
+        config.del_peer(f"new{number}=")
+        samples.append(time.perf_counter() - start)
+    report(f"{peers} peers: add + delete", samples)
+
+    samples = []
+    for _ in range(5):
+        start = time.perf_counter()
+        config.write_file()
+        samples.append(time.perf_counter() - start)
+    report(f"{peers} peers: write", samples)
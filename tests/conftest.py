@@ -1,6 +1,13 @@
+import asyncio
+import json
+from collections import Counter
+from typing import Any
 from unittest.mock import patch
 
 import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 
 from config.settings import Config
 from core.db.enums import PeerStatusChoices, ProtocolType
@@ -150,3 +157,143 @@ EndpointPort=8888
 Junk=1,2,3,4,5""")
 
     return path
+
+
+class XuiPanelStub:
+    """
+    In-memory imitation of the 3x-ui endpoints used by `XuiPanelClient`.
+
+    Attributes:
+        clients (dict[int, dict[str, dict]]): Clients by inbound and client ID, as 3x-ui stores them.
+        online (list[str]): Emails returned by `onlines`.
+        requests (Counter): Number of requests per route name.
+        delay (float): Seconds every API request is delayed by.
+        errors (int): Number of the next API requests that fail with HTTP 500.
+        raw_inbounds (dict[int, Any]): Inbounds returned as they are instead of the generated ones.
+    """
+    WEB_PATH = "panel_path"
+    USERNAME = "admin"
+    PASSWORD = "password"
+
+    def __init__(self):
+        self.clients: dict[int, dict[str, dict]] = {1: {}}
+        self.online: list[str] = []
+        self.requests: Counter = Counter()
+        self.delay = 0.0
+        self.errors = 0
+        self.raw_inbounds: dict[int, Any] = {}
+        self.__sessions: set[str] = set()
+
+    def expire_sessions(self) -> None:
+        self.__sessions.clear()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        prefix = f"/{self.WEB_PATH}"
+        app.router.add_post(f"{prefix}/login", self.login)
+        app.router.add_get(f"{prefix}/panel/api/inbounds/get/{{inbound_id}}", self.api(self.get_inbound))
+        app.router.add_post(f"{prefix}/panel/api/inbounds/addClient", self.api(self.add_client))
+        app.router.add_post(f"{prefix}/panel/api/inbounds/updateClient/{{client_id}}", self.api(self.update_client))
+        app.router.add_post(f"{prefix}/panel/api/inbounds/update/{{inbound_id}}", self.api(self.update_inbound))
+        app.router.add_post(f"{prefix}/panel/api/inbounds/{{inbound_id}}/delClient/{{client_id}}",
+                            self.api(self.delete_client))
+        app.router.add_post(f"{prefix}/panel/api/inbounds/onlines", self.api(self.get_online))
+        return app
+
+    async def login(self, request: web.Request) -> web.Response:
+        self.requests["login"] += 1
+        form = await request.post()
+        if form.get("username") != self.USERNAME or form.get("password") != self.PASSWORD:
+            return web.json_response({"success": False, "msg": "Wrong username or password"})
+        session = f"session-{self.requests['login']}"
+        self.__sessions.add(session)
+        response = web.json_response({"success": True, "msg": "Login Successfully"})
+        response.set_cookie("3x-ui", session)
+        return response
+
+    def api(self, handler):
+        async def wrapper(request: web.Request) -> web.Response:
+            self.requests[handler.__name__] += 1
+            if request.cookies.get("3x-ui") not in self.__sessions:
+                raise web.HTTPNotFound()
+            await asyncio.sleep(self.delay)
+            if self.errors:
+                self.errors -= 1
+                raise web.HTTPInternalServerError()
+            try:
+                return web.json_response({"success": True, "msg": "", "obj": await handler(request)})
+            except KeyError as e:
+                return web.json_response({"success": False, "msg": f"Not found: {e}", "obj": None})
+        return wrapper
+
+    async def get_inbound(self, request: web.Request) -> dict:
+        inbound_id = int(request.match_info["inbound_id"])
+        if inbound_id in self.raw_inbounds:
+            return self.raw_inbounds[inbound_id]
+        clients = list(self.clients[inbound_id].values())
+        return {
+            "id": inbound_id, "up": 0, "down": 0, "total": 0, "remark": "main", "enable": True,
+            "expiryTime": 0, "listen": "", "port": 443, "protocol": "vless", "tag": f"inbound-{inbound_id}",
+            "settings": json.dumps({"clients": clients, "decryption": "none", "fallbacks": []}),
+            "streamSettings": json.dumps({"network": "tcp", "security": "reality", "realitySettings": {
+                "serverNames": ["example.com"], "shortIds": ["abcd"],
+                "settings": {"publicKey": "pbk", "fingerprint": "chrome"}
+            }}),
+            "sniffing": json.dumps({"enabled": False, "destOverride": []}),
+            "clientStats": [
+                {"id": i, "inboundId": inbound_id, "enable": client["enable"], "email": client["email"],
+                 "up": client.get("up", 0), "down": client.get("down", 0), "expiryTime": 0, "total": 0}
+                for i, client in enumerate(clients, start=1)
+            ],
+        }
+
+    async def add_client(self, request: web.Request) -> None:
+        form = await request.post()
+        inbound = self.clients[int(form["id"])]
+        for client in json.loads(form["settings"])["clients"]:
+            inbound[str(client["id"])] = client
+
+    async def update_client(self, request: web.Request) -> None:
+        form = await request.post()
+        inbound = self.clients[int(form["id"])]
+        client_id = request.match_info["client_id"]
+        inbound[client_id]  # 3x-ui doesn't create clients on update
+        inbound[client_id] = json.loads(form["settings"])["clients"][0]
+
+    async def update_inbound(self, request: web.Request) -> None:
+        inbound = await request.json()
+        inbound_id = int(request.match_info["inbound_id"])
+        self.clients[inbound_id]
+        assert inbound["id"] == inbound_id and "clientStats" not in inbound
+        clients = json.loads(inbound["settings"])["clients"]
+        self.clients[inbound_id] = {str(client["id"]): client for client in clients}
+
+    async def delete_client(self, request: web.Request) -> None:
+        del self.clients[int(request.match_info["inbound_id"])][request.match_info["client_id"]]
+
+    async def get_online(self, request: web.Request) -> list[str]:
+        return self.online
+
+@pytest_asyncio.fixture
+async def xui_panel():
+    panel = XuiPanelStub()
+    server = TestServer(panel.app())
+    await server.start_server()
+    panel.port = server.port
+    yield panel
+    await server.close()
+
+@pytest_asyncio.fixture
+async def panel_xray_worker(xui_panel: XuiPanelStub):
+    with patch("py3xui.Api.login") as mock_login:
+        mock_login.return_value = None
+        worker = XrayWorker(
+            host="http://127.0.0.1",
+            port=str(xui_panel.port),
+            web_path=XuiPanelStub.WEB_PATH,
+            username=XuiPanelStub.USERNAME,
+            password=XuiPanelStub.PASSWORD,
+            tls=False
+        )
+    yield worker
+    await worker.close()
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+import pytest
+
+from core.db.async_db import (AsyncClient, AsyncClientFactory, DatabaseThread,
+                              db_thread)
+from core.db.db_works import ClientFactory
+from core.db.enums import ClientStatusChoices
+from core.db.models import db, init_db
+
+
+@pytest.fixture
+def file_db(tmp_path):
+    init_db(str(tmp_path / "db.sqlite"))
+    db_thread.start()
+    yield db
+    db_thread.stop()
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_calls_run_on_database_thread(file_db):
+    main_thread = threading.get_ident()
+    thread_id = await db_thread.run(threading.get_ident)
+
+    assert thread_id != main_thread
+
+    client, created = await AsyncClientFactory.get_or_create_client(123, name="iamuser")
+    assert created is True
+    assert isinstance(client, AsyncClient)
+
+    assert await client.set_status(ClientStatusChoices.STATUS_CONNECTED) is True
+    fetched = await AsyncClientFactory.get_client(123)
+    assert fetched.userdata.status == ClientStatusChoices.STATUS_CONNECTED
+    assert await AsyncClientFactory.count_clients() == 1
+
+@pytest.mark.asyncio
+async def test_transaction_is_rolled_back(file_db):
+    def create_and_fail():
+        ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        await db_thread.run_in_transaction(create_and_fail)
+
+    assert await AsyncClientFactory.get_client(123) is None
+
+@pytest.mark.asyncio
+async def test_bounded_queue_keeps_order():
+    database_thread = DatabaseThread(max_queue_size=2)
+    database_thread.start()
+    results = []
+    try:
+        await asyncio.gather(*(database_thread.run(results.append, i) for i in range(20)))
+    finally:
+        database_thread.stop()
+
+    assert results == list(range(20))
+
+@pytest.mark.asyncio
+async def test_runs_inline_when_not_started(db):
+    assert db_thread.is_running is False
+    assert await db_thread.run(threading.get_ident) == threading.get_ident()
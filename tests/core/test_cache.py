@@ -0,0 +1,77 @@
+from core.db.cache import ClientCache, client_cache
+from core.db.db_works import ClientFactory
+from core.db.enums import ClientStatusChoices, PeerStatusChoices
+from core.db.write_buffer import StatusWriteBuffer
+
+
+def add_peer(client, default_peers, name="iamuser_0"):
+    return client.add_wireguard_peer(**default_peers[name].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+
+def test_get_client_is_cached(db):
+    ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+
+    client = ClientFactory(user_id=123).get_client()
+
+    assert ClientFactory(user_id=123).get_client() is client
+    assert client_cache.info().hits == 1
+    assert client_cache.info().misses == 1
+
+def test_client_mutators_invalidate_cache(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    cached = ClientFactory(user_id=123).get_client()
+    assert cached.get_all_peers() == []
+
+    peer = add_peer(client, default_peers)
+    assert [p.peer_id for p in cached.get_all_peers()] == [peer.peer_id]
+
+    client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_CONNECTED)
+    assert cached.get_all_peers(protocol_specific=True)[0].peer_status == PeerStatusChoices.STATUS_CONNECTED
+
+    client.set_status(ClientStatusChoices.STATUS_ACCOUNT_BLOCKED)
+    assert ClientFactory(user_id=123).get_client().userdata.status == ClientStatusChoices.STATUS_ACCOUNT_BLOCKED
+
+    ClientFactory.delete_peer_by_id(peer.peer_id)
+    assert cached.get_all_peers() == []
+
+    ClientFactory.delete_client_by_id(123)
+    assert ClientFactory(user_id=123).get_client() is None
+
+def test_write_buffer_flush_invalidates_cache(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    peer = add_peer(client, default_peers)
+    assert client.get_all_peers()[0].peer_status == PeerStatusChoices.STATUS_DISCONNECTED
+
+    buffer = StatusWriteBuffer()
+    buffer.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_CONNECTED)
+    buffer.flush()
+
+    assert client.get_all_peers()[0].peer_status == PeerStatusChoices.STATUS_CONNECTED
+
+def test_lru_eviction():
+    cache = ClientCache(maxsize=2)
+    for user_id in range(3):
+        cache.put_peers(user_id, False, [])
+    cache.get_peers(1, False)
+    cache.put_peers(3, False, [])
+
+    assert cache.get_peers(0, False) is None
+    assert cache.get_peers(2, False) is None
+    assert cache.get_peers(1, False) == []
+    assert cache.get_peers(3, False) == []
+    assert cache.info() == (3, 2, 2, 2)
+
+def test_cached_peers_are_copies(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    add_peer(client, default_peers)
+
+    trusted = client.get_all_peers(protocol_specific=True, trusted=True)
+    trusted[0].peer_status = PeerStatusChoices.STATUS_CONNECTED
+
+    # validated and trusted reads are cached separately
+    validated = client.get_all_peers(protocol_specific=True)
+    assert validated[0].peer_status == PeerStatusChoices.STATUS_DISCONNECTED
+    again = client.get_all_peers(protocol_specific=True, trusted=True)
+    assert again[0] is not trusted[0]
+    assert again[0].peer_status == PeerStatusChoices.STATUS_DISCONNECTED
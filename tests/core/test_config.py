@@ -69,6 +69,12 @@ def test_load_config(config_path):
     assert core_cfg.connection_update_timer == 5
     assert core_cfg.connection_connected_only_listen_timer == 1
     assert core_cfg.logs_path == "./logs"
+    assert core_cfg.key_pool_low_watermark == 16
+    assert core_cfg.key_pool_high_watermark == 128
+    assert core_cfg.connection_detection == "handshake"
+    assert core_cfg.handshake_timeout == 180
+    assert core_cfg.traffic_quota_gb == 0
+    assert core_cfg.traffic_quota_period == "monthly"
     assert core_cfg.connection_update_timer == 5
 
     xray_cfg = config.get_xray_server_config()
@@ -79,3 +85,16 @@ def test_load_config(config_path):
     assert xray_cfg.password == "cock"
     assert xray_cfg.token is None
     assert xray_cfg.tls is True
+
+def test_database_config_defaults(config_path):
+    db_cfg = Config(config_path).get_database_config()
+
+    assert db_cfg.read_pool_size == 4
+    assert db_cfg.client_cache_size == 1024
+    assert db_cfg.pragmas == {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -16000,
+        "mmap_size": 134217728,
+        "busy_timeout": 5000,
+    }
@@ -1,6 +1,12 @@
+import datetime
+import sqlite3
+
+import peewee
 import pytest
 
 from core.db.db_works import Client, ClientFactory
+from core.db.enums import ClientStatusChoices, PeerStatusChoices
+from core.db.models import init_db, read_db, reader
 
 
 def test_create_client(db):
@@ -73,3 +79,160 @@ def test_add_xray_peer(db):
 
     assert peer.flow == "flow"
     assert peer.inbound_id == 123
+
+def test_select_clients_with_peers(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    client.add_wireguard_peer(**default_peers["iamuser_0"].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+    client.add_xray_peer(inbound_id=1, flow="flow")
+    ClientFactory(user_id=456).get_or_create_client(name="peerless")
+
+    clients = {c.userdata.user_id: peers for c, peers in ClientFactory.select_clients_with_peers()}
+
+    assert set(clients.keys()) == {"123", "456"}
+    assert clients["456"] == []
+    assert clients["123"] == client.get_all_peers(protocol_specific=True)
+
+def test_trusted_peers_match_validated(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    peer = client.add_wireguard_peer(**default_peers["iamuser_0"].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+    client.add_wireguard_peer(**default_peers["iamuser_1"].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }), is_amnezia=True)
+    client.add_xray_peer(inbound_id=1, flow="flow")
+    client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_CONNECTED)
+    client.set_peer_timer(peer.peer_id, datetime.datetime(2030, 1, 1, 12, 0))
+
+    assert client.get_all_peers(protocol_specific=True, trusted=True) == client.get_all_peers(protocol_specific=True)
+    assert client.get_all_peers(trusted=True) == client.get_all_peers()
+    assert client.get_connected_peers(trusted=True) == client.get_connected_peers()
+    assert ClientFactory.select_clients_with_peers(trusted=True)[0][1] == client.get_all_peers(protocol_specific=True)
+
+def test_select_clients_with_peers_by_user_ids(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    client.add_wireguard_peer(**default_peers["iamuser_0"].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+    other, _ = ClientFactory(user_id=456).get_or_create_client(name="otheruser")
+    other.add_xray_peer(inbound_id=1, flow="flow")
+
+    clients = ClientFactory.select_clients_with_peers(user_ids=[456])
+
+    assert [(c.userdata.user_id, len(peers)) for c, peers in clients] == [("456", 1)]
+
+def test_expiring_clients(db):
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    tomorrow = today + datetime.timedelta(days=1)
+    expire_times = {
+        1: today - datetime.timedelta(days=3),
+        2: today + datetime.timedelta(hours=12),
+        3: tomorrow + datetime.timedelta(hours=12),
+        4: tomorrow + datetime.timedelta(days=5),
+        5: None,
+    }
+    for user_id, expire_time in expire_times.items():
+        ClientFactory(user_id=user_id).get_or_create_client(name=f"user{user_id}", expire_time=expire_time)
+    ClientFactory(user_id=1).get_client().set_status(ClientStatusChoices.STATUS_CONNECTED)
+
+    expiring = ClientFactory.select_expiring_clients(until=tomorrow + datetime.timedelta(days=1))
+    assert [c.userdata.user_id for c in expiring] == ["1", "2", "3"]
+
+    blocked = ClientFactory.block_expired_clients(until=tomorrow)
+    assert [c.userdata.user_id for c in blocked] == ["1", "2"]
+    assert ClientFactory(user_id=1).get_client().userdata.status == ClientStatusChoices.STATUS_ACCOUNT_BLOCKED
+    assert ClientFactory.block_expired_clients(until=tomorrow) == []
+
+    warned = ClientFactory.select_expiring_clients(until=tomorrow + datetime.timedelta(days=1), since=tomorrow)
+    assert [c.userdata.user_id for c in warned] == ["3"]
+
+def test_get_peer_by_ip(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    client.add_wireguard_peer(**default_peers["iamuser_0"].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+
+    peer = ClientFactory.get_peer_by_ip("10.0.0.2")
+
+    assert peer is not None
+    assert peer.public_key == default_peers["iamuser_0"].public_key
+    assert ClientFactory.get_peer_by_ip("10.0.0.3") is None
+    assert ClientFactory.get_wireguard_peer("10.0.0.2").peer_id == peer.peer_id
+
+def test_get_peer_by_non_ipv4(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    client.add_wireguard_peer(**default_peers["iamuser_0"].model_dump(include={
+        "public_key", "private_key", "preshared_key"
+    }), shared_ips="fd00::2/128")
+
+    # peers without IPv4 have NULL in the indexed column and must not match other addresses
+    assert ClientFactory.get_peer_by_ip("::1") is None
+    assert ClientFactory.get_wireguard_peer("not an ip") is None
+    assert client.delete_wireguard_peer_by_ip("::1") is False
+    assert ClientFactory.get_peer_by_ip("fd00::2/128").public_key == default_peers["iamuser_0"].public_key
+
+def test_delete_wireguard_peer_by_ip(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    client.add_wireguard_peer(**default_peers["iamuser_0"].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+
+    assert client.delete_wireguard_peer_by_ip("10.0.0.3") is False
+    assert client.delete_wireguard_peer_by_ip("10.0.0.2") is True
+    assert client.get_wireguard_peers(is_amnezia=False) == []
+
+def test_migrate_wireguard_ipv4_column(tmp_path):
+    db_path = tmp_path / "old.sqlite"
+    connection = sqlite3.connect(db_path)
+    connection.executescript("""
+        CREATE TABLE "Users" ("user_id" VARCHAR(255) NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL,
+            "status" INTEGER NOT NULL, "expire_time" DATETIME, "registered_at" DATETIME NOT NULL);
+        CREATE TABLE "PeersTable" ("id" INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, "user_id" VARCHAR(255) NOT NULL,
+            "peer_name" VARCHAR(255) NOT NULL, "peer_type" VARCHAR(255) NOT NULL, "peer_status" INTEGER NOT NULL,
+            "peer_timer" DATETIME, FOREIGN KEY ("user_id") REFERENCES "Users" ("user_id") ON DELETE CASCADE);
+        CREATE TABLE "WireguardPeers" ("id" INTEGER NOT NULL PRIMARY KEY, "peer_id" INTEGER NOT NULL,
+            "public_key" VARCHAR(255) NOT NULL, "private_key" VARCHAR(255) NOT NULL,
+            "preshared_key" VARCHAR(255) NOT NULL, "shared_ips" VARCHAR(255) NOT NULL,
+            "is_amnezia" INTEGER NOT NULL, "Jc" INTEGER, "Jmin" INTEGER, "Jmax" INTEGER,
+            FOREIGN KEY ("peer_id") REFERENCES "PeersTable" ("id") ON DELETE CASCADE);
+        INSERT INTO "Users" VALUES ('123', 'iamuser', 0, NULL, '2024-01-01 00:00:00');
+        INSERT INTO "PeersTable" VALUES (1, '123', 'iamuser_1', 'wg', 0, NULL);
+        INSERT INTO "WireguardPeers" VALUES (1, 1, 'pub', 'priv', 'psk', '10.0.0.5', 0, NULL, NULL, NULL);
+    """)
+    connection.close()
+
+    db_instance = init_db(str(db_path))
+    try:
+        peer = ClientFactory.get_peer_by_ip("10.0.0.5")
+        assert peer is not None
+        assert peer.public_key == "pub"
+
+        indexes = {index.name: index for index in db_instance.get_indexes("WireguardPeers")}
+        assert any(index.unique and index.columns == ["ipv4"] for index in indexes.values())
+
+        # users added before per-user limits keep the global quota
+        client = ClientFactory(user_id=123).get_client()
+        assert client.userdata.traffic_limit is None
+        assert client.set_traffic_limit(1024) is True
+        assert ClientFactory(user_id=123).get_client().userdata.traffic_limit == 1024
+    finally:
+        db_instance.close()
+
+def test_wal_and_read_only_pool(tmp_path):
+    db_instance = init_db(str(tmp_path / "db.sqlite"), pragmas={"journal_mode": "wal", "synchronous": "normal"})
+    try:
+        assert db_instance.execute_sql("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+        ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+
+        with reader() as database:
+            assert database is read_db
+            assert database.execute_sql("PRAGMA query_only").fetchone()[0] == 1
+            with pytest.raises(peewee.OperationalError):
+                database.execute_sql("DELETE FROM Users")
+
+        assert ClientFactory(user_id=123).get_client().userdata.name == "iamuser"
+    finally:
+        db_instance.close()
@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from core.wg.key_pool import KeyPool
+from core.wg.keygen import generate_public_key
+
+
+def test_pool_hands_out_keys_once():
+    pool = KeyPool(low_watermark=2, high_watermark=4, batch_size=3)
+
+    assert pool.fill() == 4
+    keys = [pool.pop() for _ in range(6)]
+
+    # the last two are generated inline once the pool is drained
+    assert len(pool) == 0
+    assert len({k.private_key for k in keys}) == 6
+    assert all(generate_public_key(k.private_key) == k.public_key for k in keys)
+
+def wait_for_size(pool: KeyPool, size: int, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while len(pool) != size and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return len(pool) == size
+
+def test_refill_thread_keeps_pool_above_low_watermark():
+    pool = KeyPool(low_watermark=3, high_watermark=5)
+    pool.start()
+    try:
+        assert wait_for_size(pool, 5)
+        for _ in range(3):
+            pool.pop()
+        assert wait_for_size(pool, 5)
+    finally:
+        pool.stop()
+
+def test_invalid_watermarks():
+    with pytest.raises(ValueError):
+        KeyPool(low_watermark=10, high_watermark=5)
@@ -0,0 +1,68 @@
+import base64
+import shutil
+from unittest.mock import patch
+
+import pytest
+
+from core.wg.keygen import (KeygenBackend, generate_keypairs,
+                            generate_preshared_key, generate_private_key,
+                            generate_public_key)
+from tests.conftest import PRIVATE_KEY
+
+# RFC 7748, section 6.1
+ALICE_PRIVATE = bytes.fromhex("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a")
+ALICE_PUBLIC = bytes.fromhex("8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a")
+BOB_PRIVATE = bytes.fromhex("5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb")
+BOB_PUBLIC = bytes.fromhex("de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f")
+
+
+def b64(key: bytes) -> str:
+    return base64.b64encode(key).decode()
+
+def test_public_key_rfc7748_vectors():
+    assert generate_public_key(b64(ALICE_PRIVATE)) == b64(ALICE_PUBLIC)
+    assert generate_public_key(b64(BOB_PRIVATE)) == b64(BOB_PUBLIC)
+
+def test_keypairs_rfc7748_vectors():
+    with patch("core.wg.keygen.secrets.token_bytes", side_effect=[ALICE_PRIVATE, BOB_PRIVATE]):
+        pairs = generate_keypairs(2)
+
+    assert [public_key for _, public_key in pairs] == [b64(ALICE_PUBLIC), b64(BOB_PUBLIC)]
+    # private keys are clamped, which doesn't change the public ones
+    assert all(generate_public_key(private_key) == public_key for private_key, public_key in pairs)
+
+def test_generated_keys_format(wireguard_server_config):
+    assert generate_public_key(PRIVATE_KEY) == wireguard_server_config.public_key
+
+    private_key = base64.b64decode(generate_private_key())
+    assert len(private_key) == 32
+    # clamped like `wg genkey` does
+    assert private_key[0] & 7 == 0 and private_key[31] & 128 == 0 and private_key[31] & 64
+    assert len(base64.b64decode(generate_preshared_key())) == 32
+
+    with pytest.raises(ValueError):
+        generate_public_key("not a key")
+
+def test_batch_keypairs_match_single_keys():
+    pairs = generate_keypairs(5)
+
+    assert len({private_key for private_key, _ in pairs}) == 5
+    assert all(generate_public_key(private_key) == public_key for private_key, public_key in pairs)
+
+def test_native_backend_falls_back_to_subprocess():
+    with patch("core.wg.keygen.X25519PrivateKey", None), \
+         patch("core.wg.keygen._run", return_value=b64(ALICE_PUBLIC)) as run:
+        assert generate_public_key(b64(ALICE_PRIVATE)) == b64(ALICE_PUBLIC)
+        run.assert_called_once_with(False, "pubkey", stdin=b64(ALICE_PRIVATE))
+
+        assert generate_keypairs(2)[1][1] == b64(ALICE_PUBLIC)
+        assert run.call_count == 3
+
+@pytest.mark.skipif(shutil.which("wg") is None, reason="wg is not installed")
+def test_native_backend_matches_wg():
+    private_key = generate_private_key(backend=KeygenBackend.SUBPROCESS)
+    assert generate_public_key(private_key) == generate_public_key(private_key, backend=KeygenBackend.SUBPROCESS)
+    assert generate_public_key(b64(ALICE_PRIVATE), backend=KeygenBackend.SUBPROCESS) == b64(ALICE_PUBLIC)
+
+    for private_key, public_key in generate_keypairs(5):
+        assert generate_public_key(private_key, backend=KeygenBackend.SUBPROCESS) == public_key
@@ -0,0 +1,153 @@
+import datetime
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from core.db.db_works import ClientFactory
+from core.db.enums import ClientStatusChoices
+from core.db.quota import QuotaEngine, QuotaPeriod
+from core.db.traffic import TrafficAccounting
+from core.watchdog.events import IntervalEvents
+
+TODAY = datetime.date(2030, 1, 31)
+
+
+def add_peer(client, default_peers, name="iamuser_0"):
+    return client.add_wireguard_peer(**default_peers[name].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+
+def test_load_and_incremental_evaluation(db, default_peers):
+    client, _ = ClientFactory(user_id=1).get_or_create_client(name="heavy")
+    peer = add_peer(client, default_peers)
+    traffic = TrafficAccounting()
+    at = datetime.datetime.combine(TODAY, datetime.time(12)).timestamp()
+    traffic.record([(peer.peer_id, 0, 0)], at=at)
+    traffic.record([(peer.peer_id, 400, 400)], at=at + 60)
+    traffic.flush()
+
+    quota = QuotaEngine(limit_bytes=1000, period=QuotaPeriod.MONTHLY)
+    quota.add({"1": 10_000})  # ignored until loaded
+    quota.load(today=TODAY)
+    assert quota.get_usage(1, today=TODAY) == 800
+    assert quota.evaluate(today=TODAY) == ([], [])
+
+    quota.add({"1": 100, "2": 50}, day=TODAY)
+    assert quota.evaluate(today=TODAY) == ([], [])
+    quota.add({"1": 100}, day=TODAY)
+    assert quota.evaluate(today=TODAY) == (["1"], [])
+    quota.mark_exceeded(1)
+    # nothing changed since the previous evaluation
+    assert quota.evaluate(today=TODAY) == ([], [])
+
+    # a new month starts, the user is back under quota
+    assert quota.evaluate(today=TODAY + datetime.timedelta(days=1)) == ([], ["1"])
+    assert quota.get_usage(1, today=TODAY + datetime.timedelta(days=1)) == 0
+
+def test_rolling_window(db):
+    quota = QuotaEngine(limit_bytes=1000, period=QuotaPeriod.ROLLING, rolling_days=3)
+    assert quota.window_start(TODAY) == TODAY - datetime.timedelta(days=2)
+    assert QuotaEngine(limit_bytes=1).window_start(TODAY) == datetime.date(2030, 1, 1)
+    with pytest.raises(ValueError):
+        QuotaEngine(limit_bytes=-1)
+
+    quota.load(today=TODAY)
+    quota.add({"1": 600}, day=TODAY)
+    quota.add({"1": 600}, day=TODAY + datetime.timedelta(days=1))
+    assert quota.evaluate(today=TODAY + datetime.timedelta(days=1)) == (["1"], [])
+    quota.mark_exceeded(1)
+    assert quota.evaluate(today=TODAY + datetime.timedelta(days=2)) == ([], [])
+    assert quota.evaluate(today=TODAY + datetime.timedelta(days=3)) == ([], ["1"])
+
+def test_per_user_limits(db):
+    ClientFactory(user_id=1).get_or_create_client(name="premium")[0].set_traffic_limit(5000)
+    ClientFactory(user_id=2).get_or_create_client(name="unlimited")[0].set_traffic_limit(0)
+    ClientFactory(user_id=3).get_or_create_client(name="regular")
+
+    quota = QuotaEngine(limit_bytes=1000)
+    quota.load(today=TODAY)
+    assert (quota.limit_for(1), quota.limit_for(2), quota.limit_for(3)) == (5000, 0, 1000)
+    quota.add({"1": 2000, "2": 2000, "3": 2000}, day=TODAY)
+    assert quota.evaluate(today=TODAY) == (["3"], [])
+
+    # the admin lowers the limit of the first user and lifts the limit of the third one
+    quota.set_limit(1, 1500)
+    quota.mark_exceeded(3)
+    quota.set_limit(3, 0)
+    assert quota.evaluate(today=TODAY) == (["1"], ["3"])
+
+    quota.set_limit(1, None)
+    assert quota.limit_for(1) == 1000
+    with pytest.raises(ValueError):
+        quota.set_limit(1, -1)
+
+def test_per_user_limit_without_global_quota(db):
+    client, _ = ClientFactory(user_id=1).get_or_create_client(name="limited")
+    quota = QuotaEngine()
+    quota.load(today=TODAY)
+    assert not quota.is_enabled and not quota.is_loaded
+
+    client.set_traffic_limit(1000)
+    quota.set_limit(1, 1000)
+    assert quota.is_enabled and quota.is_loaded
+    quota.add({"1": 1000, "2": 1000}, day=TODAY)
+    assert quota.evaluate(today=TODAY) == (["1"], [])
+
+@pytest.mark.asyncio
+async def test_enforce_quotas(db, wg_hub, xray_worker, default_peers):
+    client, _ = ClientFactory(user_id=1).get_or_create_client(name="heavy")
+    add_peer(client, default_peers)
+    banned, _ = ClientFactory(user_id=2).get_or_create_client(name="banned")
+    banned.set_status(ClientStatusChoices.STATUS_ACCOUNT_BLOCKED)
+    expired, _ = ClientFactory(user_id=3).get_or_create_client(name="expired")
+    expired.set_status(ClientStatusChoices.STATUS_TIME_EXPIRED)
+
+    quota = QuotaEngine(limit_bytes=1000)
+    quota.load()
+    quota.add({"1": 2000, "2": 2000, "3": 2000})
+    interval_events = IntervalEvents(wg_hub, xray_worker)
+    exceeded, restored = AsyncMock(), AsyncMock()
+    interval_events.quota_exceeded_observer.register(exceeded)
+    interval_events.quota_restored_observer.register(restored)
+
+    with patch("core.watchdog.events.quota_engine", quota), \
+         patch("core.watchdog.events.disable_peers") as disable_peers, \
+         patch("core.watchdog.events.enable_peers") as enable_peers:
+        await interval_events._IntervalEvents__enforce_quotas()
+        assert [call.args[0].userdata.user_id for call in exceeded.call_args_list] == ["1"]
+        disable_peers.assert_called_once()
+        assert ClientFactory(user_id=1).get_client().userdata.status == ClientStatusChoices.STATUS_QUOTA_EXCEEDED
+        assert ClientFactory(user_id=3).get_client().userdata.status == ClientStatusChoices.STATUS_TIME_EXPIRED
+        assert quota.exceeded == {"1"}
+
+        with patch.object(quota, "evaluate", return_value=([], ["1"])):
+            await interval_events._IntervalEvents__enforce_quotas()
+        enable_peers.assert_called_once()
+        restored.assert_called_once()
+        assert ClientFactory(user_id=1).get_client().userdata.status == ClientStatusChoices.STATUS_DISCONNECTED
+        assert quota.exceeded == set()
+
+@pytest.mark.asyncio
+async def test_enforce_per_user_limit_without_global_quota(db, wg_hub, xray_worker, default_peers):
+    client, _ = ClientFactory(user_id=1).get_or_create_client(name="limited")
+    add_peer(client, default_peers)
+    quota = QuotaEngine()
+    quota.load()
+    interval_events = IntervalEvents(wg_hub, xray_worker)
+
+    with patch("core.watchdog.events.quota_engine", quota), \
+         patch.object(interval_events, "scheduled_runner", new_callable=AsyncMock), \
+         patch.object(interval_events, "interval_runner", new_callable=AsyncMock) as interval_runner:
+        await interval_events.run_checkers()
+    # the checker runs even though no limits are set yet
+    enforce_quotas = interval_events._IntervalEvents__enforce_quotas
+    assert enforce_quotas in [call.args[0] for call in interval_runner.call_args_list]
+
+    client.set_traffic_limit(1000)
+    quota.set_limit(1, 1000)
+    quota.add({"1": 2000})
+    with patch("core.watchdog.events.quota_engine", quota), \
+         patch("core.watchdog.events.disable_peers") as disable_peers:
+        await enforce_quotas()
+    disable_peers.assert_called_once()
+    assert ClientFactory(user_id=1).get_client().userdata.status == ClientStatusChoices.STATUS_QUOTA_EXCEEDED
@@ -0,0 +1,89 @@
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from core.db.enums import PeerStatusChoices, ProtocolType
+from core.db.model_serializer import WireguardPeer, XrayPeer
+from core.utils.reconciler import Reconciler, compute_plan
+from core.wg.wg_config import WGConfig
+from core.wg.wg_work import WGHub, WGPeerStats
+
+ORPHAN_KEY = "ZIhu8Hqb4qMDBOCXi/wEU7L4HlqX6R3JQ3GlSY41ikg="
+
+
+def xray_peer(peer_id: int, status: PeerStatusChoices) -> XrayPeer:
+    return XrayPeer(
+        id=peer_id,
+        peer_id=peer_id,
+        user_id=1,
+        peer_name=f"xray_{peer_id}",
+        peer_type=ProtocolType.XRAY,
+        peer_status=status,
+        inbound_id=1,
+        flow="xtls-rprx-vision"
+    )
+
+def interface_state(public_key: str, allowed_ips: str) -> WGPeerStats:
+    return WGPeerStats(public_key, None, None, 0, 0, (allowed_ips,))
+
+def test_compute_plan(wg_hub: WGHub, default_peers: dict[str, WireguardPeer]):
+    enabled = default_peers["iamuser_0"]
+    blocked = default_peers["iamuser_1"].model_copy(update={"peer_status": PeerStatusChoices.STATUS_BLOCKED})
+    missing = default_peers["otheruser_2"]
+    config = wg_hub.wgconfig
+    config.add_peer(ORPHAN_KEY, "# orphan")
+    config.add_attr(ORPHAN_KEY, "AllowedIPs", "10.0.0.9/32")
+    interface = {
+        enabled.public_key: interface_state(enabled.public_key, "10.0.0.2/32"),
+        blocked.public_key: interface_state(blocked.public_key, "10.0.0.3/32"),
+        ORPHAN_KEY: interface_state(ORPHAN_KEY, "10.0.0.9/32"),
+    }
+    xray_missing = xray_peer(10, PeerStatusChoices.STATUS_CONNECTED)
+    xray_blocked = xray_peer(11, PeerStatusChoices.STATUS_TIME_EXPIRED)
+    xray_clients = {"11": (1, True), "99": (1, True), "6f1c3a52-manual": (1, True)}
+
+    plan = compute_plan([enabled, blocked, missing], [xray_missing, xray_blocked], config, interface, xray_clients)
+
+    assert plan.config_upsert == [missing]
+    assert plan.config_remove == [ORPHAN_KEY]
+    assert plan.config_enable == []
+    assert plan.config_disable == [blocked.public_key]
+    assert sorted(plan.interface_sync) == sorted([blocked.public_key, missing.public_key, ORPHAN_KEY])
+    assert plan.xray_add == [xray_missing]
+    assert plan.xray_disable == [xray_blocked]
+    # clients that weren't created by the bot are left alone
+    assert plan.xray_remove == [(1, "99")]
+    assert plan.unavailable == []
+
+    plan = compute_plan([enabled], [], config, None, None)
+    assert plan.interface_sync == []
+    assert plan.unavailable == ["interface", "xray"]
+
+@pytest.mark.asyncio
+async def test_apply_plan(wg_hub: WGHub, default_peers: dict[str, WireguardPeer]):
+    blocked = default_peers["iamuser_1"].model_copy(update={"peer_status": PeerStatusChoices.STATUS_BLOCKED})
+    peers = [default_peers["iamuser_0"], blocked, default_peers["otheruser_2"]]
+    xray = AsyncMock()
+    xray.get_inbound_clients.return_value = {"99": (1, False)}
+    reconciler = Reconciler(wg_hub, xray, [1])
+
+    with patch("core.db.async_db.AsyncClientFactory.select_clients_with_peers",
+               AsyncMock(return_value=[(None, peers)])), \
+            patch.object(wg_hub, "get_peer_stats", side_effect=OSError("wg not found")):
+        plan = await reconciler.plan()
+        assert plan.config_changes == 2
+        assert plan.unavailable == ["interface"]
+
+        with patch.object(wg_hub, "submit", wraps=wg_hub.submit) as submit:
+            await reconciler.apply(plan)
+        submit.assert_called_once()
+        assert set(submit.call_args.args[1]) == {blocked.public_key, default_peers["otheruser_2"].public_key}
+        xray.delete_client.assert_called_once_with(1, "99")
+
+        xray.get_inbound_clients.return_value = {}
+        assert (await reconciler.plan()).is_empty
+
+    config = WGConfig(wg_hub.path)
+    config.read_file()
+    assert config.get_peer_enabled(blocked.public_key) is False
+    assert config.get_peer_name(default_peers["otheruser_2"].public_key) == default_peers["otheruser_2"].peer_name
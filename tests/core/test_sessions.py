@@ -0,0 +1,62 @@
+import datetime
+
+from core.db.db_works import ClientFactory
+from core.db.enums import PeerStatusChoices
+from core.db.models import PeerSessionModel, PeerSessionRollupModel
+from core.db.sessions import SessionWriter, compact_sessions
+
+
+def add_peer(client, default_peers, name="iamuser_0"):
+    return client.add_wireguard_peer(**default_peers[name].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+
+def test_writer_appends_finished_sessions(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    peer = add_peer(client, default_peers)
+    start = datetime.datetime(2030, 1, 1, 12, 0)
+
+    writer = SessionWriter()
+    writer.open(peer.peer_id, at=start)
+    writer.open(peer.peer_id, at=start + datetime.timedelta(minutes=5))
+    assert writer.close(peer.peer_id, PeerStatusChoices.STATUS_TIME_EXPIRED, at=start + datetime.timedelta(hours=1))
+    assert not writer.close(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
+    # sessions of deleted peers are skipped
+    writer.open(999, at=start)
+    writer.close(999, PeerStatusChoices.STATUS_DISCONNECTED, at=start + datetime.timedelta(hours=1))
+
+    assert writer.flush() == 2
+    assert writer.pending == 0
+    assert list(PeerSessionModel.select(
+        PeerSessionModel.peer,
+        PeerSessionModel.started_at,
+        PeerSessionModel.ended_at,
+        PeerSessionModel.end_status
+    ).tuples()) == [
+        (peer.peer_id, start, start + datetime.timedelta(hours=1), PeerStatusChoices.STATUS_TIME_EXPIRED.value)
+    ]
+
+def test_compaction_keeps_online_time(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    peer = add_peer(client, default_peers)
+    day = datetime.datetime(2030, 1, 1)
+
+    writer = SessionWriter()
+    for hour in (1, 5, 30):
+        writer.open(peer.peer_id, at=day + datetime.timedelta(hours=hour))
+        writer.close(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED, at=day + datetime.timedelta(hours=hour, minutes=30))
+    writer.flush()
+    writer.open(peer.peer_id, at=day + datetime.timedelta(hours=40))
+
+    until = day + datetime.timedelta(hours=41)
+    assert writer.get_online_time(peer.peer_id, since=day, until=until) == datetime.timedelta(hours=2, minutes=30)
+
+    assert compact_sessions(before=day + datetime.timedelta(days=1)) == 2
+    assert compact_sessions(before=day + datetime.timedelta(days=1)) == 0
+    assert PeerSessionModel.select().count() == 1
+    assert list(PeerSessionRollupModel.select(
+        PeerSessionRollupModel.day,
+        PeerSessionRollupModel.sessions,
+        PeerSessionRollupModel.online_seconds
+    ).tuples()) == [(day.date(), 2, 3600)]
+    assert writer.get_online_time(peer.peer_id, since=day, until=until) == datetime.timedelta(hours=2, minutes=30)
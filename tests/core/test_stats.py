@@ -0,0 +1,64 @@
+from core.db.db_works import ClientFactory
+from core.db.enums import ClientStatusChoices, PeerStatusChoices, ProtocolType
+from core.db.models import UserModel
+from core.db.stats import ServiceStats, service_stats
+from core.db.write_buffer import StatusWriteBuffer
+
+
+def add_peer(client, default_peers, name="iamuser_0"):
+    return client.add_wireguard_peer(**default_peers[name].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+
+def test_updates_are_ignored_until_loaded(db):
+    stats = ServiceStats()
+    stats.set_client_status(123, ClientStatusChoices.STATUS_CONNECTED)
+
+    assert stats.snapshot().total_clients == 0
+    assert stats.reconcile() is False
+    assert stats.is_loaded
+
+def test_counters_follow_status_changes(db, default_peers):
+    service_stats.load()
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    ClientFactory(user_id=456).get_or_create_client(name="iamuser2")
+    first = add_peer(client, default_peers, "iamuser_0")
+    second = add_peer(client, default_peers, "iamuser_1")
+
+    client.set_status(ClientStatusChoices.STATUS_CONNECTED)
+    client.set_peer_status(first.peer_id, PeerStatusChoices.STATUS_BLOCKED)
+    buffer = StatusWriteBuffer()
+    buffer.set_peer_status(second.peer_id, PeerStatusChoices.STATUS_CONNECTED)
+    buffer.flush()
+
+    snapshot = service_stats.snapshot()
+    assert snapshot.clients_by_status == {
+        ClientStatusChoices.STATUS_CREATED: 1,
+        ClientStatusChoices.STATUS_CONNECTED: 1
+    }
+    assert snapshot.peers_by_status == {
+        PeerStatusChoices.STATUS_BLOCKED: 1,
+        PeerStatusChoices.STATUS_CONNECTED: 1
+    }
+    assert snapshot.peers_by_protocol == {ProtocolType.WIREGUARD: 2}
+    assert service_stats.reconcile() is True
+
+    ClientFactory.delete_peer_by_id(first.peer_id)
+    client.delete_peers()
+    ClientFactory.delete_client_by_id(456)
+
+    snapshot = service_stats.snapshot()
+    assert snapshot.clients_by_status == {ClientStatusChoices.STATUS_CONNECTED: 1}
+    assert snapshot.total_peers == 0
+    assert service_stats.reconcile() is True
+
+def test_reconcile_fixes_drift(db):
+    ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    service_stats.load()
+
+    # a write that bypasses the status-change paths
+    UserModel.update(status=ClientStatusChoices.STATUS_ACCOUNT_BLOCKED.value).execute()
+
+    assert service_stats.reconcile() is False
+    assert service_stats.snapshot().clients_by_status == {ClientStatusChoices.STATUS_ACCOUNT_BLOCKED: 1}
+    assert service_stats.reconcile() is True
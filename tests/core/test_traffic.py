@@ -0,0 +1,73 @@
+import datetime
+import time
+
+from core.db.db_works import ClientFactory
+from core.db.models import PeerTrafficModel
+from core.db.traffic import TrafficAccounting, TrafficRing, TrafficUsage
+
+DAY = datetime.datetime(2030, 1, 1, 12, 0).timestamp()
+
+
+def add_peer(client, default_peers, name):
+    return client.add_wireguard_peer(**default_peers[name].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+
+def test_ring_drops_old_slots():
+    ring = TrafficRing(size=4, slot=10)
+    ring.add(10, 1, 10)
+    ring.add(11, 2, 20)
+    assert ring.total(0, 11) == TrafficUsage(3, 30)
+
+    # slots 12..14 are skipped, slot 10 falls out of the ring
+    ring.add(15, 4, 40)
+    assert ring.total(0, 15) == TrafficUsage(4, 40)
+    assert ring.total(0, 14) == TrafficUsage(0, 0)
+    # samples older than the ring are ignored
+    ring.add(11, 100, 100)
+    assert ring.total(0, 15) == TrafficUsage(4, 40)
+
+def test_deltas_and_counter_resets():
+    traffic = TrafficAccounting(slot_seconds=60, slots=60)
+    start = time.time() - 600
+    # the first sample is a baseline
+    assert len(traffic.record([(1, 1000, 5000)], at=start)) == 0
+    assert len(traffic.record([(1, 1500, 7000)], at=start + 60)) == 1
+    # the interface was restarted, counters started from zero
+    assert len(traffic.record([(1, 300, 200)], at=start + 120)) == 1
+    assert len(traffic.record([(1, 300, 200)], at=start + 180)) == 0
+
+    assert traffic.get_recent_usage([1]) == TrafficUsage(800, 2200)
+    assert traffic.get_recent_usage([1], seconds=120) == TrafficUsage(0, 0)
+    assert traffic.get_recent_usage([2]) == TrafficUsage(0, 0)
+
+    # forgotten peers start from a new baseline
+    traffic.retain([])
+    assert len(traffic.record([(1, 400, 300)], at=start + 240)) == 0
+    assert traffic.get_recent_usage([1]) == TrafficUsage(0, 0)
+
+def test_flush_and_top_users(db, default_peers):
+    first, _ = ClientFactory(user_id=1).get_or_create_client(name="first")
+    second, _ = ClientFactory(user_id=2).get_or_create_client(name="second")
+    first_peer = add_peer(first, default_peers, "iamuser_0")
+    second_peer = add_peer(second, default_peers, "otheruser_2")
+    day = datetime.date.fromtimestamp(DAY)
+
+    traffic = TrafficAccounting()
+    traffic.record([(first_peer.peer_id, 0, 0), (second_peer.peer_id, 0, 0), (999, 0, 0)], at=DAY)
+    traffic.record([(first_peer.peer_id, 100, 1000), (second_peer.peer_id, 10, 10), (999, 1, 1)], at=DAY + 60)
+    assert traffic.flush() == 3
+    traffic.record([(first_peer.peer_id, 200, 2000)], at=DAY + 120)
+
+    # the row of the deleted peer is skipped, pending totals are counted
+    assert PeerTrafficModel.select().count() == 2
+    assert traffic.get_usage([first_peer.peer_id], since=day) == TrafficUsage(200, 2000)
+    assert traffic.get_usage([first_peer.peer_id], since=day + datetime.timedelta(days=1)) == TrafficUsage(0, 0)
+
+    top = traffic.top_users(since=day)
+    assert traffic.pending == 0
+    assert [(user.user_id, user.name, user.usage) for user in top] == [
+        ("1", "first", TrafficUsage(200, 2000)),
+        ("2", "second", TrafficUsage(10, 10)),
+    ]
+    assert traffic.top_users(since=day, limit=1)[0].user_id == "1"
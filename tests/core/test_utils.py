@@ -1,10 +1,13 @@
+import time
 from datetime import timedelta
 
 import pytest
 
+from core.utils.circuit_breaker import BreakerState, CircuitBreaker
 from core.utils.date_utils import parse_time
 from core.utils.ip_utils import (IPQueue, check_ip_address,
-                                 generate_ip_addresses, get_ip_prefix)
+                                 generate_ip_addresses, get_ip_prefix,
+                                 ip_to_int, parse_ipv4_interface)
 
 
 def test_parse_time():
@@ -32,6 +35,13 @@ def test_get_ip_prefix():
     assert get_ip_prefix("192.168.1.1") == "192.168.1"
     assert get_ip_prefix("10.0.0.1") == "10.0.0"
 
+def test_parse_ipv4_interface():
+    assert parse_ipv4_interface("10.0.0.2") == (167772162, 32)
+    assert parse_ipv4_interface("10.0.0.2/24, fd00::2/128") == (167772162, 24)
+    assert parse_ipv4_interface("fd00::2/128") is None
+    assert parse_ipv4_interface("invalid") is None
+    assert ip_to_int("10.0.0.2/32") == ip_to_int("10.0.0.2") == 167772162
+
 def test_ip_queue():
     ip_list = ["192.168.1.1", "192.168.1.2"]
     queue = IPQueue(ip_list)
@@ -48,3 +58,25 @@ def test_ip_queue_empty():
     queue = IPQueue([])
     with pytest.raises(Exception, match="No IP addresses available"):
         queue.get_ip()
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker("service", failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure("timeout")
+    assert breaker.allow() and breaker.state == BreakerState.CLOSED
+
+    breaker.record_failure("timeout")
+    assert breaker.state == BreakerState.OPEN and not breaker.allow()
+    assert breaker.trips == 1 and breaker.last_error == "timeout"
+
+    time.sleep(0.06)
+    # a single trial call at a time
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure("refused")
+    assert breaker.state == BreakerState.OPEN and breaker.trips == 2
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == BreakerState.CLOSED and breaker.failures == 0
@@ -1,9 +1,14 @@
+import datetime
+import time
 from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
 
-from core.db.enums import ClientStatusChoices, PeerStatusChoices
-from core.watchdog.events import ConnectionEvents
+from core.db.db_works import ClientFactory
+from core.db.enums import ClientStatusChoices, PeerStatusChoices, ProtocolType
+from core.db.model_serializer import XrayPeer
+from core.watchdog.events import ConnectionEvents, IntervalEvents
+from core.wg.wg_work import WGPeerStats
 
 
 @pytest.fixture
@@ -16,6 +21,7 @@ async def test_emit_connect(connection_events: ConnectionEvents):
 
     client = Mock()
     client.userdata = Mock()
+    client.userdata.user_id = 1
 
     peer = Mock()
     peer.peer_id = 1
@@ -25,29 +31,38 @@ async def test_emit_connect(connection_events: ConnectionEvents):
     await connection_events.emit_connect(client, peer)
 
     triggered_func.assert_called_once_with(client, peer)
-    client.set_peer_status.assert_called_once_with(peer.peer_id, PeerStatusChoices.STATUS_CONNECTED)
-    client.set_status.assert_called_once_with(ClientStatusChoices.STATUS_CONNECTED)
+    assert connection_events.status_buffer.pending_peer_statuses == {peer.peer_id: PeerStatusChoices.STATUS_CONNECTED}
+    assert peer.peer_id in connection_events.status_buffer.pending_peer_timers
+    assert connection_events.status_buffer.pending_client_statuses == {"1": ClientStatusChoices.STATUS_CONNECTED}
+    client.set_peer_status.assert_not_called()
+    client.set_status.assert_not_called()
 
     assert peer.peer_status == PeerStatusChoices.STATUS_CONNECTED
+    assert client.userdata.status == ClientStatusChoices.STATUS_CONNECTED
+    assert peer.peer_id in connection_events.session_writer.open_sessions
 
 @pytest.mark.asyncio
 async def test_emit_disconnect(connection_events: ConnectionEvents):
     triggered_func = AsyncMock()
 
     client = Mock()
-    client.get_connected_peers.return_value = []
     client.userdata = Mock()
+    client.userdata.user_id = 1
 
     peer = Mock()
     peer.peer_id = 1
     peer.peer_status = PeerStatusChoices.STATUS_CONNECTED
+    connection_events.clients = [(client, [peer])]
 
     connection_events.disconnected.register(triggered_func)
     await connection_events.emit_disconnect(client, peer)
 
     triggered_func.assert_called_once_with(client, peer)
-    client.set_peer_status.assert_called_once_with(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
-    client.set_status.assert_called_once_with(ClientStatusChoices.STATUS_DISCONNECTED)
+    assert connection_events.status_buffer.pending_peer_statuses == {peer.peer_id: PeerStatusChoices.STATUS_DISCONNECTED}
+    assert connection_events.status_buffer.pending_client_statuses == {"1": ClientStatusChoices.STATUS_DISCONNECTED}
+    client.get_connected_peers.assert_not_called()
+    # the session was opened before the observer started, so there's nothing to close
+    assert connection_events.session_writer.pending == 0
 
     assert peer.peer_status == PeerStatusChoices.STATUS_DISCONNECTED
 
@@ -56,40 +71,172 @@ async def test_emit_disconnect_with_connected_peers(connection_events: Connectio
     triggered_func = AsyncMock()
 
     client = Mock()
-    client.get_connected_peers.return_value = [Mock()]
     client.userdata = Mock()
+    client.userdata.user_id = 1
 
     peer = Mock()
     peer.peer_id = 1
     peer.peer_status = PeerStatusChoices.STATUS_CONNECTED
+    other_peer = Mock()
+    other_peer.peer_id = 2
+    other_peer.peer_status = PeerStatusChoices.STATUS_CONNECTED
+    connection_events.clients = [(client, [peer, other_peer])]
 
     connection_events.disconnected.register(triggered_func)
     await connection_events.emit_disconnect(client, peer)
 
     triggered_func.assert_called_once_with(client, peer)
-    client.set_peer_status.assert_called_once_with(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
-    client.set_status.assert_not_called()
+    assert connection_events.status_buffer.pending_peer_statuses == {peer.peer_id: PeerStatusChoices.STATUS_DISCONNECTED}
+    assert connection_events.status_buffer.pending_client_statuses == {}
 
     assert peer.peer_status == PeerStatusChoices.STATUS_DISCONNECTED
 
+@pytest.mark.asyncio
+async def test_emit_disconnect_untracked_client(connection_events: ConnectionEvents):
+    client = Mock()
+    client.get_connected_peers = AsyncMock(return_value=[Mock()])
+    client.userdata = Mock()
+    client.userdata.user_id = 1
+
+    peer = Mock()
+    peer.peer_id = 1
+    peer.peer_status = PeerStatusChoices.STATUS_CONNECTED
+
+    await connection_events.emit_disconnect(client, peer)
+
+    # pending changes are written before falling back to the database
+    client.get_connected_peers.assert_called_once()
+    assert connection_events.status_buffer.pending == 0
+
 @pytest.mark.asyncio
 async def test_emit_timeout(connection_events: ConnectionEvents):
     triggered_func = AsyncMock()
 
     client = Mock()
     client.userdata = Mock()
-    client.get_connected_peers.return_value = []
+    client.userdata.user_id = 1
 
     peer = Mock()
     peer.peer_id = 1
     peer.peer_status = PeerStatusChoices.STATUS_CONNECTED
+    connection_events.clients = [(client, [peer])]
 
     connection_events.disconnected.register(triggered_func)
     with patch("core.wg.wg_work.WGHub.disable_peer"):
         await connection_events.emit_timeout_disconnect(client, peer)
 
     triggered_func.assert_called_once_with(client, peer)
-    client.set_peer_status.assert_called_once_with(peer.peer_id, PeerStatusChoices.STATUS_TIME_EXPIRED)
-    client.set_status.assert_called_once_with(ClientStatusChoices.STATUS_TIME_EXPIRED)
+    assert connection_events.status_buffer.pending_peer_statuses == {peer.peer_id: PeerStatusChoices.STATUS_TIME_EXPIRED}
+    assert connection_events.status_buffer.pending_client_statuses == {"1": ClientStatusChoices.STATUS_TIME_EXPIRED}
 
     assert peer.peer_status == PeerStatusChoices.STATUS_TIME_EXPIRED
+
+@pytest.mark.asyncio
+async def test_check_users_expire_date(db, wg_hub, xray_worker):
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    ClientFactory(user_id=1).get_or_create_client(name="expired", expire_time=today - datetime.timedelta(days=1))
+    ClientFactory(user_id=2).get_or_create_client(name="expiring", expire_time=today + datetime.timedelta(days=1, hours=1))
+    ClientFactory(user_id=3).get_or_create_client(name="paid", expire_time=today + datetime.timedelta(days=30))
+
+    interval_events = IntervalEvents(wg_hub, xray_worker)
+    blocked, warned = AsyncMock(), AsyncMock()
+    interval_events.expire_date_block_observer.register(blocked)
+    interval_events.expire_date_warning_observer.register(warned)
+
+    with patch("core.watchdog.events.disable_clients_peers") as disable_clients_peers:
+        await interval_events._IntervalEvents__check_users_expire_date()
+
+    assert [call.args[0].userdata.user_id for call in blocked.call_args_list] == ["1"]
+    assert [call.args[0].userdata.user_id for call in warned.call_args_list] == ["2"]
+    # peers of all blocked users are disabled in one batch
+    disable_clients_peers.assert_called_once()
+    assert [client.userdata.user_id for client, _ in disable_clients_peers.call_args.args[2]] == ["1"]
+    assert ClientFactory(user_id=1).get_client().userdata.status == ClientStatusChoices.STATUS_ACCOUNT_BLOCKED
+
+@pytest.mark.asyncio
+async def test_handshake_detection(connection_events: ConnectionEvents, default_peers):
+    now = int(time.time())
+    peers = [default_peers[name].model_copy() for name in ("iamuser_0", "iamuser_1", "otheruser_2")]
+    fresh, idle, missing = peers
+    idle.peer_status = PeerStatusChoices.STATUS_CONNECTED
+    missing.peer_status = PeerStatusChoices.STATUS_CONNECTED
+
+    client = Mock()
+    client.userdata = Mock()
+    client.userdata.user_id = 1
+    client.userdata.status = ClientStatusChoices.STATUS_CONNECTED
+    connection_events.clients = [(client, peers)]
+
+    stats = {
+        fresh.public_key: WGPeerStats(fresh.public_key, "1.2.3.4:5678", now - 10, 100, 100),
+        idle.public_key: WGPeerStats(idle.public_key, "1.2.3.4:5679", now - 600, 100, 100),
+    }
+    with patch.object(connection_events.wghub, "get_peer_stats", return_value=stats) as get_peer_stats, \
+         patch("core.watchdog.events.async_ping") as async_ping:
+        await connection_events.run_check_connections()
+        assert [peer.peer_status for peer in peers] == [PeerStatusChoices.STATUS_CONNECTED] + \
+            [PeerStatusChoices.STATUS_DISCONNECTED] * 2
+
+        # received bytes keep an old handshake connected
+        stats[idle.public_key] = stats[idle.public_key]._replace(transfer_rx=200)
+        await connection_events.run_check_connections()
+        assert idle.peer_status == PeerStatusChoices.STATUS_CONNECTED
+
+    assert get_peer_stats.call_count == 2
+    async_ping.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_handshake_detection_falls_back_to_icmp(connection_events: ConnectionEvents, default_peers):
+    peer = default_peers["iamuser_0"].model_copy()
+    client = Mock()
+    client.userdata = Mock()
+    client.userdata.user_id = 1
+    client.userdata.status = ClientStatusChoices.STATUS_DISCONNECTED
+    connection_events.clients = [(client, [peer])]
+
+    with patch.object(connection_events.wghub, "get_peer_stats", side_effect=FileNotFoundError("wg")), \
+         patch("core.watchdog.events.async_ping", AsyncMock(return_value=Mock(is_alive=True))) as async_ping:
+        await connection_events.run_check_connections()
+
+    async_ping.assert_called_once_with(peer.shared_ips)
+    assert peer.peer_status == PeerStatusChoices.STATUS_CONNECTED
+
+@pytest.mark.asyncio
+async def test_sample_traffic(connection_events: ConnectionEvents, default_peers):
+    peer = default_peers["iamuser_0"]
+    client = Mock()
+    client.userdata = Mock()
+    client.userdata.user_id = 1
+    connection_events.clients = [(client, [peer])]
+
+    def stats(rx: int, tx: int) -> dict[str, WGPeerStats]:
+        return {peer.public_key: WGPeerStats(peer.public_key, None, None, rx, tx), "unknown=": WGPeerStats("unknown=", None, None, 1, 1)}
+
+    with patch.object(connection_events.wghub, "get_peer_stats", side_effect=[stats(100, 100), stats(150, 400)]):
+        assert await connection_events.sample_traffic() == 0
+        assert await connection_events.sample_traffic() == 1
+
+    assert connection_events.traffic.get_recent_usage([peer.peer_id]) == (50, 300)
+
+@pytest.mark.asyncio
+async def test_xray_online_snapshot(connection_events: ConnectionEvents):
+    peers = [
+        XrayPeer(id=i, peer_id=i, user_id=1, peer_name=f"xray_{i}", peer_type=ProtocolType.XRAY,
+                 peer_status=PeerStatusChoices.STATUS_DISCONNECTED, inbound_id=1, flow="")
+        for i in range(5)
+    ]
+    client = Mock()
+    client.userdata = Mock()
+    client.userdata.user_id = 1
+    client.userdata.status = ClientStatusChoices.STATUS_CONNECTED
+    connection_events.clients = [(client, peers)]
+
+    with patch.object(connection_events.xray.panel, "online", AsyncMock(return_value=["xray_1", "xray_3"])) as online:
+        await connection_events.run_check_connections()
+
+    online.assert_awaited_once()
+    assert [peer.peer_status for peer in peers] == [
+        PeerStatusChoices.STATUS_DISCONNECTED, PeerStatusChoices.STATUS_CONNECTED,
+        PeerStatusChoices.STATUS_DISCONNECTED, PeerStatusChoices.STATUS_CONNECTED,
+        PeerStatusChoices.STATUS_DISCONNECTED
+    ]
@@ -0,0 +1,86 @@
+import pytest
+
+from core.wg.wg_config import WGConfig
+
+CONFIG = """# managed by heavens-gate
+[Interface]
+Address = 10.0.0.1/24, ffff:ffff:ffff:ffff::1/64
+ListenPort = 12345
+PrivateKey = +HBpjH+3M0/CFRGjoi5uKy6okJRzHo87X0XP+37hUFw=
+MTU=1500
+
+# iamuser_0
+[Peer]
+PublicKey = fDW0TEh64L1qlcuNF5dSSRIhxImrCBECje2r2vXBcXI=
+PresharedKey = OGsOqOc7uoHW2DkXoZzwVxpwaSTNxQeyXZ9ukc58rgE=
+AllowedIPs = 10.0.0.2/32 # first user
+
+#! # iamuser_1
+#! [Peer]
+#! PublicKey = Nts96aOJMVfQEZXt54q3MF1S7WVAGC/SDvpzN/mFXhw=
+#! PresharedKey = n3Fx4vZBLA6ps/Tw/s1GrVgM4oKKto4TU1ZuJBg1vao=
+#! AllowedIPs = 10.0.0.3/32
+"""
+FIRST_KEY = "fDW0TEh64L1qlcuNF5dSSRIhxImrCBECje2r2vXBcXI="
+SECOND_KEY = "Nts96aOJMVfQEZXt54q3MF1S7WVAGC/SDvpzN/mFXhw="
+
+
+@pytest.fixture
+def config(tmp_path) -> WGConfig:
+    path = tmp_path / "wg0.conf"
+    path.write_text(CONFIG)
+    config = WGConfig(str(path))
+    config.read_file()
+    return config
+
+
+def test_parse(config: WGConfig):
+    assert config.get_interface()["Address"] == ["10.0.0.1/24", "ffff:ffff:ffff:ffff::1/64"]
+    assert config.get_interface()["MTU"] == 1500
+    assert config.get_peers() == [FIRST_KEY]
+    assert config.get_peers(include_disabled=True) == [FIRST_KEY, SECOND_KEY]
+
+    assert config.get_peer(FIRST_KEY)["AllowedIPs"] == "10.0.0.2/32"
+    assert config.get_peer_name(FIRST_KEY) == "iamuser_0"
+    assert config.get_peer_enabled(FIRST_KEY) is True
+    assert config.get_peer_name(SECOND_KEY) == "iamuser_1"
+    assert config.get_peer_enabled(SECOND_KEY) is False
+
+
+def test_round_trip(config: WGConfig):
+    config.write_file()
+    with open(config.path) as file:
+        assert file.read() == CONFIG
+
+
+def test_changes_are_written(config: WGConfig):
+    config.disable_peer(FIRST_KEY)
+    config.enable_peer(SECOND_KEY)
+    config.add_peer("newkey=", "# new_user")
+    config.add_attr("newkey=", "AllowedIPs", "10.0.0.4/32")
+    config.add_attr("newkey=", "AllowedIPs", "fd00::4/128")
+    config.del_peer(SECOND_KEY)
+    config.write_file()
+
+    reread = WGConfig(config.path)
+    reread.read_file()
+    assert reread.get_peers(include_disabled=True) == [FIRST_KEY, "newkey="]
+    assert reread.get_peer_enabled(FIRST_KEY) is False
+    assert reread.get_peer("newkey=")["AllowedIPs"] == ["10.0.0.4/32", "fd00::4/128"]
+    assert reread.get_peer_name("newkey=") == "new_user"
+    with open(config.path) as file:
+        assert "#! # iamuser_0\n#! [Peer]\n" in file.read()
+
+
+def test_errors(config: WGConfig):
+    with pytest.raises(KeyError):
+        config.add_peer(FIRST_KEY)
+    with pytest.raises(KeyError):
+        config.get_peer("missing=")
+    with pytest.raises(KeyError):
+        config.del_peer("missing=")
+
+    with pytest.raises(ValueError):
+        config.read_from_fileobj(["[Interface]\n", "\n", "[Peer]\n", "AllowedIPs = 10.0.0.2/32\n"])
+    with pytest.raises(ValueError):
+        config.read_from_fileobj(CONFIG.replace(SECOND_KEY, FIRST_KEY).splitlines())
@@ -1,7 +1,14 @@
+import os
+import sys
+import time
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
 import pytest
 
 from core.db.model_serializer import WireguardPeer
-from core.wg.wg_work import WGHub
+from core.wg.wg_work import (WGCommandError, WGHub, WGPeerStats, parse_wg_dump,
+                             run_command)
 
 
 def test_disable_peer(wg_hub: WGHub, default_peers: dict[str, WireguardPeer]):
@@ -17,7 +24,7 @@ def test_add_peer(wg_hub: WGHub, default_peers: dict[str, WireguardPeer]):
     assert isinstance(wg_hub.wgconfig.get_peer(default_peers["otheruser_2"].public_key), dict)
 
     with pytest.raises(KeyError) as excinfo:
-        wg_hub.add_peer(default_peers["otheruser_2"])
+        wg_hub.add_peer(default_peers["otheruser_2"]).result()
 
 def test_delete_peer(wg_hub: WGHub, default_peers: dict[str, WireguardPeer]):
     wg_hub.delete_peer(default_peers["iamuser_0"])
@@ -25,4 +32,135 @@ def test_delete_peer(wg_hub: WGHub, default_peers: dict[str, WireguardPeer]):
         wg_hub.wgconfig.get_peer(default_peers["iamuser_0"].public_key)
 
     with pytest.raises(KeyError) as excinfo:
-        wg_hub.delete_peer(default_peers["iamuser_0"])
+        wg_hub.delete_peer(default_peers["iamuser_0"]).result()
+
+@pytest.mark.asyncio
+async def test_started_hub_writes_batch_once(wg_hub: WGHub, default_peers: dict[str, WireguardPeer]):
+    wg_hub.debounce = 0.2
+    wg_hub.start()
+    try:
+        with patch.object(wg_hub, "write_config", wraps=wg_hub.write_config) as write_config:
+            futures = [
+                wg_hub.disable_peers([default_peers["iamuser_0"], default_peers["iamuser_1"]]),
+                wg_hub.add_peer(default_peers["otheruser_2"]),
+                wg_hub.delete_peer(default_peers["otheruser_2"]),
+                wg_hub.delete_peer(default_peers["otheruser_2"]),
+            ]
+            await futures[0]
+            futures[1].result(timeout=1)
+            futures[2].result(timeout=1)
+            with pytest.raises(KeyError):
+                futures[3].result(timeout=1)
+
+        write_config.assert_called_once()
+    finally:
+        wg_hub.stop()
+
+    reread = WGHub(wg_hub.path, auto_sync=False)
+    assert reread.wgconfig.get_peer_enabled(default_peers["iamuser_0"].public_key) is False
+    assert reread.wgconfig.get_peer_enabled(default_peers["iamuser_1"].public_key) is False
+    with pytest.raises(KeyError):
+        reread.wgconfig.get_peer(default_peers["otheruser_2"].public_key)
+
+@pytest.fixture
+def wg_calls(tmp_path, monkeypatch) -> Path:
+    """Puts fake `wg` and `wg-quick` binaries on PATH. Returns the file their calls are logged to."""
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    log_path = tmp_path / "wg_calls.log"
+    for name, body in (("wg", ""), ("wg-quick", 'cat "$2"\n')):
+        script = bin_path / name
+        script.write_text(f'#!/bin/sh\necho "{name} $*" >> "{log_path}"\n{body}')
+        script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+    log_path.touch()
+    return log_path
+
+def logged_calls(wg_calls: Path) -> list[list[str]]:
+    return [line.split() for line in wg_calls.read_text().splitlines()]
+
+def test_incremental_sync_uses_wg_set(wg_hub: WGHub, wg_calls: Path, default_peers: dict[str, WireguardPeer]):
+    wg_hub.auto_sync = True
+    peer = default_peers["iamuser_0"]
+
+    wg_hub.disable_peer(peer).result()
+    wg_hub.enable_peer(peer).result()
+
+    removed, added = logged_calls(wg_calls)
+    assert removed == ["wg", "set", "wg0", "peer", peer.public_key, "remove"]
+    assert added[:5] == ["wg", "set", "wg0", "peer", peer.public_key]
+    assert added[5] == "preshared-key"
+    assert added[7:] == ["allowed-ips", "10.0.0.2/32"]
+    # without the hub's thread the file is written right away
+    assert WGHub(wg_hub.path, auto_sync=False).wgconfig.get_peer_enabled(peer.public_key) is True
+
+def test_full_sync_uses_syncconf(wg_hub: WGHub, wg_calls: Path, default_peers: dict[str, WireguardPeer]):
+    wg_hub.auto_sync = True
+    wg_hub.incremental_sync = False
+
+    wg_hub.disable_peer(default_peers["iamuser_0"]).result()
+
+    strip, syncconf = logged_calls(wg_calls)
+    assert strip == ["wg-quick", "strip", wg_hub.path]
+    assert syncconf[:3] == ["wg", "syncconf", "wg0"]
+
+def test_started_hub_persists_lazily(wg_hub: WGHub, wg_calls: Path, default_peers: dict[str, WireguardPeer]):
+    wg_hub.auto_sync = True
+    wg_hub.persist_delay = 60
+    wg_hub.start()
+    try:
+        for future in [wg_hub.disable_peer(default_peers["iamuser_0"]), wg_hub.disable_peer(default_peers["iamuser_1"])]:
+            future.result(timeout=1)
+
+        # both peers are removed by a single call, the file is not written yet
+        first, second = sorted([default_peers["iamuser_0"].public_key, default_peers["iamuser_1"].public_key])
+        assert logged_calls(wg_calls) == [["wg", "set", "wg0", "peer", first, "remove", "peer", second, "remove"]]
+        assert WGHub(wg_hub.path, auto_sync=False).wgconfig.get_peer_enabled(default_peers["iamuser_0"].public_key)
+    finally:
+        wg_hub.stop()
+
+    assert not WGHub(wg_hub.path, auto_sync=False).wgconfig.get_peer_enabled(default_peers["iamuser_0"].public_key)
+
+def test_periodic_full_sync(wg_hub: WGHub, wg_calls: Path):
+    wg_hub.auto_sync = True
+    wg_hub.full_sync_interval = 0.05
+    wg_hub.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not any(call[1] == "syncconf" for call in logged_calls(wg_calls)) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        wg_hub.stop()
+
+    assert any(call[1] == "syncconf" for call in logged_calls(wg_calls))
+
+def test_parse_wg_dump(default_peers: dict[str, WireguardPeer]):
+    first, second = default_peers["iamuser_0"], default_peers["iamuser_1"]
+    dump = "\n".join([
+        "serverprivate=\tserverpublic=\t51820\toff",
+        f"{first.public_key}\t{first.preshared_key}\t1.2.3.4:5678\t10.0.0.2/32\t1700000000\t1024\t2048\toff",
+        f"{second.public_key}\t(none)\t(none)\t10.0.0.3/32\t0\t0\t0\t25",
+    ])
+
+    peers = parse_wg_dump(dump)
+    assert peers[first.public_key] == WGPeerStats(first.public_key, "1.2.3.4:5678", 1700000000, 1024, 2048, ("10.0.0.2/32",))
+    assert peers[second.public_key] == WGPeerStats(second.public_key, None, None, 0, 0, ("10.0.0.3/32",))
+
+@pytest.mark.asyncio
+async def test_run_command():
+    assert await run_command([sys.executable, "-c", "import sys; print(sys.stdin.read())"], 5, stdin="ok") == "ok\n"
+
+    with pytest.raises(WGCommandError) as excinfo:
+        await run_command([sys.executable, "-c", "import sys; sys.exit('Unable to access interface')"], 5)
+    assert excinfo.value.returncode == 1
+    assert "Unable to access interface" in str(excinfo.value)
+
+    with pytest.raises(WGCommandError) as excinfo:
+        await run_command([sys.executable, "-c", "import time; time.sleep(10)"], 0.2)
+    assert excinfo.value.timed_out
+
+@pytest.mark.asyncio
+async def test_get_peer_stats(wg_hub: WGHub):
+    with patch("core.wg.wg_work.run_command", AsyncMock(return_value="interface\n")) as run:
+        assert await wg_hub.get_peer_stats() == {}
+    run.assert_awaited_once_with(["wg", "show", "wg0", "dump"], wg_hub.command_timeout)
@@ -0,0 +1,90 @@
+import datetime
+from unittest.mock import patch
+
+from core.db.db_works import ClientFactory
+from core.db.enums import ClientStatusChoices, PeerStatusChoices
+from core.db.write_buffer import StatusWriteBuffer
+
+
+def test_flush_writes_coalesced_statuses(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    peers = [
+        client.add_wireguard_peer(**default_peers[name].model_dump(include={
+            "shared_ips", "public_key", "private_key", "preshared_key"
+        }))
+        for name in ("iamuser_0", "iamuser_1")
+    ]
+    timer = datetime.datetime(2030, 1, 1, 12, 0)
+
+    buffer = StatusWriteBuffer()
+    for peer in peers:
+        buffer.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_CONNECTED)
+        buffer.set_peer_timer(peer.peer_id, timer)
+    buffer.set_peer_status(peers[1].peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
+    buffer.set_client_status(123, ClientStatusChoices.STATUS_CONNECTED)
+
+    assert buffer.pending == 5
+    assert buffer.flush() == 5
+    assert buffer.pending == 0
+
+    stored = {peer.peer_id: peer for peer in client.get_all_peers()}
+    assert stored[peers[0].peer_id].peer_status == PeerStatusChoices.STATUS_CONNECTED
+    assert stored[peers[1].peer_id].peer_status == PeerStatusChoices.STATUS_DISCONNECTED
+    assert all(peer.peer_timer == timer for peer in stored.values())
+    assert ClientFactory(user_id=123).get_client().userdata.status == ClientStatusChoices.STATUS_CONNECTED
+
+def test_flush_keeps_blocked_statuses(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    peer = client.add_wireguard_peer(**default_peers["iamuser_0"].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+
+    buffer = StatusWriteBuffer()
+    buffer.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_CONNECTED)
+    buffer.set_client_status(123, ClientStatusChoices.STATUS_CONNECTED)
+    # the admin bans the user before the buffer is flushed
+    client.set_status(ClientStatusChoices.STATUS_ACCOUNT_BLOCKED)
+    client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_BLOCKED)
+    buffer.flush()
+
+    assert client.get_all_peers()[0].peer_status == PeerStatusChoices.STATUS_BLOCKED
+    assert ClientFactory(user_id=123).get_client().userdata.status == ClientStatusChoices.STATUS_ACCOUNT_BLOCKED
+
+def test_direct_writes_supersede_buffered(db, default_peers):
+    client, _ = ClientFactory(user_id=123).get_or_create_client(name="iamuser")
+    peer = client.add_wireguard_peer(**default_peers["iamuser_0"].model_dump(include={
+        "shared_ips", "public_key", "private_key", "preshared_key"
+    }))
+    old_timer, new_timer = datetime.datetime(2030, 1, 1, 12, 0), datetime.datetime(2030, 1, 1, 17, 0)
+
+    buffer = StatusWriteBuffer()
+    buffer.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_TIME_EXPIRED)
+    buffer.set_peer_timer(peer.peer_id, old_timer)
+    buffer.set_client_status(123, ClientStatusChoices.STATUS_TIME_EXPIRED)
+    # the admin unblocks the user before the buffer is flushed
+    client.set_peer_status(peer.peer_id, PeerStatusChoices.STATUS_DISCONNECTED)
+    client.set_peer_timer(peer.peer_id, new_timer)
+    client.set_status(ClientStatusChoices.STATUS_DISCONNECTED)
+    assert buffer.pending == 0
+    buffer.flush()
+
+    stored = client.get_all_peers()[0]
+    assert stored.peer_status == PeerStatusChoices.STATUS_DISCONNECTED
+    assert stored.peer_timer == new_timer
+    assert ClientFactory(user_id=123).get_client().userdata.status == ClientStatusChoices.STATUS_DISCONNECTED
+
+def test_flush_requeues_on_failure(db):
+    buffer = StatusWriteBuffer()
+    buffer.set_peer_status(1, PeerStatusChoices.STATUS_CONNECTED)
+
+    with patch("core.db.write_buffer.db.atomic", side_effect=RuntimeError):
+        assert buffer.flush() == 0
+
+    assert buffer.pending_peer_statuses == {1: PeerStatusChoices.STATUS_CONNECTED}
+
+def test_buffer_flushes_when_full(db):
+    buffer = StatusWriteBuffer(max_pending=2)
+    buffer.set_peer_status(1, PeerStatusChoices.STATUS_CONNECTED)
+    assert buffer.pending == 1
+    buffer.set_peer_status(2, PeerStatusChoices.STATUS_CONNECTED)
+    assert buffer.pending == 0
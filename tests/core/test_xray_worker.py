@@ -0,0 +1,237 @@
+import asyncio
+import datetime
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+from core.db.enums import PeerStatusChoices, ProtocolType
+from core.db.model_serializer import XrayPeer
+from core.utils.circuit_breaker import BreakerState
+from core.utils.peers_utils import disable_clients_peers
+from core.xray.panel_client import PanelError, PanelUnavailable, XuiPanelClient
+from core.xray.xray_worker import XrayWorker
+
+
+def xray_peer(peer_id: int, status: PeerStatusChoices = PeerStatusChoices.STATUS_DISCONNECTED) -> XrayPeer:
+    return XrayPeer(id=peer_id, peer_id=peer_id, user_id=1, peer_name=f"xray_{peer_id}", peer_type=ProtocolType.XRAY,
+                    peer_status=status, inbound_id=1, flow="xtls-rprx-vision")
+
+def make_inbound(inbound_id: int = 1, port: int = 443) -> Mock:
+    inbound = Mock(id=inbound_id, port=port, remark="main")
+    inbound.stream_settings.reality_settings = {
+        "settings": {"publicKey": "pbk", "fingerprint": "chrome"},
+        "serverNames": ["example.com"],
+        "shortIds": ["abcd"],
+    }
+    return inbound
+
+@pytest.mark.asyncio
+async def test_peer_lifecycle(panel_xray_worker: XrayWorker, xui_panel):
+    peers = [xray_peer(1), xray_peer(2)]
+    expire_time = datetime.datetime(2030, 1, 1)
+
+    await panel_xray_worker.add_peers(1, peers, expire_time)
+    assert xui_panel.clients[1]["1"]["expiryTime"] == int(expire_time.timestamp() * 1000)
+    assert await panel_xray_worker.get_inbound_clients([1]) == {"1": (1, True), "2": (1, True)}
+
+    await panel_xray_worker.disable_peer(peers[0])
+    assert xui_panel.clients[1]["1"]["enable"] is False
+    await panel_xray_worker.delete_peer(peers[1])
+    assert list(xui_panel.clients[1]) == ["1"]
+
+    xui_panel.clients[1]["1"].update(up=10, down=20)
+    assert await panel_xray_worker.get_clients_traffic([1]) == {"xray_1": (10, 20)}
+    # every request reused the session of the first login
+    assert xui_panel.requests["login"] == 1
+
+@pytest.mark.asyncio
+async def test_relogin_on_expired_session(panel_xray_worker: XrayWorker, xui_panel):
+    xui_panel.online = ["xray_1"]
+    assert await panel_xray_worker.is_connected(xray_peer(1))
+
+    xui_panel.expire_sessions()
+    await asyncio.gather(*(panel_xray_worker.get_inbound_clients([1]) for _ in range(5)))
+    assert xui_panel.requests["login"] == 2
+
+@pytest.mark.asyncio
+async def test_request_errors(panel_xray_worker: XrayWorker, xui_panel):
+    with pytest.raises(PanelError, match="rejected"):
+        await panel_xray_worker.get_inbound_clients([2])
+
+    panel_xray_worker.panel.timeout = 0.1
+    await panel_xray_worker.close()
+    xui_panel.delay = 0.5
+    with pytest.raises(PanelError, match="timed out"):
+        await panel_xray_worker.get_online_clients()
+
+@pytest.mark.asyncio
+async def test_online_clients_snapshot(panel_xray_worker: XrayWorker, xui_panel):
+    xui_panel.online = ["xray_1"]
+    assert await panel_xray_worker.get_online_clients() == {"xray_1"}
+    assert await panel_xray_worker.get_online_clients() == {"xray_1"}
+    assert xui_panel.requests["get_online"] == 1
+
+    xui_panel.online = ["xray_2"]
+    assert await panel_xray_worker.get_online_clients(max_age=0) == {"xray_2"}
+    assert xui_panel.requests["get_online"] == 2
+
+@pytest.mark.asyncio
+async def test_online_clients_shared_request(panel_xray_worker: XrayWorker, xui_panel):
+    xui_panel.online = ["xray_1"]
+    xui_panel.delay = 0.1
+    results = await asyncio.gather(*(panel_xray_worker.get_online_clients() for _ in range(8)))
+
+    assert xui_panel.requests["get_online"] == 1
+    assert results == [frozenset({"xray_1"})] * 8
+
+@pytest.mark.asyncio
+async def test_connection_string_from_cached_inbound(panel_xray_worker: XrayWorker, xui_panel):
+    peer = xray_peer(7).model_copy(update={"peer_name": "my phone"})
+    panel_xray_worker.cache_inbound(make_inbound(port=8443))
+
+    assert await panel_xray_worker.get_connection_string(peer) == (
+        "vless://7@127.0.0.1:8443?type=tcp&security=reality&pbk=pbk&fp=chrome"
+        "&sni=example.com&sid=abcd&spx=%2F&flow=xtls-rprx-vision#main-my%20phone"
+    )
+    assert xui_panel.requests["get_inbound"] == 0
+
+    panel_xray_worker.invalidate_inbound(1)
+    assert (await panel_xray_worker.get_inbound_meta(1)).port == 443
+    assert xui_panel.requests["get_inbound"] == 1
+
+    # outdated settings are used if the panel can't be reached
+    panel_xray_worker.inbound_ttl = 0
+    xui_panel.expire_sessions()
+    xui_panel.PASSWORD = "changed"
+    assert (await panel_xray_worker.get_inbound_meta(1)).port == 443
+
+    panel_xray_worker.invalidate_inbound()
+    with pytest.raises(PanelError):
+        await panel_xray_worker.get_inbound_meta(1)
+
+@pytest.mark.asyncio
+async def test_batch_update(panel_xray_worker: XrayWorker, xui_panel):
+    xui_panel.clients[2] = {}
+    peers = [xray_peer(i) for i in range(1, 6)] + [xray_peer(6).model_copy(update={"inbound_id": 2})]
+    await panel_xray_worker.add_peers(1, peers[:5])
+    await panel_xray_worker.add_peers(2, peers[5:])
+    xui_panel.clients[1]["1"]["tgId"] = 42
+    expire_time = datetime.datetime(2030, 1, 1)
+
+    result = await panel_xray_worker.set_enabled_many(peers, False, expiry_time=expire_time)
+    assert result.updated == peers and result.failed == {}
+    assert all(not client["enable"] for inbound in xui_panel.clients.values() for client in inbound.values())
+    assert xui_panel.clients[2]["6"]["expiryTime"] == int(expire_time.timestamp() * 1000)
+    # fields the bot doesn't manage are kept
+    assert xui_panel.clients[1]["1"]["tgId"] == 42
+    # a read and a write per inbound instead of a request per peer
+    assert xui_panel.requests["get_inbound"] == 2
+    assert xui_panel.requests["update_inbound"] == 2
+    assert xui_panel.requests["update_client"] == 0
+
+@pytest.mark.asyncio
+async def test_disable_many_clients_keeps_expiry_times(panel_xray_worker: XrayWorker, xui_panel):
+    peers = [xray_peer(1), xray_peer(2).model_copy(update={"user_id": 2})]
+    await panel_xray_worker.add_peers(1, peers)
+    expire_times = [datetime.datetime(2030, 1, 1), datetime.datetime(2030, 2, 1)]
+    clients = [
+        (Mock(userdata=Mock(expire_time=expire_time), set_peer_status=AsyncMock()), [peer])
+        for expire_time, peer in zip(expire_times, peers)
+    ]
+
+    await disable_clients_peers(AsyncMock(), panel_xray_worker, clients)
+    for peer, expire_time in zip(peers, expire_times):
+        client = xui_panel.clients[1][str(peer.peer_id)]
+        assert client["enable"] is False
+        assert client["expiryTime"] == int(expire_time.timestamp() * 1000)
+    assert xui_panel.requests["update_inbound"] == 1
+
+@pytest.mark.asyncio
+async def test_batch_update_failures(panel_xray_worker: XrayWorker, xui_panel):
+    await panel_xray_worker.add_peers(1, [xray_peer(1)])
+    peers = [xray_peer(1, PeerStatusChoices.STATUS_BLOCKED), xray_peer(2),
+             xray_peer(3).model_copy(update={"inbound_id": 3})]
+
+    result = await panel_xray_worker.update_peers(peers)
+    assert result.updated == peers[:1]
+    assert result.failed[2] == "client not found in inbound 1"
+    assert "rejected" in result.failed[3]
+    assert xui_panel.clients[1]["1"]["enable"] is False
+    assert list(xui_panel.clients[1]) == ["1"]
+
+@pytest.mark.asyncio
+async def test_batch_update_malformed_inbound(panel_xray_worker: XrayWorker, xui_panel):
+    await panel_xray_worker.add_peers(1, [xray_peer(1)])
+    xui_panel.raw_inbounds = {2: None, 3: {"id": 3, "settings": "{not json"}, 4: {"id": 4, "settings": "[]"}}
+    peers = [xray_peer(1, PeerStatusChoices.STATUS_BLOCKED)] + [
+        xray_peer(inbound_id).model_copy(update={"inbound_id": inbound_id}) for inbound_id in (2, 3, 4)
+    ]
+
+    # a broken inbound fails only its own peers
+    result = await panel_xray_worker.update_peers(peers)
+    assert result.updated == peers[:1]
+    assert sorted(result.failed) == [2, 3, 4]
+    assert all("Malformed inbound" in error for error in result.failed.values())
+    assert xui_panel.requests["update_inbound"] == 1
+
+@pytest.mark.asyncio
+async def test_retries_and_circuit_breaker(panel_xray_worker: XrayWorker, xui_panel):
+    panel = panel_xray_worker.panel
+    panel.backoff = 0.01
+    panel.breaker.failure_threshold = 2
+    await panel.login()
+
+    # idempotent reads are retried
+    xui_panel.errors = 2
+    assert await panel_xray_worker.get_inbound_clients([1]) == {}
+    assert xui_panel.requests["get_inbound"] == 3
+
+    # writes are not
+    xui_panel.errors = 1
+    await panel_xray_worker.add_peers(1, [xray_peer(1)])
+    assert xui_panel.clients[1] == {} and xui_panel.requests["add_client"] == 1
+
+    assert panel.breaker.failures == 1
+
+    xui_panel.errors = 3
+    with pytest.raises(PanelError, match="HTTP 500"):
+        await panel_xray_worker.get_online_clients(max_age=0)
+    assert panel.breaker.state == BreakerState.OPEN
+    # no request reaches the panel while the breaker is open
+    with pytest.raises(PanelUnavailable):
+        await panel_xray_worker.get_inbound_clients([1])
+    assert xui_panel.requests["get_online"] == 3 and xui_panel.requests["get_inbound"] == 3
+
+    panel.breaker.reset_timeout = 0
+    xui_panel.online = ["xray_1"]
+    assert await panel_xray_worker.get_online_clients(max_age=0) == {"xray_1"}
+    assert panel.breaker.state == BreakerState.CLOSED
+
+@pytest.mark.asyncio
+async def test_session_refresh(panel_xray_worker: XrayWorker, xui_panel):
+    panel = panel_xray_worker.panel
+    assert panel.session_age is None
+    await panel_xray_worker.get_inbound_clients([1])
+    assert panel.session_age < 1
+
+    panel.session_ttl = 0
+    await asyncio.gather(*(panel_xray_worker.get_inbound_clients([1]) for _ in range(5)))
+    # the old cookie is renewed before the request, concurrent requests share the login
+    assert xui_panel.requests["login"] == 2
+    assert xui_panel.requests["get_inbound"] == 6
+
+def test_session_of_previous_loop_is_closed():
+    panel = XuiPanelClient("http://127.0.0.1:1", "user", "password")
+
+    async def get_session(close: bool = False):
+        session = panel._XuiPanelClient__get_session()
+        if close:
+            await panel.close()
+        return session
+
+    first = asyncio.run(get_session())
+    assert not first.closed
+    # a new loop, e.g. another `asyncio.run`, gets a new session and the old one doesn't leak
+    second = asyncio.run(get_session(close=True))
+    assert second is not first
+    assert first.closed and first.connector is None